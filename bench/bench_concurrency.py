@@ -0,0 +1,112 @@
+"""
+Benchmark delle scritture concorrenti (cambio turno) contro un server FTP locale
+(bench_suite.LocalFTP): --operators thread accodano righe ognuno sulla propria
+connessione mentre un amministratore salva modifiche nel journal e compatta.
+
+    append          latenza di un APPE (mediana e 95° percentile)
+    compattazione   durata di una compattazione con APPE in corso
+    righe perse     righe accodate che non si ritrovano nel CSV finale (deve essere 0)
+    modifiche perse modifiche salvate che non si ritrovano nel CSV finale (deve essere 0)
+
+    python bench/bench_concurrency.py [--rows 100000] [--operators 8] [--appends 20]
+                                      [--compactions 5] [--json out.json]
+
+Richiede pyftpdlib (solo per i benchmark).
+"""
+import argparse
+import io
+import json
+import statistics
+import threading
+import time
+
+import pandas as pd
+
+from bench_suite import LocalFTP, meta, reset_caches, use_server
+from prd.config import PRIMARY_DIR, REMOTE_FILE
+from prd.ftp import ftp_download_file
+from prd.store import append_rows_safe_via_ftp, compact_journal, save_row_changes
+from synth import make_csv
+
+
+def connect(server: LocalFTP):
+    ftp = server.connect()
+    ftp.cwd(PRIMARY_DIR)
+    return ftp
+
+
+def operator(server: LocalFTP, op: int, appends: int, lat: list, errors: list):
+    ftp = connect(server)
+    for i in range(appends):
+        row = {"Timestamp": f"BENCH-{op}-{i}", "OPERATORE": f"OP{op}", "DATA": "2025-01-15",
+               "CICLO_NR": 10_000_000 + op * 10_000 + i, "TEMPO_FASE_MIN": "0:10:00"}
+        t = time.perf_counter()
+        try:
+            append_rows_safe_via_ftp(ftp, REMOTE_FILE, [row])
+            lat.append(time.perf_counter() - t)
+        except Exception as e:
+            errors.append(f"append {op}/{i}: {e}")
+
+
+def admin(server: LocalFTP, ts: list[str], compactions: int, durations: list, errors: list):
+    ftp = connect(server)
+    for k in range(compactions):
+        try:
+            save_row_changes(ftp, REMOTE_FILE, [(k, ts[k], {"DESCRIZIONE": f"BENCH-EDIT-{k}"})])
+            t = time.perf_counter()
+            compact_journal(ftp, REMOTE_FILE)
+            durations.append(time.perf_counter() - t)
+        except Exception as e:
+            errors.append(f"compattazione {k}: {e}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--operators", type=int, default=8)
+    ap.add_argument("--appends", type=int, default=20, help="righe accodate da ogni operatore")
+    ap.add_argument("--compactions", type=int, default=5)
+    ap.add_argument("--json", help="scrive i risultati in questo file")
+    args = ap.parse_args()
+
+    raw = make_csv(args.rows, ";")
+    ts = pd.read_csv(io.BytesIO(raw), sep=";", dtype=str, usecols=["Timestamp"], nrows=args.compactions)["Timestamp"].tolist()
+    server = LocalFTP()
+    server.seed(raw)
+    use_server(server)
+    reset_caches()
+    lat, durations, errors = [], [], []
+    try:
+        threads = [threading.Thread(target=operator, args=(server, op, args.appends, lat, errors))
+                   for op in range(args.operators)]
+        threads.append(threading.Thread(target=admin, args=(server, ts, args.compactions, durations, errors)))
+        t = time.perf_counter()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        total = time.perf_counter() - t
+        final = pd.read_csv(io.BytesIO(ftp_download_file(connect(server), REMOTE_FILE)), sep=";", dtype=str,
+                            keep_default_na=False)
+    finally:
+        server.close()
+
+    expected = args.operators * args.appends
+    res = {
+        "rows": args.rows, "operators": args.operators, "totale_s": round(total, 3),
+        "append_mediana_s": statistics.median(lat) if lat else None,
+        "append_p95_s": statistics.quantiles(lat, n=20)[-1] if len(lat) >= 2 else None,
+        "compattazione_mediana_s": statistics.median(durations) if durations else None,
+        "righe_perse": expected - int(final["Timestamp"].str.startswith("BENCH-").sum()),
+        "modifiche_perse": len(durations) - int(final["DESCRIZIONE"].str.startswith("BENCH-EDIT-").sum()),
+        "errori": errors,
+    }
+    for k, v in res.items():
+        print(f"{k:<26}{v:.3f}" if isinstance(v, float) else f"{k:<26}{v}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "concurrency", "meta": meta(), "results": [res]}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark lettura del CSV di produzione: read_csv_bytes + type_frame (copiati qui
+com'erano) contro ingest_csv di prd.data. Verifica che il DataFrame tipizzato sia
+identico e misura tempo e picco di memoria (VmHWM) di ciascuna lettura in un
+processo separato, oltre ai byte grezzi già in memoria.
+
+    python bench/bench_ingest.py [--sizes 100000 1000000] [--json out.json]
+"""
+import argparse
+import io
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prd.data import ingest_csv, type_frame  # noqa: E402
+
+
+# ---------- versione precedente (riferimento) ----------
+def legacy_read(raw: bytes) -> pd.DataFrame:
+    head = raw.splitlines()[0].decode("utf-8", "ignore")
+    sep = ";" if head.count(";") >= head.count(",") else ","
+    try:
+        df = pd.read_csv(io.BytesIO(raw), sep=sep)
+    except Exception:
+        sep = "," if sep == ";" else ";"
+        df = pd.read_csv(io.BytesIO(raw), sep=sep)
+    df.columns = [c.strip() for c in df.columns]
+    return type_frame(df)
+
+def new_read(raw: bytes) -> pd.DataFrame:
+    return ingest_csv(raw)[0]
+
+
+# ---------- dati ----------
+def make_csv(n: int, seed: int = 0) -> bytes:
+    """CSV come lo scrive l'app (serialize_row), con qualche vuoto."""
+    rng = np.random.default_rng(seed)
+    ts = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 3 * 365 * 86400, n), unit="s")
+    df = pd.DataFrame({
+        "Timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+        "OPERATORE": rng.choice(["ALESSIO", "LUCA", "MICHELE", "VALERIO"], n),
+        "DATA": ts.strftime("%Y-%m-%d"),
+        "CODICE_MATERIALE": np.char.add("MAT-", rng.integers(0, 5000, n).astype(str)),
+        "DESCRIZIONE": rng.choice(["Flangia 80", "Albero, rettificato", "Supporto \"L\"", "Piastra"], n),
+        "CICLO_NR": np.arange(1, n + 1),
+        "MACCHINA": rng.choice(["DMG MORI", "TAKISAWA", "MAZAK VRX", "HURCO"], n),
+        "NUMERO_PRG": rng.choice(["P1", "P22", "", "O7731"], n),
+        "CARTELLA_MACCHINA": rng.choice(["WASS", "EL.EN", "DUMAREY", "VARIE"], n),
+        "FASE": rng.choice(["Fase 1", "Fase 2", "Preparazione"], n),
+        "TEMPO_FASE_MIN": [f"{h}:{m:02d}:00" for h, m in zip(rng.integers(0, 9, n), rng.integers(0, 60, n))],
+    })
+    return df.to_csv(sep=";", index=False, lineterminator="\n").encode("utf-8")
+
+
+EDGE_CASES = [
+    b"Timestamp;OPERATORE;DATA;CICLO_NR;TEMPO_FASE_MIN\n2024-01-01 10:00:00;LUCA;2024-01-01;1;45\n",
+    b"Timestamp,OPERATORE,DATA,CICLO_NR,TEMPO_FASE_MIN\r\n2024-01-01 10:00:00,LUCA,01/02/2024,,1:30:00\r\n",
+    b"Timestamp;OPERATORE;DESCRIZIONE;CICLO_NR\n2024-01-01;;\"a;b\";7\n\n2024-01-02;MICHELE;x;\n",
+    b"Timestamp;OPERATORE;DATA;CICLO_NR\n2024-01-01;LUCA;2024-01-01\n",   # campo mancante
+    b" Timestamp ; OPERATORE \n2024-01-01;LUCA\n",
+    b"Timestamp;OPERATORE\n",
+]
+
+def check_identical() -> int:
+    cases = EDGE_CASES + [make_csv(5000, seed=1)]
+    for raw in cases:
+        assert_frame_equal(new_read(raw), legacy_read(raw), check_dtype=len(legacy_read(raw)) > 0)
+    return len(cases)
+
+
+# ---------- misura in un processo separato ----------
+def _status_mb(field: str) -> float:
+    """VmRSS / VmHWM (picco) del processo in MB, da /proc (Linux)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+def _measure(kind: str, path: str, out):
+    with open(path, "rb") as f:
+        raw = f.read()
+    base = _status_mb("VmRSS")
+    t = time.perf_counter()
+    df = (new_read if kind == "nuova" else legacy_read)(raw)
+    elapsed = time.perf_counter() - t
+    out.put((elapsed, _status_mb("VmHWM") - base, df.memory_usage(deep=True).sum() / 2 ** 20))
+
+def measure(kind: str, path: str) -> tuple[float, float, float]:
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    p = ctx.Process(target=_measure, args=(kind, path, q))
+    p.start()
+    res = q.get()
+    p.join()
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    ap.add_argument("--json", help="scrive i risultati in questo file")
+    args = ap.parse_args()
+
+    print(f"output identico su {check_identical()} casi")
+    results = []
+    print(f"{'righe':>10}{'MB csv':>8}{'versione':>10}{'s':>8}{'picco MB':>10}{'frame MB':>10}")
+    for n in args.sizes:
+        raw = make_csv(n)
+        with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as f:
+            f.write(raw)
+        try:
+            for kind in ["prima", "nuova"]:
+                elapsed, peak, frame = measure(kind, f.name)
+                print(f"{n:>10}{len(raw) / 2 ** 20:>8.1f}{kind:>10}{elapsed:>8.2f}{peak:>10.0f}{frame:>10.0f}")
+                results.append({"rows": n, "csv_mb": len(raw) / 2 ** 20, "version": kind,
+                                "seconds": elapsed, "peak_mb": peak, "frame_mb": frame})
+        finally:
+            os.remove(f.name)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark normalize_time_columns: versione riga per riga (copiata qui com'era)
+contro quella vettoriale di prd.data. Verifica anche che l'output sia identico
+per tutte le forme di input accettate.
+
+    python bench/bench_normalize.py [--sizes 10000 100000 1000000] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prd.data import (minutes_to_hhmm, normalize_time_columns, parse_hhmmss_to_minutes,  # noqa: E402
+                      to_int_safe)
+
+
+# ---------- versione precedente (riferimento) ----------
+def legacy_normalize_time_columns(df: pd.DataFrame) -> pd.DataFrame:
+    u2orig = {c.upper().strip(): c for c in df.columns}
+    tmin = None
+
+    if "TEMPO_FASE_MIN" in u2orig:
+        c = u2orig["TEMPO_FASE_MIN"]
+        ser = df[c]
+        if ser.astype(str).str.contains(":").any():
+            tmin = ser.apply(parse_hhmmss_to_minutes).astype("Int64")
+        else:
+            tmin = pd.to_numeric(ser, errors="coerce").astype("Int64")
+
+    if tmin is None:
+        tempo_cols = [u2orig[u] for u in u2orig if "TEMPO" in u]
+        for c in tempo_cols:
+            ser = df[c].astype(str)
+            if ser.str.contains(":").any():
+                tmin = ser.apply(parse_hhmmss_to_minutes).astype("Int64")
+                break
+
+    if tmin is None and "ORE" in u2orig and "MINUTI" in u2orig:
+        h, m = u2orig["ORE"], u2orig["MINUTI"]
+        tmin = (df[h].apply(to_int_safe) * 60 + df[m].apply(to_int_safe)).astype("Int64")
+
+    if tmin is None:
+        df["TEMPO_FASE_MIN"] = pd.Series([pd.NA] * len(df), dtype="Int64")
+    else:
+        df["TEMPO_FASE_MIN"] = tmin
+
+    df["TEMPO_FASE (hh:mm)"] = df["TEMPO_FASE_MIN"].apply(minutes_to_hhmm)
+    return df
+
+
+# ---------- dati ----------
+def make_frame(shape: str, n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    mins = rng.integers(0, 600, n)
+    base = pd.DataFrame({"CICLO_NR": np.arange(n), "FASE": rng.choice(["Fase 1", "Fase 2", "Preparazione"], n)})
+    hhmmss = pd.Series([f"{m // 60}:{m % 60:02d}:00" for m in mins], dtype=object)
+    if shape == "hhmmss":
+        hhmmss[rng.random(n) < 0.01] = None
+        base["TEMPO_FASE_MIN"] = hhmmss
+    elif shape == "numeric":
+        base["TEMPO_FASE_MIN"] = pd.Series(mins.astype(str), dtype=object).where(rng.random(n) > 0.01, None)
+    elif shape == "mixed":
+        base["TEMPO_FASE_MIN"] = hhmmss.where(rng.random(n) > 0.3, pd.Series(mins.astype(str), dtype=object))
+    elif shape == "tempo_alt":
+        base["Tempo lavoro"] = pd.Series([f"{m // 60:02d}:{m % 60:02d}" for m in mins], dtype=object)
+    elif shape == "ore_minuti":
+        ore = pd.Series((mins // 60).astype(str), dtype=object)
+        ore[rng.random(n) < 0.05] = "1,5"
+        ore[rng.random(n) < 0.02] = ""
+        minuti = pd.Series((mins % 60).astype(float))
+        minuti[rng.random(n) < 0.02] = np.nan
+        minuti[rng.random(n) < 0.01] = -3
+        base["ORE"], base["MINUTI"] = ore, minuti
+    elif shape != "none":
+        raise ValueError(shape)
+    return base
+
+EDGE_CASES = [
+    pd.DataFrame({"TEMPO_FASE_MIN": ["1:30:00", " 2:05 ", "12:99", "abc", None, float("nan"), "999:59:59",
+                                     "1:2:3", "1:\n30", "١:٣٠", "", "0:00"]}),
+    pd.DataFrame({"TEMPO_FASE_MIN": ["90", "-5", None, "x", "3"]}),
+    pd.DataFrame({"TEMPO_FASE_MIN": [90, -5, None, 3]}),
+    pd.DataFrame({" tempo_fase_min ": ["0:45:00"], "Tempo lavoro": ["1:00"]}),
+    pd.DataFrame({"ORE": ["1_000", "infinity", "1e3", " 2,9 ", True, None, "-0.5", "7"],
+                  "MINUTI": [1, 2, 3, 4, 5, 6, 7, 8]}),
+    pd.DataFrame({"TEMPO": ["a", "b"], "ALTRO": [1, 2]}),
+    pd.DataFrame({"TEMPO_FASE_MIN": pd.Series([], dtype=object)}),
+    pd.DataFrame({"TEMPO_FASE_MIN": ["1:00"]}, index=[10]),
+]
+
+SHAPES = ["hhmmss", "numeric", "mixed", "tempo_alt", "ore_minuti", "none"]
+
+
+def check_identical():
+    frames = EDGE_CASES + [make_frame(s, 2000, seed=i) for i, s in enumerate(SHAPES)]
+    for df in frames:
+        # su un frame vuoto apply() lasciava la colonna hh:mm in Int64, ora è sempre object
+        assert_frame_equal(normalize_time_columns(df.copy()), legacy_normalize_time_columns(df.copy()),
+                           check_dtype=len(df) > 0)
+    return len(frames)
+
+
+def timeit(fn, df, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        d = df.copy()
+        t0 = time.perf_counter()
+        fn(d)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--shapes", nargs="+", default=SHAPES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="scrive i risultati in questo file")
+    args = ap.parse_args()
+
+    print(f"output identico su {check_identical()} casi")
+    results = []
+    print(f"{'forma':<11}{'righe':>10}{'prima (s)':>12}{'dopo (s)':>11}{'x':>8}")
+    for shape in args.shapes:
+        for n in args.sizes:
+            df = make_frame(shape, n)
+            old = timeit(legacy_normalize_time_columns, df, 1 if n >= 1_000_000 else args.repeat)
+            new = timeit(normalize_time_columns, df, args.repeat)
+            results.append({"shape": shape, "rows": n, "legacy_s": old, "vectorized_s": new, "speedup": old / new})
+            print(f"{shape:<11}{n:>10}{old:>12.3f}{new:>11.3f}{old / new:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "normalize_time_columns", "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark dell'avvio a freddo dell'app: ogni misura gira in un processo nuovo che ha
+già importato streamlit (come il server) ed esegue main.py con AppTest contro un
+server FTP locale (bench_suite.LocalFTP) con un dataset sintetico.
+
+    tempo alla schermata di login   prima esecuzione, utente non autenticato
+    tempo ai primi dati             invio del form di login fino alla pagina Lettura con i
+                                    dati, subito oppure dopo --think secondi di digitazione
+    rerun                           esecuzione successiva a cache calde
+
+    python bench/bench_startup.py [--rows 100000] [--repeat 5] [--think 0 3]
+                                  [--json out.json] [--compare base.json]
+
+Richiede pyftpdlib e bcrypt (solo per i benchmark).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MAIN = os.path.join(ROOT, "main.py")
+
+
+# ---------- processo figlio (una misura) ----------
+def child(port: int, think: float) -> dict:
+    import streamlit  # noqa: F401  (già in memoria nel server: fuori dalla misura)
+    import bcrypt
+    from ftplib import FTP
+    from streamlit.testing.v1 import AppTest
+
+    sys.path.insert(0, ROOT)
+    import prd.ftp as prd_ftp
+
+    def connect():
+        ftp = FTP()
+        ftp.connect("127.0.0.1", port, timeout=90)
+        ftp.login("bench", "bench")
+        return ftp
+    prd_ftp._pool = prd_ftp.FTPPool(connect=connect)
+
+    at = AppTest.from_file(MAIN, default_timeout=300)
+    at.secrets["FTP_HOST"], at.secrets["FTP_USER"], at.secrets["FTP_PASS"] = "127.0.0.1", "bench", "bench"
+    at.secrets["auth"] = {"cookie_name": "prd", "cookie_key": "bench", "cookie_expiry_days": 1, "credentials": {
+        "usernames": {"bench": {"name": "Bench", "role": "admin",
+                                "password": bcrypt.hashpw(b"bench", bcrypt.gensalt(4)).decode()}}}}
+    out = {}
+    t = time.perf_counter()
+    at.run()
+    out["login"] = time.perf_counter() - t
+    time.sleep(think)
+    at.text_input[0].input("bench")
+    at.text_input[1].input("bench")
+    t = time.perf_counter()
+    at.button[0].click().run()   # "Login": credenziali verificate e prima pagina nella stessa esecuzione
+    out["primi dati"] = time.perf_counter() - t
+    if at.exception or not (at.dataframe or any("prd-card" in m.value for m in at.markdown)):
+        raise RuntimeError(f"pagina senza dati: {at.exception}")
+    t = time.perf_counter()
+    at.run()
+    out["rerun"] = time.perf_counter() - t
+    return out
+
+
+# ---------- processo principale ----------
+def measure(port: int, think: float, repeat: int) -> dict[str, list[float]]:
+    res: dict[str, list[float]] = {}
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, __file__, "--child", str(port), "--think", str(think)],
+                              capture_output=True, text=True, cwd=ROOT)
+        line = proc.stdout.strip().splitlines()[-1] if proc.stdout.strip() else ""
+        if proc.returncode or not line.startswith("{"):
+            raise RuntimeError(proc.stderr[-2000:])
+        for k, v in json.loads(line).items():
+            res.setdefault(k, []).append(v)
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--think", type=float, nargs="+", default=[0.0, 3.0],
+                    help="secondi tra schermata di login e primo accesso")
+    ap.add_argument("--json", help="scrive i risultati in questo file")
+    ap.add_argument("--compare", help="JSON di un'esecuzione precedente da confrontare")
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        print(json.dumps(child(args.child, args.think[0])))
+        return
+
+    sys.path.insert(0, HERE)
+    from bench_suite import LocalFTP, meta
+    from synth import make_csv
+
+    base = {}
+    if args.compare:
+        with open(args.compare) as f:
+            base = {(r["think"], r["step"]): r["median_s"] for r in json.load(f)["results"]}
+
+    server = LocalFTP()
+    server.seed(make_csv(args.rows, ";"))
+    results = []
+    try:
+        print(f"{'attesa s':>8}  {'passo':<14}{'mediana s':>10}{'min s':>9}" + (f"{'x base':>8}" if base else ""))
+        for think in args.think:
+            for step, times in measure(server.port, think, args.repeat).items():
+                if step == "login" and think != args.think[0]:
+                    continue   # non dipende dall'attesa
+                med = statistics.median(times)
+                results.append({"rows": args.rows, "think": think, "step": step, "median_s": med,
+                                "min_s": min(times), "runs": times})
+                ratio = med / base[(think, step)] if base.get((think, step)) else None
+                print(f"{think:>8.1f}  {step:<14}{med:>10.3f}{min(times):>9.3f}"
+                      + (f"{ratio:>8.2f}" if ratio else ("       -" if base else "")))
+    finally:
+        server.close()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "startup", "meta": meta(), "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
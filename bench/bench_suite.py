@@ -0,0 +1,213 @@
+"""
+Benchmark end-to-end dei percorsi caldi dell'app su dataset sintetici (bench/synth.py)
+serviti da un server FTP locale nel processo (pyftpdlib): stesso codice di prd.*,
+solo la connessione punta al server locale invece che all'hosting.
+
+Per ogni dimensione e separatore misura: download + lettura del CSV, normalizzazione
+dei tempi, filtri della Lettura, schede, prossimo CICLO_NR, append di una riga,
+sincronizzazione della coda e salvataggio di una modifica (journal).
+
+    python bench/bench_suite.py [--sizes 10000 100000 1000000] [--seps ";" ","]
+                                [--repeat 3] [--json out.json] [--compare base.json]
+
+Il JSON contiene versioni di Python/pandas/pyarrow e il commit git, così i risultati
+di versioni diverse si confrontano con --compare (rapporto tempo attuale / base).
+Richiede pyftpdlib (solo per i benchmark, non è una dipendenza dell'app).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from ftplib import FTP
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synth import make_csv  # noqa: E402
+
+import prd.ftp as prd_ftp  # noqa: E402
+import prd.store as prd_store  # noqa: E402
+from prd.cache import get_dataset, invalidate_dataset  # noqa: E402
+from prd.cards import CARD_PAGE_SIZE, cards_html  # noqa: E402
+from prd.config import COLUMNS, PRIMARY_DIR, REMOTE_FILE  # noqa: E402
+from prd.data import ingest_csv, normalize_time_columns  # noqa: E402
+from prd.partitions import forget_manifest  # noqa: E402
+from prd.search import SearchIndex  # noqa: E402
+from prd.seq import ciclo_sequence  # noqa: E402
+from prd.store import append_row_safe_via_ftp, get_next_ciclo_nr_from_server, save_dataset_changes  # noqa: E402
+
+USER, PASSWORD = "bench", "bench"
+
+
+# ---------- server FTP locale ----------
+class LocalFTP:
+    """Server pyftpdlib su una porta libera di 127.0.0.1, con PRIMARY_DIR sotto una cartella temporanea."""
+
+    def __init__(self):
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+
+        log = logging.getLogger("pyftpdlib")   # con un handler già presente pyftpdlib non configura il suo log
+        log.addHandler(logging.NullHandler())
+        log.propagate = False
+        self.root = tempfile.mkdtemp(prefix="prd-bench-")
+        self.dir = os.path.join(self.root, PRIMARY_DIR.lstrip("/"))
+        os.makedirs(self.dir)
+        auth = DummyAuthorizer()
+        auth.add_user(USER, PASSWORD, self.root, perm="elradfmwMT")
+        handler = type("Handler", (FTPHandler,), {"authorizer": auth})
+        self.server = ThreadedFTPServer(("127.0.0.1", 0), handler)
+        self.port = self.server.socket.getsockname()[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def connect(self) -> FTP:
+        ftp = FTP()
+        ftp.connect("127.0.0.1", self.port, timeout=90)
+        ftp.login(USER, PASSWORD)
+        return ftp
+
+    def seed(self, raw: bytes):
+        """Cartella remota vuota con il solo CSV di produzione."""
+        prd_store.drain_maintenance()   # snapshot/compattazioni del caso precedente
+        shutil.rmtree(self.dir)
+        os.makedirs(self.dir)
+        with open(os.path.join(self.dir, REMOTE_FILE), "wb") as f:
+            f.write(raw)
+
+    def close(self):
+        prd_store.drain_maintenance()   # i lavori in background usano ancora il server
+        self.server.close_all()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def use_server(server: LocalFTP):
+    """Le funzioni di prd.ftp usano il server locale (nuovo pool, stesse regole)."""
+    prd_ftp._pool.close_all()
+    prd_ftp._pool = prd_ftp.FTPPool(connect=server.connect)
+
+def reset_caches():
+    invalidate_dataset()
+    forget_manifest()
+    ciclo_sequence.invalidate()
+    with prd_store._schema_lock:
+        prd_store._schemas.clear()
+
+
+# ---------- misure ----------
+def timed(fn, repeat: int, setup=None) -> list[float]:
+    out = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t)
+    return out
+
+def run_case(server: LocalFTP, n: int, sep: str, repeat: int) -> dict[str, list[float]]:
+    raw = make_csv(n, sep)
+    server.seed(raw)
+    reset_caches()
+    res = {}
+
+    res["ingest_csv"] = timed(lambda: ingest_csv(raw), repeat)
+    res["get_dataset (freddo)"] = timed(lambda: get_dataset(REMOTE_FILE), repeat, setup=invalidate_dataset)
+    ds = get_dataset(REMOTE_FILE)
+    res["normalize_time_columns"] = timed(lambda: normalize_time_columns(ds.df.copy()), repeat)
+
+    view = ds.view
+    def lettura(index: SearchIndex):
+        rows = index.query(contains={"CODICE_MATERIALE": "mat-00", "DESCRIZIONE": "flangia", "CARTELLA_MACCHINA": ""},
+                           equals={"OPERATORE": "LUCA", "DATA": None})
+        fdf = view if rows is None else view.iloc[rows]
+        return fdf.sort_values("Timestamp", ascending=False)
+    res["filtri Lettura (indice nuovo)"] = timed(lambda: lettura(SearchIndex(ds.df)), repeat)
+    res["filtri Lettura"] = timed(lambda: lettura(ds.search), repeat)
+    fdf = lettura(ds.search)
+    res["schede (una pagina)"] = timed(lambda: cards_html(fdf.iloc[:CARD_PAGE_SIZE]), repeat)
+
+    res["get_next_ciclo_nr_from_server"] = timed(get_next_ciclo_nr_from_server, repeat,
+                                                 setup=ciclo_sequence.invalidate)
+    row = {"Timestamp": "2030-01-01 08:00:00", "OPERATORE": "LUCA", "DATA": "2030-01-01", "CODICE_MATERIALE": "MAT-0001",
+           "DESCRIZIONE": "bench", "CICLO_NR": n + 1, "MACCHINA": "DMG MORI", "NUMERO_PRG": "", "FASE": "Fase 1",
+           "CARTELLA_MACCHINA": "", "TEMPO_FASE_MIN": "1:00:00"}
+    res["append_row_safe_via_ftp"] = timed(
+        lambda: prd_ftp.ftp_run(lambda ftp: append_row_safe_via_ftp(ftp, REMOTE_FILE, dict(row), COLUMNS)), repeat)
+    res["get_dataset (coda)"] = timed(lambda: get_dataset(REMOTE_FILE), 1,
+                                      setup=lambda: invalidate_dataset(REMOTE_FILE, drop=False))
+
+    ds = get_dataset(REMOTE_FILE)
+    def salva():
+        r = len(ds.df) // 2
+        change = [(r, ds.df["Timestamp"].iat[r], {"FASE": "Collaudo", "TEMPO_FASE_MIN": "2:00:00"})]
+        prd_ftp.ftp_run(lambda ftp: save_dataset_changes(ftp, ds.parts, change, "bench"))
+    res["salvataggio Modifica"] = timed(salva, repeat)
+    return res
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def meta() -> dict:
+    try:
+        import pyarrow
+        arrow = pyarrow.__version__
+    except ImportError:
+        arrow = None
+    return {"commit": git_commit(), "python": platform.python_version(), "pandas": pd.__version__,
+            "pyarrow": arrow, "machine": platform.machine(), "at": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--seps", nargs="+", default=[";", ","], choices=[";", ","])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="scrive i risultati in questo file")
+    ap.add_argument("--compare", help="JSON di un'esecuzione precedente da confrontare")
+    args = ap.parse_args()
+
+    base = {}
+    if args.compare:
+        with open(args.compare) as f:
+            base = {(r["rows"], r["sep"], r["step"]): r["median_s"] for r in json.load(f)["results"]}
+
+    server = LocalFTP()
+    use_server(server)
+    results = []
+    try:
+        print(f"{'righe':>9} {'sep':>3}  {'passo':<32}{'mediana s':>10}{'min s':>9}" + (f"{'x base':>8}" if base else ""))
+        for n in args.sizes:
+            for sep in args.seps:
+                for step, times in run_case(server, n, sep, args.repeat).items():
+                    med = statistics.median(times)
+                    results.append({"rows": n, "sep": sep, "step": step, "median_s": med, "min_s": min(times),
+                                    "runs": times})
+                    ratio = med / base[(n, sep, step)] if base.get((n, sep, step)) else None
+                    print(f"{n:>9} {sep:>3}  {step:<32}{med:>10.4f}{min(times):>9.4f}"
+                          + (f"{ratio:>8.2f}" if ratio else ("       -" if base else "")))
+    finally:
+        server.close()
+        prd_ftp._pool.close_all()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "suite", "meta": meta(), "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Generatore di dataset PRD sintetici ma realistici: colonne reali (COLUMNS), righe in
+ordine di Timestamp con CICLO_NR crescente, TEMPO_FASE_MIN in formati misti
+('H:MM:SS', 'H:MM', minuti), descrizioni con separatori e virgolette, campi vuoti.
+Stesso seme = stessi byte, quindi i risultati dei benchmark sono confrontabili.
+
+    python bench/synth.py 100000 out.csv [--sep ,] [--seed 1]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prd.config import COLUMNS, OPERATORI  # noqa: E402
+
+MACCHINE = ["DMG MORI", "TAKISAWA", "MAZAK VRX", "HURCO", "OKUMA 2SP", "DOOSAN"]
+CARTELLE = ["WASS", "EL.EN", "DUMAREY", "VARIE", "BONFIGLIOLI", ""]
+FASI = ["Fase 1", "Fase 2", "Fase 3", "Preparazione", "Collaudo"]
+DESCRIZIONI = ["Flangia 80", "Albero, rettificato", 'Supporto "L"', "Piastra forata", "Boccola; ottone",
+               "Perno Ø12", "Coperchio lato pompa", ""]
+# Quota di TEMPO_FASE_MIN per formato: 'H:MM:SS' (come scrive l'app), 'H:MM', minuti
+TEMPO_MIX = (0.8, 0.1, 0.1)
+
+
+# ---------- dati ----------
+def _pool(n: int, make) -> np.ndarray:
+    return np.array([make(i) for i in range(n)], dtype=object)
+
+def make_frame(n: int, seed: int = 0, years: int = 3) -> pd.DataFrame:
+    """DataFrame di testo con le colonne del CSV di produzione (valori presi da pool di stringhe)."""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(end="2025-06-30", periods=years * 365, freq="D").strftime("%Y-%m-%d").to_numpy(object)
+    times = _pool(86400, lambda s: f" {s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}")
+    day, sec = rng.integers(0, len(days), n), rng.integers(6 * 3600, 22 * 3600, n)
+    order = np.lexsort((sec, day))
+    day, sec = day[order], sec[order]
+    ts = days[day] + times[sec]
+
+    hhmmss, hhmm = _pool(600, lambda m: f"{m // 60}:{m % 60:02d}:00"), _pool(600, lambda m: f"{m // 60}:{m % 60:02d}")
+    mins, fmt = rng.integers(1, 600, n), rng.choice(3, n, p=TEMPO_MIX)
+    tempo = np.where(fmt == 0, hhmmss[mins], np.where(fmt == 1, hhmm[mins], mins.astype(str).astype(object)))
+    tempo[rng.random(n) < 0.005] = ""
+
+    materiali = _pool(5000, lambda i: f"MAT-{i:04d}")
+    prg = _pool(2000, lambda i: f"O{i:04d}")
+    df = pd.DataFrame({
+        "Timestamp": ts,
+        "OPERATORE": np.array(OPERATORI, dtype=object)[rng.integers(0, len(OPERATORI), n)],
+        "DATA": days[day],
+        "CODICE_MATERIALE": materiali[rng.zipf(1.3, n) % len(materiali)],
+        "DESCRIZIONE": np.array(DESCRIZIONI, dtype=object)[rng.integers(0, len(DESCRIZIONI), n)],
+        "CICLO_NR": np.arange(1, n + 1).astype(str).astype(object),
+        "MACCHINA": np.array(MACCHINE, dtype=object)[rng.integers(0, len(MACCHINE), n)],
+        "NUMERO_PRG": np.where(rng.random(n) < 0.2, "", prg[rng.integers(0, len(prg), n)]),
+        "CARTELLA_MACCHINA": np.array(CARTELLE, dtype=object)[rng.integers(0, len(CARTELLE), n)],
+        "FASE": np.array(FASI, dtype=object)[rng.integers(0, len(FASI), n)],
+        "TEMPO_FASE_MIN": tempo,
+    })
+    return df[COLUMNS]
+
+def make_csv(n: int, sep: str = ";", seed: int = 0) -> bytes:
+    """Byte del CSV come lo scrive l'app (intestazione, '\\n', quoting minimo)."""
+    return make_frame(n, seed).to_csv(sep=sep, index=False, lineterminator="\n").encode("utf-8")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("rows", type=int)
+    ap.add_argument("out")
+    ap.add_argument("--sep", default=";", choices=[";", ","])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    with open(args.out, "wb") as f:
+        f.write(make_csv(args.rows, args.sep, args.seed))
+
+
+if __name__ == "__main__":
+    main()
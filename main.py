@@ -1,638 +1,875 @@
-import streamlit as st
-import pandas as pd
-from datetime import datetime, date, timedelta  # + timedelta per idle timeout
-import io
-from ftplib import FTP, error_perm
-import math
-import re
-import csv
-import streamlit_authenticator as stauth  # <— NEW
-
-# ---------- CONFIG ----------
-st.set_page_config(page_title="PRD • Raccolta Dati", page_icon="🛠️", layout="wide")
-
-# ---------- AUTH (minimal, prima di qualsiasi UI/FTP) ----------
-def _build_credentials_from_secrets():
-    auth = st.secrets["auth"]
-    creds = {"usernames": {}}
-    for uname, u in auth["credentials"]["usernames"].items():
-        creds["usernames"][uname] = {
-            "name": u["name"],
-            "email": u.get("email", ""),
-            "password": u["password"],   # hash bcrypt ($2b$12$…)
-            "role": u.get("role", "viewer"),
-        }
-    return auth, creds
-
-_auth, _credentials = _build_credentials_from_secrets()
-_authenticator = stauth.Authenticate(
-    _credentials,
-    _auth["cookie_name"],
-    _auth["cookie_key"],
-    cookie_expiry_days=int(_auth["cookie_expiry_days"]),
-)
-
-# --- LOGIN (nuova API: solo location, poi leggo da session_state)
-_authenticator.login(location="main")
-auth_status = st.session_state.get("authentication_status")
-name       = st.session_state.get("name")
-username   = st.session_state.get("username")
-
-if auth_status is False:
-    st.error("❌ Credenziali errate. Riprova.")
-    st.stop()
-elif auth_status is None or not username:
-    st.info("Inserisci le credenziali per accedere.")
-    st.stop()
-
-# --- Idle timeout (60 min)
-from datetime import datetime, timedelta
-IDLE_MIN = 60
-_now = datetime.utcnow()
-_last = st.session_state.get("_last_activity")
-if _last and (_now - _last).total_seconds() > IDLE_MIN * 60:
-    st.warning("Sessione scaduta per inattività.")
-    _authenticator.logout(button_name="Rifai login", location="main")
-    st.stop()
-st.session_state["_last_activity"] = _now
-
-# --- Barra utente + logout
-with st.sidebar:
-    st.success(f"✅ Autenticato: **{name}**")
-    _authenticator.logout(button_name="Logout", location="sidebar")
-
-_role = _credentials["usernames"][username]["role"]
-
-
-
-# ---------- COSTANTI APP (dopo login) ----------
-PRIMARY_DIR  = "/httpdocs/IA/luppichini/PRD"
-REMOTE_FILE  = "Dati_PRD_Alessio.csv"
-OPERATORI    = ["ALESSIO", "ALE_SERAP", "ALESSANDRO", "LUCA", "MICHELE", "VALERIO"]
-
-# ---------- STILE CLEAN ----------
-st.markdown("""
-<style>
-.block-container{padding-top:3.2rem !important;}
-/* Header clean */
-.prd-header{display:flex;align-items:center;gap:.6rem;margin:0 0 1rem 0}
-.prd-title{font-weight:800;font-size:1.6rem;letter-spacing:-.02em;margin:0;color:#111827}
-/* Card minimal */
-.prd-card{
-  border:1px solid #e5e7eb;
-  border-left:6px solid #2563eb;
-  border-radius:12px;
-  padding:14px 16px;
-  margin:12px 0;
-  background:#fff;
-  box-shadow:0 1px 2px rgba(0,0,0,.04);
-}
-.prd-h4{font-size:1.02rem;font-weight:800;color:#111827;margin:0 0 .4rem 0}
-.prd-meta{color:#374151;font-size:.92rem;margin-bottom:8px}
-.prd-chip{
-  display:inline-block;padding:3px 8px;margin:0 6px 6px 0;border-radius:999px;
-  background:#eff6ff;color:#1d4ed8;border:1px solid #dbeafe;font-weight:700;font-size:.78rem
-}
-.prd-sep{height:1px;background:#e5e7eb;margin:8px 0}
-.prd-kv{font-size:.9rem;color:#111827}
-/* Dataframe full width */
-[data-testid="stDataFrameResizable"]{width:100% !important;}
-</style>
-""", unsafe_allow_html=True)
-
-# ---------- HEADER ----------
-st.markdown(f"""
-<div class="prd-header">
-  <span style="font-size:1.6rem">🛠️</span>
-  <div class="prd-title">Raccolta Dati Produzione</div>
-</div>
-""", unsafe_allow_html=True)
-
-# ---------- FTP ----------
-def ftp_connect() -> FTP:
-    ftp = FTP(st.secrets["FTP_HOST"], timeout=90)
-    ftp.set_pasv(True)
-    ftp.login(user=st.secrets["FTP_USER"], passwd=st.secrets["FTP_PASS"])
-    return ftp
-
-def ftp_cwd_existing(ftp: FTP, target_dir: str):
-    try:
-        ftp.cwd(target_dir)
-    except Exception as e:
-        raise RuntimeError(f"Impossibile entrare in {target_dir}: {e}")
-
-def ftp_download_file(ftp: FTP, filename: str) -> bytes | None:
-    bio = io.BytesIO()
-    try:
-        ftp.retrbinary(f"RETR {filename}", bio.write)
-        return bio.getvalue()
-    except error_perm as e:
-        if "550" in str(e):
-            return None
-        raise
-
-def ftp_upload_file(ftp: FTP, filename: str, payload: bytes):
-    bio = io.BytesIO(payload)
-    ftp.storbinary(f"STOR {filename}", bio)
-
-# ---------- CSV lettura/tempo ----------
-def _detect_sep(csv_bytes: bytes, default=";"):
-    if not csv_bytes:
-        return default
-    try:
-        head = csv_bytes.splitlines()[0].decode("utf-8", "ignore")
-    except Exception:
-        return default
-    return ";" if head.count(";") >= head.count(",") else ","
-
-def read_csv_bytes(csv_bytes: bytes | None):
-    if not csv_bytes:
-        return pd.DataFrame(), ";"
-    sep = _detect_sep(csv_bytes)
-    try:
-        df = pd.read_csv(io.BytesIO(csv_bytes), sep=sep)
-    except Exception:
-        sep = "," if sep == ";" else ";"
-        df = pd.read_csv(io.BytesIO(csv_bytes), sep=sep)
-    return df, sep
-
-def std(x: str) -> str:
-    return " ".join(str(x or "").strip().split())
-
-def to_int_safe(x, default=0):
-    try:
-        s = str(x).strip().replace(",", ".")
-        v = int(float(s))
-        return v if v >= 0 else default
-    except Exception:
-        return default
-
-def minutes_to_hhmm(m) -> str:
-    try:
-        if pd.isna(m):
-            return ""
-        m = int(round(float(m)))
-        h = m // 60
-        r = m % 60
-        return f"{h:02d}:{r:02d}"
-    except Exception:
-        return ""
-
-def parse_hhmmss_to_minutes(s: str) -> int | None:
-    """Converte 'HH:MM:SS' o 'HH:MM' in minuti; None se non combacia."""
-    if s is None:
-        return None
-    s = str(s).strip()
-    m = re.match(r"^\s*(\d{1,3})\s*:\s*([0-5]?\d)\s*:\s*([0-5]?\d)\s*$", s)
-    if m:
-        hh, mm = int(m.group(1)), int(m.group(2))
-        return hh * 60 + mm
-    m = re.match(r"^\s*(\d{1,3})\s*:\s*([0-5]?\d)\s*$", s)
-    if m:
-        hh, mm = int(m.group(1)), int(m.group(2))
-        return hh * 60 + mm
-    return None
-
-def normalize_time_columns(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Popola sempre:
-      - TEMPO_FASE_MIN (int, minuti)
-      - TEMPO_FASE (hh:mm) per display
-    """
-    u2orig = {c.upper().strip(): c for c in df.columns}
-    tmin = None
-
-    if "TEMPO_FASE_MIN" in u2orig:
-        c = u2orig["TEMPO_FASE_MIN"]
-        ser = df[c]
-        if ser.astype(str).str.contains(":").any():
-            tmin = ser.apply(parse_hhmmss_to_minutes).astype("Int64")
-        else:
-            tmin = pd.to_numeric(ser, errors="coerce").astype("Int64")
-
-    if tmin is None:
-        tempo_cols = [u2orig[u] for u in u2orig if "TEMPO" in u]
-        for c in tempo_cols:
-            ser = df[c].astype(str)
-            if ser.str.contains(":").any():
-                tmin = ser.apply(parse_hhmmss_to_minutes).astype("Int64")
-                break
-
-    if tmin is None and "ORE" in u2orig and "MINUTI" in u2orig:
-        h, m = u2orig["ORE"], u2orig["MINUTI"]
-        tmin = (df[h].apply(to_int_safe) * 60 + df[m].apply(to_int_safe)).astype("Int64")
-
-    if tmin is None:
-        df["TEMPO_FASE_MIN"] = pd.Series([pd.NA] * len(df), dtype="Int64")
-    else:
-        df["TEMPO_FASE_MIN"] = tmin
-
-    df["TEMPO_FASE (hh:mm)"] = df["TEMPO_FASE_MIN"].apply(minutes_to_hhmm)
-    return df
-
-# ---------- NEW: append sicuro via FTP ----------
-def sniff_separator_from_bytes(csv_bytes: bytes, default=";"):
-    if not csv_bytes:
-        return default
-    try:
-        head = csv_bytes.splitlines()[0].decode("utf-8", "ignore")
-    except Exception:
-        return default
-    return ";" if head.count(";") >= head.count(",") else ","
-
-def serialize_row(columns: list[str], row: dict, sep: str) -> str:
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=sep, lineterminator="\n", quoting=csv.QUOTE_MINIMAL)
-    writer.writerow([row.get(col, "") for col in columns])
-    return output.getvalue()
-
-def ftp_file_exists_and_size(ftp: FTP, filename: str) -> tuple[bool, int]:
-    try:
-        size = ftp.size(filename)
-        return True, size if size is not None else 0
-    except Exception:
-        return False, 0
-
-def ftp_backup_file(ftp: FTP, filename: str):
-    try:
-        data = ftp_download_file(ftp, filename)
-        if not data:
-            return
-
-        stamp = datetime.now().strftime("%Y%m%d")
-        bak_name = f"{filename}.bak_{stamp}"
-
-        exists, _ = ftp_file_exists_and_size(ftp, bak_name)
-        if exists:
-            return
-
-        ftp_upload_file(ftp, bak_name, data)
-        ftp_cleanup_old_backups(ftp, filename, keep_last=7)
-
-    except Exception:
-        pass
-        
-
-def append_row_safe_via_ftp(ftp: FTP, filename: str, row: dict, preferred_columns: list[str] = None):
-    exists, size = ftp_file_exists_and_size(ftp, filename)
-
-    if not exists or size == 0:
-        cols = preferred_columns or list(row.keys())
-        sep = ";"
-        header = (sep.join(cols) + "\n").encode("utf-8")
-        line   = serialize_row(cols, row, sep).encode("utf-8")
-        ftp_upload_file(ftp, filename, header + line)
-        return
-
-    data = ftp_download_file(ftp, filename)
-    if not data:
-        raise RuntimeError("Il file remoto esiste ma non è leggibile (download vuoto). Append annullato per sicurezza.")
-
-    sep = sniff_separator_from_bytes(data, default=";")
-    try:
-        first_line = data.splitlines()[0].decode("utf-8", "ignore")
-        cols = [c.strip() for c in first_line.split(sep)]
-    except Exception:
-        raise RuntimeError("Header esistente non leggibile. Append annullato per evitare corruzioni.")
-
-    for c in cols:
-        row.setdefault(c, "")
-
-    ftp_backup_file(ftp, filename)
-
-    line_str = serialize_row(cols, row, sep)
-    bio = io.BytesIO(line_str.encode("utf-8"))
-    ftp.storbinary(f"APPE {filename}", bio)
-
-def get_next_ciclo_nr_from_server() -> int:
-    try:
-        ftp = ftp_connect()
-        ftp_cwd_existing(ftp, PRIMARY_DIR)
-        data = ftp_download_file(ftp, REMOTE_FILE)
-        ftp.quit()
-        if not data:
-            return 1
-        df, _ = read_csv_bytes(data)
-        if "CICLO_NR" not in df.columns or df.empty:
-            return 1
-        nums = pd.to_numeric(df["CICLO_NR"], errors="coerce")
-        current_max = int(nums.max()) if pd.notna(nums.max()) else 0
-        return max(current_max + 1, 1)
-    except Exception:
-        return 1
-
-# ---------- SIDEBAR ----------
-with st.sidebar:
-    mode = st.radio("Modalità", ["✍️ Scrittura", "📖 Lettura", "📝 Modifica"], index=1)
-    if st.button("🔎 Verifica accesso"):
-        try:
-            ftp = ftp_connect(); root_pwd = ftp.pwd()
-            ftp_cwd_existing(ftp, PRIMARY_DIR); here = ftp.pwd()
-            data = ftp_download_file(ftp, REMOTE_FILE); ftp.quit()
-            st.success(f"OK. Root: {root_pwd} → Dir: {here} → File: {REMOTE_FILE} "
-                       f"{'(trovato)' if data is not None else '(vuoto)'}")
-        except Exception as e:
-            st.error(f"Verifica fallita: {e}")
-
-# ---------- SCRITTURA ----------
-
-if mode == "✍️ Scrittura":
-    st.subheader("✍️ Inserisci dati")
-
-    next_ciclo_nr = get_next_ciclo_nr_from_server()
-
-    operatore   = st.selectbox("Operatore", OPERATORI, 0)
-    data_lavoro = st.date_input("Data", value=date.today(), format="DD/MM/YYYY")
-
-    st.markdown("#### Dati tecnici")
-    c1, c2 = st.columns([2,3])
-    with c1: codice_materiale = st.text_input("CODICE Materiale").upper()
-    with c2: descrizione      = st.text_input("DESCRIZIONE")
-
-    c3, c4, c5 = st.columns(3)
-    with c3:
-        # ✅ SUGGERITO ma EDITABILE (niente disabled)
-        ciclo_nr = st.number_input(
-            "CICLO NR (suggerito)",
-            min_value=1,
-            value=next_ciclo_nr,
-            step=1
-        )
-        if ciclo_nr < next_ciclo_nr:
-            st.warning(
-                "Il valore è inferiore al suggerito (storico massimo + 1). "
-                "Attenzione a possibili duplicati già usati in passato."
-            )
-
-    with c4:
-        macchina = st.selectbox("MACCHINA",
-            ["DMG MORI","TAKISAWA","QUASER","MAZAK VCN 600","MAZAK VCN 530c", "MAZAK VRX","MAZAK HCN","HYUNDAI","HURCO"], 0)
-    with c5:
-        fase = st.selectbox("FASE",
-            ["Fase 1","Fase 2","Fase 3","Fase 4","Fase 5","Fase 6","Preparazione","Attrezzaggio","Programmazione"], 0)
-
-    c6, c7, c8 = st.columns(3)
-    with c6: numero_prg = st.text_input("NUMERO PRG")
-    with c7:
-        cartella_mac = st.selectbox("CARTELLA MACCHINA",
-                                    ["WASS", "EL.EN", "DUMAREY", "VARIE"], 0)
-    with c8:
-        tempo_min_input = st.number_input("Tempo fase (minuti)", min_value=0, value=0, step=1)
-
-    if st.button("📩 Invia"):
-        missing = []
-        if not codice_materiale: missing.append("CODICE Materiale")
-        if not descrizione:      missing.append("DESCRIZIONE")
-        if not fase:             missing.append("FASE")
-        if missing:
-            st.error("Compila: " + ", ".join(missing))
-        else:
-            min_tot = to_int_safe(tempo_min_input)
-            h = min_tot // 60
-            m = min_tot % 60
-            tempo_str = f"{h}:{m:02d}:00"
-
-            record = {
-                "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "OPERATORE": operatore,
-                "DATA": data_lavoro.strftime("%Y-%m-%d"),
-                "CODICE_MATERIALE": std(codice_materiale),
-                "DESCRIZIONE": std(descrizione),
-                "CICLO_NR": int(ciclo_nr),
-                "MACCHINA": std(macchina),
-                "NUMERO_PRG": std(numero_prg),
-                "CARTELLA_MACCHINA": std(cartella_mac),
-                "FASE": std(fase),
-                "TEMPO_FASE_MIN": tempo_str,  # HH:MM:SS per continuità
-            }
-
-            try:
-                ftp = ftp_connect(); ftp_cwd_existing(ftp, PRIMARY_DIR)
-                append_row_safe_via_ftp(
-                    ftp, REMOTE_FILE, record,
-                    preferred_columns=[
-                        "Timestamp","OPERATORE","DATA","CODICE_MATERIALE","DESCRIZIONE","CICLO_NR",
-                        "MACCHINA","NUMERO_PRG","CARTELLA_MACCHINA","FASE","TEMPO_FASE_MIN"
-                    ]
-                )
-                where = ftp.pwd(); ftp.quit()
-                st.success(f"✅ Tutto salavato, visto non è difficile, se ci riesce MICHELE!!!")
-                st.balloons()
-            except Exception as e:
-                st.error(f"❌ Errore salvataggio su FTP: {e}")
-
-elif mode == "📝 Modifica":
-    st.subheader("📝 Modifica dati esistenti")
-
-    # --- carica dataset da FTP ---
-    try:
-        ftp = ftp_connect()
-        ftp_cwd_existing(ftp, PRIMARY_DIR)
-        csv_bytes = ftp_download_file(ftp, REMOTE_FILE)
-        ftp.quit()
-        if not csv_bytes:
-            st.warning("Nessun dato disponibile per la modifica.")
-            st.stop()
-        df, sep = read_csv_bytes(csv_bytes)
-        df.columns = [c.strip() for c in df.columns]
-        if "TEMPO_FASE_MIN" not in df.columns:
-            df["TEMPO_FASE_MIN"] = ""
-    except Exception as e:
-        st.error(f"Errore durante il caricamento: {e}")
-        st.stop()
-
-    # --- FILTRI DI RICERCA ---
-    st.markdown("### 🔎 Ricerca record")
-    col1, col2, col3, col4 = st.columns(4)
-    with col1: flt_codice = st.text_input("CODICE Materiale contiene")
-    with col2: flt_descr  = st.text_input("DESCRIZIONE contiene")
-    with col3: flt_ciclo  = st.text_input("CICLO NR esatto")
-    with col4: flt_prg    = st.text_input("NUMERO PRG contiene")
-
-    avvia_ricerca = st.button("🔍 RICERCA")
-
-    # --- SE L’UTENTE NON HA ANCORA CERCATO ---
-    if not avvia_ricerca:
-        st.info("Inserisci uno o più criteri di ricerca, poi premi **RICERCA** per visualizzare i record modificabili.")
-        st.stop()
-
-    # --- FILTRA IL DATAFRAME ---
-    fdf = df.copy()
-    if flt_codice:
-        fdf = fdf[fdf["CODICE_MATERIALE"].astype(str).str.contains(re.escape(flt_codice), case=False, regex=True)]
-    if flt_descr:
-        fdf = fdf[fdf["DESCRIZIONE"].astype(str).str.contains(re.escape(flt_descr), case=False, regex=True)]
-    if flt_ciclo:
-        fdf = fdf[fdf["CICLO_NR"].astype(str) == flt_ciclo.strip()]
-    if flt_prg:
-        fdf = fdf[fdf["NUMERO_PRG"].astype(str).str.contains(re.escape(flt_prg), case=False, regex=True)]
-
-    # --- NESSUN RECORD TROVATO ---
-    if fdf.empty:
-        st.warning("⚠️ Nessun record trovato con i criteri indicati.")
-        st.stop()
-
-    # --- MOSTRA AREA DI MODIFICA ---
-    st.markdown(f"### ✏️ Record trovati: {len(fdf)} — Modifica i campi e salva")
-    for idx, r in fdf.iterrows():
-        st.markdown(f"<div class='prd-sep'></div>", unsafe_allow_html=True)
-        with st.form(f"edit_{idx}"):
-            st.markdown(f"#### 🔧 Modifica — CICLO {r.get('CICLO_NR','')} | {r.get('CODICE_MATERIALE','')}")
-
-            col1, col2 = st.columns([2,3])
-            with col1: codice_materiale = st.text_input("CODICE Materiale", r["CODICE_MATERIALE"], key=f"cod_{idx}")
-            with col2: descrizione = st.text_input("DESCRIZIONE", r["DESCRIZIONE"], key=f"desc_{idx}")
-
-            col3, col4, col5 = st.columns(3)
-            with col3: ciclo_nr = st.number_input("CICLO NR", min_value=1, value=int(r["CICLO_NR"]), step=1, key=f"ciclo_{idx}")
-            with col4: macchina  = st.text_input("MACCHINA", r["MACCHINA"], key=f"mac_{idx}")
-            with col5: fase      = st.text_input("FASE", r["FASE"], key=f"fase_{idx}")
-
-            col6, col7, col8 = st.columns(3)
-            with col6: numero_prg = st.text_input("NUMERO PRG", r["NUMERO_PRG"], key=f"prg_{idx}")
-            with col7: cartella_mac = st.text_input("CARTELLA MACCHINA", r["CARTELLA_MACCHINA"], key=f"cart_{idx}")
-            with col8: tempo_min = st.text_input("Tempo fase (hh:mm:ss)", r["TEMPO_FASE_MIN"], key=f"time_{idx}")
-
-            submitted = st.form_submit_button("💾 Salva")
-
-        if submitted:
-            updated_row = r.to_dict()
-            updated_row.update({
-                "CODICE_MATERIALE": codice_materiale,
-                "DESCRIZIONE": descrizione,
-                "CICLO_NR": ciclo_nr,
-                "MACCHINA": macchina,
-                "FASE": fase,
-                "NUMERO_PRG": numero_prg,
-                "CARTELLA_MACCHINA": cartella_mac,
-                "TEMPO_FASE_MIN": tempo_min,
-            })
-
-            key = r["Timestamp"]
-            df.loc[df["Timestamp"] == key] = updated_row
-
-            # --- SALVATAGGIO SU FTP ---
-            try:
-                out = io.BytesIO()
-                df.to_csv(out, index=False, sep=sep)
-                ftp = ftp_connect()
-                ftp_cwd_existing(ftp, PRIMARY_DIR)
-                ftp_backup_file(ftp, REMOTE_FILE)
-                ftp_upload_file(ftp, REMOTE_FILE, out.getvalue())
-                ftp.quit()
-                st.success(f"✅ Riga con CICLO {r.get('CICLO_NR','')} salvata correttamente!")
-            except Exception as e:
-                st.error(f"❌ Errore nel salvataggio della riga {idx+1}: {e}")
-
-    else:
-        st.dataframe(fdf, use_container_width=True, height=500)
-        st.info("Filtra ulteriormente per ottenere un solo record da modificare.")
-
-# ---------- LETTURA ----------
-else:
-    st.subheader("📘 Consultazione dati")
-
-    try:
-        ftp = ftp_connect(); ftp_cwd_existing(ftp, PRIMARY_DIR)
-        csv_bytes = ftp_download_file(ftp, REMOTE_FILE); here = ftp.pwd(); ftp.quit()
-    except Exception as e:
-        csv_bytes = None; here="(n/a)"; st.error(f"Lettura FTP: {e}")
-
-    if not csv_bytes:
-        st.info(f"Nessun dato presente in {here}/{REMOTE_FILE}.")
-    else:
-        df, sep = read_csv_bytes(csv_bytes)
-        df.columns = [c.strip() for c in df.columns]
-        df = normalize_time_columns(df)
-
-        preferred = ["Timestamp","OPERATORE","DATA","CODICE_MATERIALE","DESCRIZIONE","CICLO_NR",
-                     "MACCHINA","NUMERO_PRG","CARTELLA_MACCHINA","FASE","TEMPO_FASE_MIN","TEMPO_FASE (hh:mm)"]
-        cols = [c for c in preferred if c in df.columns] + [c for c in df.columns if c not in preferred]
-        df = df[cols]
-
-        ss = st.session_state
-        ss.setdefault("flt_operatore","(tutti)")
-        ss.setdefault("flt_codice","")
-        ss.setdefault("flt_descr","")
-        ss.setdefault("flt_data",None)
-
-        st.markdown("### 🔎 Filtra")
-        with st.container():
-            col1, col2, col3, col4, col5, col6 = st.columns([1, 1.2, 2, 1.1, 1.3, .9])
-            with col1:
-                ss.flt_operatore = st.selectbox(
-                    "Operatore", ["(tutti)"] + OPERATORI,
-                    index=(["(tutti)"] + OPERATORI).index(ss.flt_operatore)
-                )
-            with col2:
-                ss.flt_codice = st.text_input("CODICE Materiale contiene", ss.flt_codice)
-            with col3:
-                ss.flt_descr = st.text_input("DESCRIZIONE contiene", ss.flt_descr)
-            with col4:
-                ss.flt_cartella = st.text_input("CARTELLA contiene", ss.get("flt_cartella", ""))
-            with col5:
-                ss.flt_data = st.date_input("Solo data", value=ss.flt_data)
-            with col6:
-                if st.button("↺ Reset filtri"):
-                    ss.flt_operatore = "(tutti)"
-                    ss.flt_codice = ""
-                    ss.flt_descr = ""
-                    ss.flt_cartella = ""
-                    ss.flt_data = None
-                    st.rerun()
-
-        fdf = df.copy()
-        if ss.flt_operatore!="(tutti)" and "OPERATORE" in fdf: fdf = fdf[fdf["OPERATORE"]==ss.flt_operatore]
-        if ss.flt_codice and "CODICE_MATERIALE" in fdf:
-            mask = fdf["CODICE_MATERIALE"].astype(str).str.contains(re.escape(ss.flt_codice), case=False, regex=True)
-            fdf = fdf[mask]
-        if ss.flt_descr and "DESCRIZIONE" in fdf:
-            mask = fdf["DESCRIZIONE"].astype(str).str.contains(re.escape(ss.flt_descr), case=False, regex=True)
-            fdf = fdf[mask]
-        if ss.flt_cartella and "CARTELLA_MACCHINA" in fdf:
-            mask = fdf["CARTELLA_MACCHINA"].astype(str).str.contains(re.escape(ss.flt_cartella), case=False, regex=True)
-            fdf = fdf[mask]
-        if ss.flt_data and "DATA" in fdf:
-            fdf = fdf[fdf["DATA"]==ss.flt_data.strftime("%Y-%m-%d")]
-
-        if "Timestamp" in fdf:
-            fdf["Timestamp"] = pd.to_datetime(fdf["Timestamp"], errors="coerce")
-            fdf = fdf.sort_values("Timestamp", ascending=False)
-
-        st.markdown("### 👀 Visualizzazione")
-        left, _ = st.columns([1,4])
-        show_cards = left.toggle("Modalità mobile-friendly (schede)", value=True)
-
-        if show_cards:
-            if fdf.empty:
-                st.info("Nessun record corrisponde ai filtri.")
-            else:
-                for _, r in fdf.iterrows():
-                    st.markdown(f"""
-                    <div class="prd-card">
-                      <div class="prd-h4">🔩 {r.get('CODICE_MATERIALE','')} — {r.get('DESCRIZIONE','')}</div>
-                      <div class="prd-meta">📅 <b>{r.get('DATA','')}</b> &nbsp;•&nbsp; 👤 <b>{r.get('OPERATORE','')}</b> &nbsp;•&nbsp; 🏭 <b>{r.get('MACCHINA','')}</b> &nbsp;•&nbsp; 🚦 <b>{r.get('FASE','')}</b></div>
-                      <div>
-                        <span class="prd-chip">CICLO: {r.get('CICLO_NR','')}</span>
-                        <span class="prd-chip">PRG: {r.get('NUMERO_PRG','')}</span>
-                        <span class="prd-chip">CARTELLA: {r.get('CARTELLA_MACCHINA','')}</span>
-                        <span class="prd-chip">Tempo: {r.get('TEMPO_FASE (hh:mm)','')}</span>
-                      </div>
-                      <div class="prd-sep"></div>
-                      <div class="prd-kv"><b>Timestamp:</b> {r.get('Timestamp','')}</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-        else:
-            st.dataframe(fdf, use_container_width=True, height=620)
-
-        st.download_button(
-            "⬇️ Scarica CSV filtrato",
-            data=fdf.to_csv(index=False, sep=sep).encode("utf-8"),
-            file_name="estratto_prd.csv",
-            mime="text/csv",
-        )
-
-
-
-
-
+import copy
+import json
+import uuid
+from datetime import datetime, date, timedelta
+
+import streamlit as st
+import streamlit_authenticator as stauth
+
+from prd import startup
+from prd.config import REMOTE_FILE
+
+# ---------- CONFIG ----------
+st.set_page_config(page_title="PRD • Raccolta Dati", page_icon="🛠️", layout="wide")
+# primo avvio del processo: import pesanti e dataset in background, già durante il login
+startup.warm_up(REMOTE_FILE)
+
+# ---------- AUTH (minimal, prima di qualsiasi UI/FTP) ----------
+# Credenziali e parametri del cookie si leggono dai secrets una volta per processo;
+# Authenticate invece va creato a ogni esecuzione completa (il suo CookieManager è un
+# componente della sessione), ma costa pochi ms una volta importati i moduli.
+@st.cache_resource(show_spinner=False)
+def _build_credentials_from_secrets():
+    auth = st.secrets["auth"]
+    creds = {"usernames": {}}
+    for uname, u in auth["credentials"]["usernames"].items():
+        creds["usernames"][uname] = {
+            "name": u["name"],
+            "email": u.get("email", ""),
+            "password": u["password"],   # hash bcrypt ($2b$12$…)
+            "role": u.get("role", "viewer"),
+        }
+    return (auth["cookie_name"], auth["cookie_key"], int(auth["cookie_expiry_days"])), creds
+
+# Pausa di stauth prima del form, per dare al browser il tempo di restituire il cookie di
+# accesso: serve solo alla prima esecuzione della sessione (poi il cookie è arrivato o non c'è)
+LOGIN_SLEEP_SEC = 0.7
+_first_run = "_auth_seen" not in st.session_state
+st.session_state["_auth_seen"] = True
+
+(_cookie_name, _cookie_key, _cookie_days), _credentials = _build_credentials_from_secrets()
+_credentials = copy.deepcopy(_credentials)   # Authenticate ci scrive lo stato di login
+_authenticator = stauth.Authenticate(
+    _credentials,
+    _cookie_name,
+    _cookie_key,
+    cookie_expiry_days=_cookie_days,
+    login_sleep_time=LOGIN_SLEEP_SEC if _first_run else 0,
+)
+
+# --- LOGIN (nuova API: solo location, poi leggo da session_state)
+_authenticator.login(location="main")
+auth_status = st.session_state.get("authentication_status")
+name       = st.session_state.get("name")
+username   = st.session_state.get("username")
+
+if auth_status is False:
+    st.error("❌ Credenziali errate. Riprova.")
+    startup.mark("login")
+    st.stop()
+elif auth_status is None or not username:
+    st.info("Inserisci le credenziali per accedere.")
+    startup.mark("login")
+    st.stop()
+
+# ---------- MODULI DELL'APP (dopo il login: intanto warm_up li ha già importati) ----------
+import pandas as pd
+
+from prd.config import OPERATORI, PRIMARY_DIR
+from prd.ftp import ftp_session, ftp_run, ftp_remote_version
+from prd.data import std, to_int_safe, fmt_cell, minutes_to_hhmm, minutes_to_hhmmss
+from prd.store import (check_parts_unchanged, compact_journal, get_next_ciclo_nr_from_server,
+                       migrate_to_partitions, save_dataset_changes)
+from prd.partitions import duplicate_indexes, get_manifest, load_dataset, prefetch_dataset
+from prd.cards import CARD_PAGE_SIZE, cards_html, page_count
+from prd.edits import READONLY_COLUMNS, changes_from_edits, diff_edits, edit_frame, validate_edits
+from prd.outbox import outbox
+from prd.importer import guess_mapping, import_rows, prepare_import, read_upload
+from prd.exports import CONTENTS, FORMATS, cached_export, get_export
+from prd.rollups import pivot, query
+from prd.dupes import check_record, ciclo_conflicts, flag_duplicates, report_in_background
+from prd import tracing
+from prd.tracing import log_error, recent_runs, set_enabled, span, trace_page
+
+# --- Idle timeout (60 min): controllato anche nei rerun parziali dei fragment
+IDLE_MIN = 60
+def _check_idle():
+    _now = datetime.utcnow()
+    _last = st.session_state.get("_last_activity")
+    if _last and (_now - _last).total_seconds() > IDLE_MIN * 60:
+        st.warning("Sessione scaduta per inattività.")
+        _authenticator.logout(button_name="Rifai login", location="main")
+        st.stop()
+    st.session_state["_last_activity"] = _now
+
+_check_idle()
+
+# --- Barra utente + logout
+with st.sidebar:
+    st.success(f"✅ Autenticato: **{name}**")
+    _authenticator.logout(button_name="Logout", location="sidebar")
+
+_role = _credentials["usernames"][username]["role"]
+
+
+
+# ---------- STILE CLEAN + HEADER (un solo blocco, costante) ----------
+_STYLE = """
+<style>
+.block-container{padding-top:3.2rem !important;}
+/* Header clean */
+.prd-header{display:flex;align-items:center;gap:.6rem;margin:0 0 1rem 0}
+.prd-title{font-weight:800;font-size:1.6rem;letter-spacing:-.02em;margin:0;color:#111827}
+/* Card minimal */
+.prd-card{
+  border:1px solid #e5e7eb;
+  border-left:6px solid #2563eb;
+  border-radius:12px;
+  padding:14px 16px;
+  margin:12px 0;
+  background:#fff;
+  box-shadow:0 1px 2px rgba(0,0,0,.04);
+}
+.prd-h4{font-size:1.02rem;font-weight:800;color:#111827;margin:0 0 .4rem 0}
+.prd-meta{color:#374151;font-size:.92rem;margin-bottom:8px}
+.prd-chip{
+  display:inline-block;padding:3px 8px;margin:0 6px 6px 0;border-radius:999px;
+  background:#eff6ff;color:#1d4ed8;border:1px solid #dbeafe;font-weight:700;font-size:.78rem
+}
+.prd-sep{height:1px;background:#e5e7eb;margin:8px 0}
+.prd-kv{font-size:.9rem;color:#111827}
+/* Dataframe full width */
+[data-testid="stDataFrameResizable"]{width:100% !important;}
+</style>
+<div class="prd-header">
+  <span style="font-size:1.6rem">🛠️</span>
+  <div class="prd-title">Raccolta Dati Produzione</div>
+</div>
+"""
+st.markdown(_STYLE, unsafe_allow_html=True)
+
+# invio in background delle registrazioni rimaste in coda (anche dopo un riavvio)
+outbox.start()
+# il dataset (periodo di default) si scarica in background mentre la pagina si disegna
+if not st.session_state.get("_prefetched"):
+    st.session_state["_prefetched"] = True
+    prefetch_dataset(REMOTE_FILE)
+
+# ---------- DIAGNOSTICA (admin) ----------
+def diagnostica():
+    """Tempi delle ultime esecuzioni di pagina, passo per passo (dal modulo prd.tracing)."""
+    with st.expander("🩺 Diagnostica"):
+        on = st.toggle("Tracciamento attivo", value=tracing.enabled, key="diag_on")
+        if on != tracing.enabled:
+            set_enabled(on)
+        st.button("↻ Aggiorna", key="diag_refresh")
+        avvio = startup.report()
+        if avvio:
+            st.caption("Avvio del processo: " + " • ".join(f"{k} {v:.2f} s" for k, v in avvio.items()))
+        runs = recent_runs()
+        if not runs:
+            st.caption("Nessuna esecuzione registrata.")
+            return
+        st.dataframe(pd.DataFrame([{"ora": r["at"][11:], "pagina": r["run"], "ms": r["ms"], "passi": len(r["spans"]),
+                                    "errori": sum("error" in s for s in r["spans"])} for r in runs]),
+                     hide_index=True, use_container_width=True)
+        i = st.selectbox("Dettaglio", range(len(runs)), key="diag_run",
+                         format_func=lambda i: f"{runs[i]['at'][11:]} • {runs[i]['run']} ({runs[i]['ms']:.0f} ms)")
+        spans = pd.DataFrame(runs[i]["spans"]).reindex(columns=["name", "ms", "bytes", "rows", "error"])
+        if spans.empty:
+            return
+        per_passo = (spans.groupby("name").agg(volte=("ms", "size"), ms=("ms", "sum"), bytes=("bytes", "sum"),
+                                               righe=("rows", "max"))
+                     .sort_values("ms", ascending=False))
+        st.dataframe(per_passo, use_container_width=True)
+        for err in spans["error"].dropna():
+            st.caption(f"⚠️ {err}")
+        st.caption(f"Log: {tracing.LOG_FILE}")
+
+# ---------- SIDEBAR ----------
+with st.sidebar:
+    modes = ["✍️ Scrittura", "📖 Lettura", "📝 Modifica", "📊 Analisi"] + (["📥 Importa"] if _role == "admin" else [])
+    mode = st.radio("Modalità", modes, index=1)
+    if st.button("🔎 Verifica accesso"):
+        try:
+            here, version = ftp_run(lambda ftp: (ftp.pwd(), ftp_remote_version(ftp, REMOTE_FILE)))
+            stato = "(trovato)" if version is not None else "(archivio mensile)" if get_manifest(REMOTE_FILE) else "(vuoto)"
+            st.success(f"OK. Dir: {here} → File: {REMOTE_FILE} {stato}")
+        except Exception as e:
+            st.error(f"Verifica fallita: {e}")
+    if _role == "admin":
+        diagnostica()
+
+# ---------- SCRITTURA ----------
+@st.fragment
+@trace_page("Scrittura")
+def scrittura_page():
+    _check_idle()
+    st.subheader("✍️ Inserisci dati")
+
+    in_coda = outbox.pending()
+    if in_coda:
+        st.caption(f"📤 {in_coda} registrazioni in attesa di invio al server"
+                   + (f" — ultimo errore: {outbox.last_error}" if outbox.last_error else ""))
+
+    # le righe in coda senza numero prenderanno i prossimi CICLO NR liberi
+    next_ciclo_nr = get_next_ciclo_nr_from_server() + outbox.pending_auto()
+
+    operatore   = st.selectbox("Operatore", OPERATORI, 0)
+    data_lavoro = st.date_input("Data", value=date.today(), format="DD/MM/YYYY")
+
+    st.markdown("#### Dati tecnici")
+    c1, c2 = st.columns([2,3])
+    with c1: codice_materiale = st.text_input("CODICE Materiale").upper()
+    with c2: descrizione      = st.text_input("DESCRIZIONE")
+
+    c3, c4, c5 = st.columns(3)
+    with c3:
+        # ✅ SUGGERITO ma EDITABILE (niente disabled)
+        ciclo_nr = st.number_input(
+            "CICLO NR (suggerito)",
+            min_value=1,
+            value=next_ciclo_nr,
+            step=1
+        )
+        if ciclo_nr < next_ciclo_nr:
+            st.warning(
+                "Il valore è inferiore al suggerito (storico massimo + 1). "
+                "Attenzione a possibili duplicati già usati in passato."
+            )
+
+    with c4:
+        macchina = st.selectbox("MACCHINA",
+            ["DMG MORI","TAKISAWA","QUASER","MAZAK VCN 600","MAZAK VCN 530c", "MAZAK VRX","MAZAK HCN","HYUNDAI","HURCO"], 0)
+    with c5:
+        fase = st.selectbox("FASE",
+            ["Fase 1","Fase 2","Fase 3","Fase 4","Fase 5","Fase 6","Preparazione","Attrezzaggio","Programmazione"], 0)
+
+    c6, c7, c8 = st.columns(3)
+    with c6: numero_prg = st.text_input("NUMERO PRG")
+    with c7:
+        cartella_mac = st.selectbox("CARTELLA MACCHINA",
+                                    ["WASS", "EL.EN", "DUMAREY", "VARIE"], 0)
+    with c8:
+        tempo_min_input = st.number_input("Tempo fase (minuti)", min_value=0, value=0, step=1)
+
+    if st.button("📩 Invia"):
+        missing = []
+        if not codice_materiale: missing.append("CODICE Materiale")
+        if not descrizione:      missing.append("DESCRIZIONE")
+        if not fase:             missing.append("FASE")
+        if missing:
+            st.error("Compila: " + ", ".join(missing))
+        else:
+            min_tot = to_int_safe(tempo_min_input)
+            h = min_tot // 60
+            m = min_tot % 60
+            tempo_str = f"{h}:{m:02d}:00"
+
+            record = {
+                "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "OPERATORE": operatore,
+                "DATA": data_lavoro.strftime("%Y-%m-%d"),
+                "CODICE_MATERIALE": std(codice_materiale),
+                "DESCRIZIONE": std(descrizione),
+                "CICLO_NR": int(ciclo_nr),
+                "MACCHINA": std(macchina),
+                "NUMERO_PRG": std(numero_prg),
+                "CARTELLA_MACCHINA": std(cartella_mac),
+                "FASE": std(fase),
+                "TEMPO_FASE_MIN": tempo_str,  # HH:MM:SS per continuità
+            }
+
+            ciclo_req = None if ciclo_nr == next_ciclo_nr else int(ciclo_nr)
+            try:
+                # CICLO NR già usato, registrazione identica (doppio invio), PRG di un altro materiale
+                avvisi = check_record(record, duplicate_indexes(REMOTE_FILE, pd.DataFrame([record])),
+                                      outbox.pending_rows(), check_ciclo=ciclo_req is not None)
+            except Exception as e:
+                log_error("Controllo duplicati", e)
+                avvisi = []
+            if avvisi:
+                st.session_state["scrittura_dup"] = (record, ciclo_req, avvisi)
+            else:
+                _invia(record, ciclo_req, _chiave_invio(record, ciclo_req))
+
+    dup = st.session_state.get("scrittura_dup")
+    if dup:
+        record, ciclo_req, avvisi = dup
+        box = st.container()   # avvisi sopra i pulsanti, ma solo se non si invia
+        c1, c2 = st.columns(2)
+        c2.button("Annulla", on_click=lambda: st.session_state.pop("scrittura_dup", None))
+        if c1.button("📩 Invia comunque"):
+            st.session_state.pop("scrittura_dup", None)
+            _invia(record, ciclo_req, uuid.uuid4().hex)   # conferma esplicita: nuovo invio anche se identico
+        else:
+            for a in avvisi:
+                box.warning(f"⚠️ {a}")
+
+def _chiave_invio(record: dict, ciclo_req: int | None) -> str:
+    """
+    Chiave di idempotenza della registrazione: resta la stessa finché il form non cambia,
+    così un doppio click su Invia ripete lo stesso invio e la coda lo scarta. Timestamp
+    e CICLO NR suggerito (che avanza dopo ogni invio) non contano.
+    """
+    firma = json.dumps([{k: v for k, v in record.items() if k != "Timestamp" and (k != "CICLO_NR" or ciclo_req)},
+                        ciclo_req], sort_keys=True, default=str)
+    ss = st.session_state
+    if ss.get("scrittura_firma") != firma:
+        ss["scrittura_firma"], ss["scrittura_key"] = firma, uuid.uuid4().hex
+    return ss["scrittura_key"]
+
+def _invia(record: dict, ciclo_req: int | None, key: str):
+    try:
+        # la riga va nella coda locale: il CICLO NR suggerito viene riservato all'invio
+        # (se nel frattempo l'ha preso un altro operatore si usa il prossimo libero)
+        outbox.enqueue(record, ciclo_req, key=key)
+        st.success(f"✅ Tutto salavato, visto non è difficile, se ci riesce MICHELE!!!")
+        st.balloons()
+    except Exception as e:
+        st.error(f"❌ Errore salvataggio: {e}")
+
+# ---------- PERIODO (archivio mensile) ----------
+PERIODI = {"Ultimi 3 mesi": 3, "Ultimi 12 mesi": 12, "Tutto l'archivio": None}
+
+def _periodo(key: str, day=None, ciclo=None) -> dict:
+    """
+    Partizioni da caricare quando l'archivio è suddiviso per mese: il mese del
+    giorno filtrato, i mesi che contengono il CICLO NR, oppure il periodo scelto.
+    Dizionario vuoto con il file unico.
+    """
+    try:
+        if get_manifest(REMOTE_FILE) is None:
+            return {}
+    except Exception:
+        return {}
+    if day is not None:
+        return {"day": day}
+    if ciclo is not None:
+        return {"ciclo": ciclo}
+    scelta = st.selectbox("Periodo", list(PERIODI) + ["Intervallo date"], key=key)
+    if scelta != "Intervallo date":
+        return {"last_months": PERIODI[scelta]}
+    rng = st.date_input("Dal – al", value=(date.today() - timedelta(days=90), date.today()),
+                        format="DD/MM/YYYY", key=f"{key}_rng")
+    rng = tuple(rng) if isinstance(rng, (tuple, list)) else (rng,)
+    return {"start": rng[0] if rng else None, "end": rng[-1] if rng else None}
+
+def archivio_mensile():
+    """Stato dell'archivio mensile e migrazione una tantum dal file unico (admin)."""
+    manifest = get_manifest(REMOTE_FILE)
+    with st.expander("🗂️ Archivio mensile" + (f": {len(manifest['partitions'])} partizioni" if manifest else " (file unico)")):
+        if manifest:
+            st.dataframe(pd.DataFrame.from_dict(manifest["partitions"], orient="index").sort_index(),
+                         use_container_width=True)
+            return
+        st.caption("Un CSV per mese + manifest: letture, modifiche e backup toccano solo i mesi necessari. "
+                   f"Il file unico resta sul server come {REMOTE_FILE}.pre_partizioni.")
+        if st.button("Suddividi per mese"):
+            try:
+                with ftp_session() as ftp:
+                    manifest = migrate_to_partitions(ftp, REMOTE_FILE)
+                st.success(f"✅ Creati {len(manifest['partitions'])} file mensili.")
+            except Exception as e:
+                st.error(f"❌ Migrazione non eseguita: {e}")
+
+def controllo_duplicati():
+    """Report di coerenza su tutto lo storico (admin), calcolato in background."""
+    ss = st.session_state
+    with st.expander("🔁 Controllo duplicati (tutto lo storico)"):
+        c1, c2, c3 = st.columns([3, 1, 1])
+        if c2.button("▶️ Avvia controllo", key="dup_avvia"):
+            ss["dup_report"] = datetime.now().strftime("%H:%M:%S")
+        c3.button("↻ Aggiorna", key="dup_aggiorna")
+        if "dup_report" not in ss:
+            c1.caption("CICLO NR ripetuti, registrazioni identiche (stessa DATA, OPERATORE, MATERIALE, FASE, "
+                       "MACCHINA), NUMERO PRG usati per più materiali e minuti contati in più per macchina.")
+            return
+        fut = report_in_background((REMOTE_FILE, ss["dup_report"]),
+                                   lambda: load_dataset(REMOTE_FILE, last_months=None))
+        if not fut.done():
+            c1.info(f"⏳ Controllo avviato alle {ss['dup_report']}: premi Aggiorna per il risultato.")
+            return
+        try:
+            rep = fut.result()
+        except Exception as e:
+            c1.error(f"❌ Controllo non riuscito: {e}")
+            return
+        c1.caption(f"Controllo delle {ss['dup_report']} su {rep['rows']} righe.")
+        m1, m2, m3 = st.columns(3)
+        m1.metric("CICLO NR ripetuti", int(rep["cicli"]["CICLO_NR"].nunique()) if len(rep["cicli"]) else 0)
+        m2.metric("Registrazioni identiche", len(rep["registrazioni"]))
+        m3.metric("PRG su più materiali", len(rep["prg"]))
+        if len(rep["gonfiati"]):
+            st.markdown("**Minuti contati in più per macchina** (copie oltre la prima)")
+            st.dataframe(rep["gonfiati"].assign(ORE_IN_PIÙ=rep["gonfiati"]["MINUTI_IN_PIÙ"].map(minutes_to_hhmm)),
+                         use_container_width=True, hide_index=True)
+        for titolo, k in [("CICLO NR ripetuti", "cicli"), ("Registrazioni identiche", "registrazioni"),
+                          ("NUMERO PRG usati per più materiali", "prg")]:
+            if len(rep[k]):
+                st.markdown(f"**{titolo}**")
+                st.dataframe(rep[k].head(1000), use_container_width=True, hide_index=k == "prg")
+
+# ---------- MODIFICA ----------
+@st.fragment
+@trace_page("Modifica record")
+def modifica_record(idx, r, parts):
+    """Form di un record: il "Salva" riesegue solo questo blocco."""
+    _check_idle()
+    st.markdown(f"<div class='prd-sep'></div>", unsafe_allow_html=True)
+    # valori come testo (il dataset è tipizzato: tempo in minuti, NA per i vuoti)
+    shown = {c: fmt_cell(r.get(c)) for c in
+             ["CODICE_MATERIALE","DESCRIZIONE","CICLO_NR","MACCHINA","FASE","NUMERO_PRG","CARTELLA_MACCHINA"]}
+    shown["TEMPO_FASE_MIN"] = minutes_to_hhmmss(r.get("TEMPO_FASE_MIN"))
+    with st.form(f"edit_{idx}"):
+        st.markdown(f"#### 🔧 Modifica — CICLO {r.get('CICLO_NR','')} | {r.get('CODICE_MATERIALE','')}")
+
+        col1, col2 = st.columns([2,3])
+        with col1: codice_materiale = st.text_input("CODICE Materiale", shown["CODICE_MATERIALE"], key=f"cod_{idx}")
+        with col2: descrizione = st.text_input("DESCRIZIONE", shown["DESCRIZIONE"], key=f"desc_{idx}")
+
+        col3, col4, col5 = st.columns(3)
+        with col3: ciclo_nr = st.number_input("CICLO NR", min_value=1, value=int(shown["CICLO_NR"] or 1), step=1, key=f"ciclo_{idx}")
+        with col4: macchina  = st.text_input("MACCHINA", shown["MACCHINA"], key=f"mac_{idx}")
+        with col5: fase      = st.text_input("FASE", shown["FASE"], key=f"fase_{idx}")
+
+        col6, col7, col8 = st.columns(3)
+        with col6: numero_prg = st.text_input("NUMERO PRG", shown["NUMERO_PRG"], key=f"prg_{idx}")
+        with col7: cartella_mac = st.text_input("CARTELLA MACCHINA", shown["CARTELLA_MACCHINA"], key=f"cart_{idx}")
+        with col8: tempo_min = st.text_input("Tempo fase (hh:mm:ss)", shown["TEMPO_FASE_MIN"], key=f"time_{idx}")
+
+        submitted = st.form_submit_button("💾 Salva")
+
+    if submitted:
+        updated_row = {
+            "CODICE_MATERIALE": codice_materiale,
+            "DESCRIZIONE": descrizione,
+            "CICLO_NR": int(ciclo_nr),
+            "MACCHINA": macchina,
+            "FASE": fase,
+            "NUMERO_PRG": numero_prg,
+            "CARTELLA_MACCHINA": cartella_mac,
+            "TEMPO_FASE_MIN": tempo_min,
+        }
+        changes = {c: v for c, v in updated_row.items() if str(v) != shown[c]}
+        if "CICLO_NR" in changes and _cicli_doppi({idx: changes["CICLO_NR"]}, {idx: shown["CICLO_NR"]}):
+            st.error(f"❌ CICLO NR {changes['CICLO_NR']} già usato da un'altra registrazione.")
+            return
+
+        # --- SALVATAGGIO SU FTP: una riga nel journal del file da cui viene (idx = posizione nel dataset) ---
+        try:
+            if changes:
+                with ftp_session() as ftp:
+                    save_dataset_changes(ftp, parts, [(idx, r.get("Timestamp", ""), changes)], user=username)
+            st.success(f"✅ Riga con CICLO {r.get('CICLO_NR','')} salvata correttamente!")
+        except Exception as e:
+            st.error(f"❌ Errore nel salvataggio della riga {idx+1}: {e}")
+
+def _cicli_doppi(nuovi: dict[int, int], attuali: dict[int, str]) -> list[int]:
+    """Righe modificate il cui nuovo CICLO NR è già usato (su tutto l'archivio) o ripetuto."""
+    if not nuovi:
+        return []
+    old = {r: int(v) for r, v in attuali.items() if str(v).strip().isdigit()}
+    try:
+        indexes = duplicate_indexes(REMOTE_FILE, pd.DataFrame({"CICLO_NR": list(nuovi.values())}))
+    except Exception as e:
+        log_error("Controllo duplicati", e)
+        return []
+    return ciclo_conflicts(nuovi, indexes, old)
+
+def modifica_griglia(ds, rows, filters):
+    """
+    Griglia sulle righe trovate. Le modifiche si confrontano con la versione
+    caricata alla ricerca (tenuta in session_state finché non si salva o
+    ricarica) e si salvano tutte con un solo APPE sul journal.
+    """
+    ss = st.session_state
+    ss.setdefault("mod_grid_n", 0)
+    if ss.get("mod_grid") is None or ss["mod_grid"]["filters"] != filters:
+        ss["mod_grid_n"] += 1   # nuova chiave: la griglia riparte senza modifiche pendenti
+        ss["mod_grid"] = {"filters": filters, "parts": ds.parts, "base": edit_frame(ds.df, rows)}
+    grid = ss["mod_grid"]
+    base = grid["base"]
+
+    if ss.get("mod_grid_msg"):
+        st.success(ss.pop("mod_grid_msg"))
+    st.markdown(f"### ✏️ Record trovati: {len(base)} — Modifica le celle e salva tutto insieme")
+    edited = st.data_editor(
+        base, key=f"grid_{ss['mod_grid_n']}", num_rows="fixed", use_container_width=True,
+        disabled=READONLY_COLUMNS,
+        column_config={"TEMPO_FASE_MIN": st.column_config.TextColumn("Tempo fase (hh:mm:ss)")},
+    )
+    changed = diff_edits(base, edited)
+    n_changed = int(changed.any(axis=1).sum())
+
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        st.button("↻ Ricarica", use_container_width=True, on_click=lambda: ss.update(mod_grid=None))
+    with col1:
+        save = st.button(f"💾 Salva {n_changed} righe modificate", disabled=n_changed == 0)
+    if not save:
+        return
+
+    errors = validate_edits(edited, changed)
+    if errors:
+        for e in errors:
+            st.error(f"❌ {e}")
+        return
+    changes = changes_from_edits(base, edited, changed)
+    nuovi = {row: vals["CICLO_NR"] for row, _, vals in changes if "CICLO_NR" in vals}
+    doppi = _cicli_doppi(nuovi, {row: base.at[row, "CICLO_NR"] for row in nuovi})
+    if doppi:
+        st.error(f"❌ CICLO_NR già usato o ripetuto: righe {', '.join(str(r) for r in doppi[:20])}"
+                 + (" …" if len(doppi) > 20 else ""))
+        return
+    try:
+        with ftp_session() as ftp:
+            check_parts_unchanged(ftp, grid["parts"], base.loc[[row for row, _, _ in changes]])
+            save_dataset_changes(ftp, grid["parts"], changes, user=username)
+    except Exception as e:
+        st.error(f"❌ Salvataggio non eseguito: {e}")
+        return
+    ss["mod_grid"] = None
+    ss["mod_grid_msg"] = f"✅ Salvate {len(changes)} righe con un solo invio."
+    st.rerun(scope="fragment")
+
+@st.fragment
+@trace_page("Modifica")
+def modifica_page():
+    _check_idle()
+    st.subheader("📝 Modifica dati esistenti")
+
+    # --- FILTRI DI RICERCA ---
+    st.markdown("### 🔎 Ricerca record")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1: flt_codice = st.text_input("CODICE Materiale contiene")
+    with col2: flt_descr  = st.text_input("DESCRIZIONE contiene")
+    with col3: flt_ciclo  = st.text_input("CICLO NR esatto")
+    with col4: flt_prg    = st.text_input("NUMERO PRG contiene")
+    ciclo = int(flt_ciclo.strip()) if flt_ciclo.strip().isdigit() else None
+    selection = _periodo("mod_periodo", ciclo=ciclo)
+
+    # la ricerca resta attiva anche nei rerun dei pulsanti "Salva"
+    if st.button("🔍 RICERCA"):
+        st.session_state["mod_ricerca"] = True
+
+    # --- carica dataset (cache condivisa, rivalidata su SIZE/MDTM; solo i mesi necessari) ---
+    try:
+        with st.spinner("Caricamento dati…"):
+            ds = load_dataset(REMOTE_FILE, **selection)
+        if ds is None:
+            st.warning("Nessun dato disponibile per la modifica.")
+            return
+        df, sep = ds.df, ds.sep
+        if "TEMPO_FASE_MIN" not in df.columns:
+            df = df.assign(TEMPO_FASE_MIN="")
+    except Exception as e:
+        st.error(f"Errore durante il caricamento: {e}")
+        return
+
+    if _role == "admin":
+        with st.expander("🗜️ Modifiche in attesa di compattazione: " + str(ds.journal_entries)):
+            if st.button("Compatta ora nel CSV"):
+                try:
+                    with ftp_session() as ftp:
+                        n = sum(compact_journal(ftp, fname) for fname, *_ in ds.parts)
+                    st.success(f"✅ Compattate {n} modifiche.")
+                except Exception as e:
+                    st.error(f"❌ Compattazione fallita: {e}")
+        archivio_mensile()
+        controllo_duplicati()
+
+    # --- SE L’UTENTE NON HA ANCORA CERCATO ---
+    if not st.session_state.get("mod_ricerca"):
+        st.info("Inserisci uno o più criteri di ricerca, poi premi **RICERCA** per visualizzare i record modificabili.")
+        return
+
+    # --- FILTRA IL DATAFRAME (indice di ricerca della versione in cache) ---
+    rows = ds.search.query(
+        contains={"CODICE_MATERIALE": flt_codice, "DESCRIZIONE": flt_descr, "NUMERO_PRG": flt_prg},
+        equals={"CICLO_NR": flt_ciclo.strip()},
+    )
+    fdf = df if rows is None else df.iloc[rows]
+
+    # --- NESSUN RECORD TROVATO ---
+    if fdf.empty:
+        st.warning("⚠️ Nessun record trovato con i criteri indicati.")
+        return
+
+    # --- MODIFICA A GRIGLIA: tutte le righe trovate, un solo salvataggio ---
+    if st.toggle("Modifica a griglia (più righe, un solo salvataggio)", value=True, key="mod_griglia"):
+        modifica_griglia(ds, fdf.index, (flt_codice, flt_descr, flt_ciclo, flt_prg, str(selection)))
+        return
+
+    # --- MOSTRA AREA DI MODIFICA ---
+    st.markdown(f"### ✏️ Record trovati: {len(fdf)} — Modifica i campi e salva")
+    for idx, r in fdf.iterrows():
+        with st.container():   # un contenitore per record: id di fragment distinti
+            modifica_record(idx, r, ds.parts)
+
+    else:
+        st.dataframe(fdf, use_container_width=True, height=500)
+        st.info("Filtra ulteriormente per ottenere un solo record da modificare.")
+
+# ---------- LETTURA ----------
+@st.fragment
+@trace_page("Lettura")
+def lettura_page():
+    _check_idle()
+    st.subheader("📘 Consultazione dati")
+
+    ss = st.session_state
+    ss.setdefault("flt_operatore","(tutti)")
+    ss.setdefault("flt_codice","")
+    ss.setdefault("flt_descr","")
+    ss.setdefault("flt_data",None)
+
+    st.markdown("### 🔎 Filtra")
+    with st.container():
+        col1, col2, col3, col4, col5, col6 = st.columns([1, 1.2, 2, 1.1, 1.3, .9])
+        with col1:
+            ss.flt_operatore = st.selectbox(
+                "Operatore", ["(tutti)"] + OPERATORI,
+                index=(["(tutti)"] + OPERATORI).index(ss.flt_operatore)
+            )
+        with col2:
+            ss.flt_codice = st.text_input("CODICE Materiale contiene", ss.flt_codice)
+        with col3:
+            ss.flt_descr = st.text_input("DESCRIZIONE contiene", ss.flt_descr)
+        with col4:
+            ss.flt_cartella = st.text_input("CARTELLA contiene", ss.get("flt_cartella", ""))
+        with col5:
+            ss.flt_data = st.date_input("Solo data", value=ss.flt_data)
+        with col6:
+            if st.button("↺ Reset filtri"):
+                ss.flt_operatore = "(tutti)"
+                ss.flt_codice = ""
+                ss.flt_descr = ""
+                ss.flt_cartella = ""
+                ss.flt_data = None
+                st.rerun(scope="fragment")
+
+    # archivio mensile: solo il mese del giorno filtrato o il periodo scelto
+    selection = _periodo("let_periodo", day=ss.flt_data)
+
+    try:
+        with st.spinner("Caricamento dati…"):
+            ds = load_dataset(REMOTE_FILE, **selection)
+    except Exception as e:
+        ds = None; st.error(f"Lettura FTP: {e}")
+
+    if ds is None:
+        st.info(f"Nessun dato presente in {PRIMARY_DIR}/{REMOTE_FILE}.")
+    else:
+        df, sep = ds.view, ds.sep
+
+        preferred = ["Timestamp","OPERATORE","DATA","CODICE_MATERIALE","DESCRIZIONE","CICLO_NR",
+                     "MACCHINA","NUMERO_PRG","CARTELLA_MACCHINA","FASE","TEMPO_FASE_MIN","TEMPO_FASE (hh:mm)"]
+        cols = [c for c in preferred if c in df.columns] + [c for c in df.columns if c not in preferred]
+        df = df[cols]
+
+        rows = ds.search.query(
+            contains={"CODICE_MATERIALE": ss.flt_codice, "DESCRIZIONE": ss.flt_descr,
+                      "CARTELLA_MACCHINA": ss.flt_cartella},
+            equals={"OPERATORE": None if ss.flt_operatore == "(tutti)" else ss.flt_operatore,
+                    "DATA": ss.flt_data},
+        )
+        fdf = df if rows is None else df.iloc[rows]
+
+        if "Timestamp" in fdf:   # già datetime nel dataset tipizzato
+            fdf = fdf.sort_values("Timestamp", ascending=False)
+
+        st.markdown("### 👀 Visualizzazione")
+        left, _ = st.columns([1,4])
+        show_cards = left.toggle("Modalità mobile-friendly (schede)", value=True)
+
+        if show_cards:
+            if fdf.empty:
+                st.info("Nessun record corrisponde ai filtri.")
+            else:
+                # pagina corrente: si riparte dalla prima quando cambiano i filtri
+                n_pages = page_count(len(fdf))
+                filters = (ss.flt_operatore, ss.flt_codice, ss.flt_descr, ss.flt_cartella, ss.flt_data)
+                if ss.get("_cards_filters") != filters:
+                    ss["_cards_filters"] = filters
+                    ss["card_page"] = 1
+                ss["card_page"] = min(max(1, ss.get("card_page", 1)), n_pages)
+
+                def _move(step):
+                    ss["card_page"] = min(max(1, ss["card_page"] + step), n_pages)
+
+                nav1, nav2, nav3 = st.columns([1, 2, 1])
+                nav1.button("◀", on_click=_move, args=(-1,), disabled=ss["card_page"] <= 1, use_container_width=True)
+                nav2.number_input(f"Pagina (di {n_pages})", min_value=1, max_value=n_pages, key="card_page",
+                                  label_visibility="collapsed")
+                nav3.button("▶", on_click=_move, args=(1,), disabled=ss["card_page"] >= n_pages, use_container_width=True)
+
+                start = (ss["card_page"] - 1) * CARD_PAGE_SIZE
+                page = fdf.iloc[start:start + CARD_PAGE_SIZE]
+                st.caption(f"Record {start + 1}–{start + len(page)} di {len(fdf)} • pagina {ss['card_page']} di {n_pages}")
+                st.markdown(cards_html(page), unsafe_allow_html=True)
+        else:
+            with span("render.tabella", rows=len(fdf)):
+                st.dataframe(fdf, use_container_width=True, height=620,
+                             column_config={"DATA": st.column_config.DateColumn("DATA", format="YYYY-MM-DD")})
+
+        # --- export: il file si genera solo quando viene chiesto (poi resta in cache) ---
+        st.markdown("### ⬇️ Esporta")
+        e1, e2, e3 = st.columns([2, 1, 1.4])
+        content = e1.selectbox("Contenuto", list(CONTENTS), key="exp_content")
+        fmt = e2.selectbox("Formato", list(FORMATS), key="exp_format")
+        key = (ds.filename, ds.version, ds.journal_version, str(selection), ss.flt_operatore, ss.flt_codice,
+               ss.flt_descr, ss.flt_cartella, ss.flt_data)
+        data = cached_export(key, content, fmt)
+        with e3:
+            st.write("")
+            if data is None and st.button("Prepara file", use_container_width=True):
+                try:
+                    with st.spinner("Preparazione export…"):
+                        data = get_export(key, lambda: fdf, content, fmt, sep)
+                except Exception as e:
+                    st.error(f"❌ Export non riuscito: {e}")
+            if data is not None:
+                ext, mime = FORMATS[fmt]
+                stem = "estratto_prd" if CONTENTS[content] is None else f"riepilogo_{CONTENTS[content].lower()}"
+                st.download_button(f"⬇️ Scarica {fmt}", data=data, file_name=f"{stem}.{ext}", mime=mime,
+                                   use_container_width=True)
+
+
+# ---------- IMPORTA ----------
+@st.fragment
+@trace_page("Importa")
+def importa_page():
+    _check_idle()
+    st.subheader("📥 Importa registrazioni da file")
+    ss = st.session_state
+
+    up = st.file_uploader("File CSV o Excel (una riga per registrazione)", type=["csv", "txt", "xlsx", "xlsm"],
+                          key=f"imp_file_{ss.get('imp_n', 0)}")
+    if ss.get("imp_msg"):
+        st.success(ss.pop("imp_msg"))
+    if up is None:
+        st.info("Il file viene controllato per intero prima dell'invio: le righe valide vengono accodate "
+                "con un solo invio, CICLO NR vuoti assegnati in blocco.")
+        return
+
+    try:
+        src = read_upload(up.name, up.getvalue())
+    except Exception as e:
+        st.error(f"❌ File non leggibile: {e}")
+        return
+
+    # --- corrispondenza colonne (proposta dai nomi, modificabile) ---
+    st.markdown(f"### 🔗 Colonne ({len(src)} righe nel file)")
+    guess = guess_mapping(list(src.columns))
+    options = ["(nessuna)"] + list(src.columns)
+    mapping = {}
+    cols = st.columns(4)
+    for i, (target, found) in enumerate(guess.items()):
+        with cols[i % 4]:
+            sel = st.selectbox(target, options, index=options.index(found) if found else 0, key=f"imp_map_{target}")
+        mapping[target] = None if sel == "(nessuna)" else sel
+    st.caption("Timestamp vuoto = ora dell'importazione • CICLO NR vuoto = prossimo libero • "
+               "senza colonna tempo si usano ORE e MINUTI (se mancano anche queste le righe sono scartate).")
+
+    rows, errors = prepare_import(src, mapping)
+    try:
+        dup = flag_duplicates(rows, duplicate_indexes(REMOTE_FILE, rows))
+    except Exception as e:
+        log_error("Controllo duplicati", e)
+        dup = pd.Series("", index=rows.index, dtype=object)
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Righe valide", len(rows))
+    c2.metric("Righe con errori", len(errors))
+    c3.metric("Possibili duplicati", int((dup != "").sum()))
+    if len(errors):
+        with st.expander(f"⚠️ Errori ({len(errors)} righe, escluse dall'importazione)", expanded=rows.empty):
+            st.dataframe(errors, use_container_width=True, hide_index=True)
+            st.download_button("⬇️ Scarica errori", errors.to_csv(index=False, sep=";").encode("utf-8"),
+                               file_name="errori_import.csv", mime="text/csv")
+    if (dup != "").any():
+        with st.expander(f"🔁 Possibili duplicati ({int((dup != '').sum())} righe)"):
+            st.dataframe(rows[dup != ""].assign(MOTIVO=dup[dup != ""]).head(500), use_container_width=True,
+                         hide_index=True)
+        if st.checkbox("Escludi i possibili duplicati", value=True, key="imp_escludi"):
+            rows = rows[dup == ""]
+    if rows.empty:
+        return
+    st.dataframe(rows.head(50), use_container_width=True, hide_index=True)
+
+    if st.button(f"📤 Importa {len(rows)} righe valide", type="primary"):
+        try:
+            with st.spinner("Invio in corso…"):
+                first = import_rows(rows)
+            ss["imp_msg"] = f"✅ Importate {len(rows)} righe" + (f" (CICLO NR da {first})." if first else ".")
+            ss["imp_n"] = ss.get("imp_n", 0) + 1   # svuota l'uploader
+            st.rerun()
+        except Exception as e:
+            st.error(f"❌ Importazione fallita: {e}")
+
+# ---------- ANALISI (solo sui riepiloghi: il costo non cresce con le righe) ----------
+DIMENSIONI = {"Macchina": "MACCHINA", "Operatore": "OPERATORE", "Fase": "FASE",
+              "Materiale": "CODICE_MATERIALE", "Giorno": "DATA"}
+MISURE = {"Tempo totale (min)": "TEMPO_MIN", "Minuti medi per riga": "MEDIA_MIN",
+          "Righe": "RIGHE"}
+# Barre mostrate al massimo nel grafico (le voci con la misura più alta)
+MAX_BARRE = 25
+
+@st.fragment
+@trace_page("Analisi")
+def analisi_page():
+    _check_idle()
+    st.subheader("📊 Analisi produzione")
+    selection = _periodo("an_periodo")
+    try:
+        with st.spinner("Caricamento dati…"):
+            ds = load_dataset(REMOTE_FILE, **selection)
+    except Exception as e:
+        st.error(f"Lettura FTP: {e}")
+        return
+    if ds is None:
+        st.info(f"Nessun dato presente in {PRIMARY_DIR}/{REMOTE_FILE}.")
+        return
+
+    roll = ds.rollup
+    days = sorted(d for d in roll.index.unique("DATA") if d)
+    if not days:
+        st.info("Nessuna registrazione con DATA valida.")
+        return
+    first, last = date.fromisoformat(days[0]), date.fromisoformat(days[-1])
+
+    c1, c2, c3 = st.columns([1.4, 2, 2])
+    rng = c1.date_input("Dal – al", value=(max(first, last - timedelta(days=30)), last), min_value=first,
+                        max_value=last, format="DD/MM/YYYY", key="an_rng")
+    rng = tuple(rng) if isinstance(rng, (tuple, list)) else (rng,)
+    start, end = (rng[0].isoformat(), rng[-1].isoformat()) if rng else (None, None)
+    macchine = c2.multiselect("Macchina", sorted(v for v in roll.index.unique("MACCHINA") if v), key="an_macchine")
+    operatori = c3.multiselect("Operatore", sorted(v for v in roll.index.unique("OPERATORE") if v), key="an_operatori")
+    rows = query(roll, start, end, {"MACCHINA": macchine, "OPERATORE": operatori})
+    if rows.empty:
+        st.info("Nessuna registrazione nel periodo e con i filtri scelti.")
+        return
+
+    tot = rows[["TEMPO_MIN", "RIGHE"]].sum()
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Tempo totale", minutes_to_hhmm(tot["TEMPO_MIN"]))
+    m2.metric("Righe", int(tot["RIGHE"]))
+    m3.metric("Minuti medi per riga", round(tot["TEMPO_MIN"] / tot["RIGHE"], 1))
+
+    st.markdown("### 📈 Andamento giornaliero")
+    trend = pivot(rows, "DATA", measure="TEMPO_MIN")
+    trend.index = pd.to_datetime(trend.index)
+    st.line_chart(trend.rename(columns={"TEMPO_MIN": "minuti"}))
+
+    st.markdown("### 🧮 Tabella pivot")
+    p1, p2, p3 = st.columns(3)
+    righe = p1.selectbox("Righe", list(DIMENSIONI), key="an_righe")
+    colonne = p2.selectbox("Colonne", ["(nessuna)"] + list(DIMENSIONI), index=3, key="an_colonne")
+    misura = p3.selectbox("Misura", list(MISURE), key="an_misura")
+    bars = pivot(rows, DIMENSIONI[righe], measure=MISURE[misura]).iloc[:, 0].nlargest(MAX_BARRE)
+    st.bar_chart(bars.rename(misura), horizontal=True)
+    st.dataframe(pivot(rows, DIMENSIONI[righe], None if colonne == "(nessuna)" else DIMENSIONI[colonne],
+                       MISURE[misura]), use_container_width=True)
+
+# ---------- PAGINA (ogni pagina è un fragment: i widget rieseguono solo la loro parte) ----------
+if mode == "✍️ Scrittura":
+    scrittura_page()
+elif mode == "📝 Modifica":
+    modifica_page()
+elif mode == "📥 Importa":
+    importa_page()
+elif mode == "📊 Analisi":
+    analisi_page()
+else:
+    lettura_page()
+startup.mark("prima pagina")
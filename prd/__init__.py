@@ -0,0 +1 @@
+"""Backend dell'app PRD • Raccolta Dati (FTP, CSV, cache)."""
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime
+from ftplib import FTP, error_perm
+
+from .ftp import ftp_download_file, ftp_file_exists_and_size, ftp_parallel, ftp_run, ftp_upload_file
+from .lease import known_generation
+
+# Retention: ultimi N giorni + il primo backup di ciascuno degli ultimi M mesi
+KEEP_DAILY   = 7
+KEEP_MONTHLY = 12
+# Byte finali del backup precedente riletti per verificare che il file non sia stato riscritto
+TAIL_CHECK   = 256
+
+# un backup alla volta per file: partizioni diverse (e la coda di invio) non si aspettano
+_locks: dict[str, threading.Lock] = {}
+_guard = threading.Lock()
+# filename -> (giorno, generazione) per cui il backup del giorno è già sul server: gli APPE
+# successivi non rileggono manifest ed elenco. Si torna sul server al cambio di giorno o
+# quando questo processo vede una nuova generazione (riscrittura, anche di altri).
+_done: dict[str, tuple[str, int | None]] = {}
+
+
+# ---------- BACKUP (full mensile + segmenti incrementali) ----------
+def _file_lock(filename: str) -> threading.Lock:
+    with _guard:
+        return _locks.setdefault(filename, threading.Lock())
+
+def _manifest_name(filename: str) -> str:
+    return f"{filename}.bak_manifest.json"
+
+def _tail_hash(data: bytes) -> str:
+    return hashlib.sha1(data[-TAIL_CHECK:]).hexdigest()
+
+def _list_backups(ftp: FTP, filename: str) -> list[str]:
+    try:
+        names = ftp.nlst()
+    except error_perm:   # alcuni server rispondono 550 se la directory è vuota
+        return []
+    prefix = f"{filename}.bak_"
+    return [n.rsplit("/", 1)[-1] for n in names if n.rsplit("/", 1)[-1].startswith(prefix)]
+
+def load_manifest(ftp: FTP, filename: str) -> list[dict]:
+    """
+    Voci del manifest in ordine di data. Ogni voce:
+      date, kind ("full"|"incr"), name (None se il segmento è vuoto),
+      start/end (intervallo di byte del file coperto), tail (hash degli ultimi byte).
+    """
+    data = ftp_download_file(ftp, _manifest_name(filename))
+    entries = json.loads(data.decode("utf-8"))["entries"] if data else []
+    known = {e["name"] for e in entries}
+    # backup completi creati prima del manifest (.bak_YYYYMMDD)
+    for name in _list_backups(ftp, filename):
+        m = re.fullmatch(re.escape(filename) + r"\.bak_(\d{8})", name)
+        if m and name not in known:
+            _, size = ftp_file_exists_and_size(ftp, name)
+            entries.append({"date": m.group(1), "kind": "full", "name": name,
+                            "start": 0, "end": size, "tail": None})
+    return sorted(entries, key=lambda e: e["date"])
+
+def _save_manifest(ftp: FTP, filename: str, entries: list[dict]):
+    payload = json.dumps({"entries": entries}, indent=1).encode("utf-8")
+    ftp_upload_file(ftp, _manifest_name(filename), payload)
+
+
+def _incremental(ftp: FTP, filename: str, prev: dict, size: int) -> tuple[bytes, str] | None:
+    """Byte accodati dopo il backup precedente + nuovo hash di coda; None se serve un full."""
+    if prev.get("tail") is None or size < prev["end"]:
+        return None
+    overlap = min(TAIL_CHECK, prev["end"])
+    data = ftp_download_file(ftp, filename, offset=prev["end"] - overlap) or b""
+    if _tail_hash(data[:overlap]) != prev["tail"]:
+        return None   # file riscritto (Modifica/compattazione) dopo l'ultimo backup
+    return data[overlap:], _tail_hash(data)
+
+
+def backup_file(ftp: FTP, filename: str, data: bytes | None = None) -> dict | None:
+    """
+    Backup giornaliero del file: nessun trasferimento se quello di oggi esiste già.
+    Il primo backup del mese (o dopo una riscrittura) è completo, gli altri
+    salvano solo i byte accodati dal backup precedente. `data`, se passato, è il
+    contenuto attuale già in memoria (evita il download per il backup completo).
+    """
+    with _file_lock(filename):
+        stamp = datetime.now().strftime("%Y%m%d")
+        key = (stamp, known_generation(filename))
+        if _done.get(filename) == key:
+            return None
+        entries = load_manifest(ftp, filename)
+        if any(e["date"] == stamp for e in entries):
+            _done[filename] = key
+            return None
+
+        exists, size = ftp_file_exists_and_size(ftp, filename)
+        if not exists or size == 0:
+            return None
+
+        prev = entries[-1] if entries else None
+        inc = None
+        if prev is not None and prev["date"][:6] == stamp[:6]:
+            inc = _incremental(ftp, filename, prev, size)
+
+        if inc is not None:
+            segment, tail = inc
+            name = f"{filename}.bak_{stamp}.inc" if segment else None
+            if name:
+                ftp_upload_file(ftp, name, segment)
+            entry = {"date": stamp, "kind": "incr", "name": name,
+                     "start": prev["end"], "end": prev["end"] + len(segment), "tail": tail}
+        else:
+            if data is None or len(data) != size:
+                data = ftp_download_file(ftp, filename)
+            name = f"{filename}.bak_{stamp}"
+            ftp_upload_file(ftp, name, data)
+            entry = {"date": stamp, "kind": "full", "name": name,
+                     "start": 0, "end": len(data), "tail": _tail_hash(data)}
+
+        entries.append(entry)
+        entries = cleanup_old_backups(ftp, filename, entries)
+        _save_manifest(ftp, filename, entries)
+        _done[filename] = key
+        return entry
+
+
+def _chain(entries: list[dict], i: int) -> list[dict]:
+    """Backup completo di base + incrementali fino alla voce i compresa."""
+    j = i
+    while entries[j]["kind"] != "full":
+        j -= 1
+    return entries[j:i + 1]
+
+def cleanup_old_backups(ftp: FTP, filename: str, entries: list[dict],
+                        keep_daily: int = KEEP_DAILY, keep_monthly: int = KEEP_MONTHLY) -> list[dict]:
+    """Applica la retention (con le catene di incrementali necessarie) e cancella il resto."""
+    keep_idx = set(range(max(0, len(entries) - keep_daily), len(entries)))
+    months = []
+    for i, e in enumerate(entries):
+        if not months or months[-1][0] != e["date"][:6]:
+            months.append((e["date"][:6], i))
+    keep_idx |= {i for _, i in months[-keep_monthly:]}
+
+    keep = set()
+    for i in keep_idx:
+        keep |= {id(e) for e in _chain(entries, i)}
+
+    kept = []
+    for e in entries:
+        if id(e) in keep:
+            kept.append(e)
+        elif e["name"]:
+            try:
+                ftp.delete(e["name"])
+            except error_perm:
+                pass
+    return kept
+
+
+def restore_backup(ftp: FTP, filename: str, date: str) -> bytes:
+    """Ricostruisce il contenuto del file al backup del giorno `date` (YYYYMMDD)."""
+    entries = load_manifest(ftp, filename)
+    idx = [i for i, e in enumerate(entries) if e["date"] <= date]
+    if not idx:
+        raise RuntimeError(f"Nessun backup disponibile al {date}.")
+    chain = _chain(entries, idx[-1])
+    # segmenti della catena scaricati in parallelo, ciascuno su una connessione del pool
+    parts = ftp_parallel([lambda n=e["name"]: ftp_run(lambda f: ftp_download_file(f, n)) if n else b""
+                          for e in chain])
+    out = bytearray()
+    for e, data in zip(chain, parts):
+        if e["start"] != len(out):
+            raise RuntimeError(f"Catena di backup incompleta a {e['date']}.")
+        out += data or b""
+    return bytes(out)
@@ -0,0 +1,310 @@
+import threading
+import time
+from dataclasses import dataclass, field, replace
+
+import pandas as pd
+
+from .config import REMOTE_FILE
+from .data import concat_typed, ingest_csv, normalize_time_columns
+from .dupes import DuplicateIndex
+from .ftp import ftp_download_file, ftp_read_head, ftp_remote_version, ftp_run, ftp_try_run
+from .journal import apply_patches, journal_name, parse_journal
+from .lease import read_version
+from .rollups import aggregate, combine, rollup_after_patches
+from .search import SearchIndex
+from .snapshot import read_snapshot
+from .tracing import log_error
+
+# Entro questo intervallo il dataset in cache si usa senza nemmeno interrogare il server
+REVALIDATE_SEC = 10
+# Byte già noti riscaricati in testa alla coda per verificare che il file non sia stato riscritto
+TAIL_OVERLAP = 256
+
+
+# ---------- CACHE DATASET (condivisa tra sessioni) ----------
+@dataclass
+class Dataset:
+    filename: str
+    version: tuple[int, str | None]   # (SIZE, MDTM) del file remoto
+    header: bytes                     # riga di intestazione (con a capo)
+    tail: bytes                       # ultimi TAIL_OVERLAP byte letti, per la verifica della coda
+    synced: int                       # offset fino a cui il CSV è stato letto
+    df: pd.DataFrame                  # CSV tipizzato (colonne ripulite) + modifiche del journal
+    sep: str
+    journal_version: tuple[int, str | None] | None = None
+    journal_offset: int = 0           # byte del journal già applicati
+    journal_entries: int = 0          # modifiche in attesa di compattazione
+    snapshot_offset: int | None = None  # byte di CSV coperti dallo snapshot remoto (None = nessuno)
+    gen: int = 0                      # generazione del file (sidecar ".ver") al caricamento completo
+    _view: pd.DataFrame | None = field(default=None, repr=False)
+    _search: SearchIndex | None = field(default=None, repr=False)
+    _rollup: pd.DataFrame | None = field(default=None, repr=False)
+    _dupes: DuplicateIndex | None = field(default=None, repr=False)
+
+    @property
+    def can_tail(self) -> bool:
+        """La sincronizzazione in coda richiede che l'ultima riga letta sia completa."""
+        return self.tail.endswith(b"\n")
+
+    @property
+    def view(self) -> pd.DataFrame:
+        """DataFrame normalizzato per la consultazione (calcolato una volta per versione)."""
+        if self._view is None:
+            self._view = normalize_time_columns(self.df.copy())
+        return self._view
+
+    @property
+    def search(self) -> SearchIndex:
+        """Indice dei filtri di ricerca; le posizioni valgono sia per df che per view."""
+        if self._search is None:
+            self._search = SearchIndex(self.df)
+        return self._search
+
+    @property
+    def rollup(self) -> pd.DataFrame:
+        """Riepilogo per DATA × MACCHINA × OPERATORE × FASE × materiale (vedi rollups);
+        calcolato una volta, poi aggiornato per differenza a ogni coda o modifica."""
+        if self._rollup is None:
+            self._rollup = aggregate(self.df)
+        return self._rollup
+
+    @property
+    def dupes(self) -> DuplicateIndex:
+        """Contatori per i controlli dei duplicati (vedi dupes); come il riepilogo,
+        calcolati una volta e poi aggiornati con le sole righe accodate o modificate."""
+        if self._dupes is None:
+            self._dupes = DuplicateIndex(self.df)
+        return self._dupes
+
+    @property
+    def parts(self) -> list[tuple]:
+        """(file, prima riga, righe, versione CSV, versione journal) dei file che compongono il dataset."""
+        return [(self.filename, 0, len(self.df), self.version, self.journal_version)]
+
+
+def _parse_dataset(filename: str, version, raw: bytes) -> Dataset:
+    df, sep = ingest_csv(raw)
+    nl = raw.find(b"\n")
+    header = raw[:nl + 1] if nl >= 0 else raw
+    return Dataset(filename, version, header, raw[-TAIL_OVERLAP:], len(raw), df, sep)
+
+
+def _tail_dataset(entry: Dataset, version, tail: bytes) -> Dataset:
+    """Accoda al dataset le sole righe nuove (tail) già verificate."""
+    names = [c.strip() for c in entry.header.decode("utf-8", "ignore").rstrip("\r\n").split(entry.sep)]
+    new, _ = ingest_csv(tail, sep=entry.sep, names=names)
+    new.columns = list(entry.df.columns)
+    df = concat_typed([entry.df, new])
+    search = SearchIndex(df, entry._search) if entry._search is not None else None
+    rollup = combine(entry._rollup, add=aggregate(new)) if entry._rollup is not None else None
+    dupes = entry._dupes.appended(new) if entry._dupes is not None else None
+    return replace(entry, version=version, tail=(entry.tail + tail)[-TAIL_OVERLAP:],
+                   synced=entry.synced + len(tail), df=df, _view=None, _search=search, _rollup=rollup,
+                   _dupes=dupes)
+
+
+def _sync_tail(ftp, entry: Dataset, version, allow_same: bool = False) -> Dataset | None:
+    """
+    Sincronizzazione incrementale: il file cresce solo via APPE, quindi scarico
+    (REST) solo i byte successivi all'ultimo offset letto. None se serve un
+    ricaricamento completo (file accorciato/riscritto, header cambiato).
+    allow_same accetta anche un file della stessa dimensione (verificato sulla coda).
+    """
+    size = version[0]
+    if not entry.can_tail or size < entry.synced or (size == entry.synced and not allow_same):
+        return None
+    header = entry.header
+    if ftp_read_head(ftp, entry.filename, max_bytes=len(header) + 1) != header:
+        return None
+    overlap = min(TAIL_OVERLAP, entry.synced)
+    data = ftp_download_file(ftp, entry.filename, offset=entry.synced - overlap)
+    if not data or data[:overlap] != entry.tail[-overlap:]:
+        return None
+    tail = data[overlap:]
+    if not tail:
+        return replace(entry, version=version)
+    if not tail.endswith(b"\n"):
+        return None   # append in corso: meglio rileggere tutto
+    if len(tail) != size - entry.synced:
+        version = (entry.synced + len(tail), None)
+    return _tail_dataset(entry, version, tail)
+
+
+def _sync_journal(ftp, entry: Dataset, jversion, prefetched: bytes | None = None) -> Dataset | None:
+    """Applica le modifiche accodate al journal dall'ultimo offset letto (REST).
+    None se il journal è stato accorciato: serve ripartire dal CSV.
+    prefetched: journal intero già scaricato in parallelo (vale solo da offset 0)."""
+    if jversion == entry.journal_version:
+        return entry
+    size = jversion[0] if jversion else 0
+    if size < entry.journal_offset:
+        return None
+    if size == entry.journal_offset:
+        return replace(entry, journal_version=jversion)
+    if prefetched is not None and entry.journal_offset == 0:
+        data = prefetched
+    else:
+        data = ftp_download_file(ftp, journal_name(entry.filename), offset=entry.journal_offset) or b""
+    entries, used = parse_journal(data)
+    if used != len(data):
+        jversion = None   # riga in scrittura: la rileggo al prossimo controllo
+    df = apply_patches(entry.df.copy(), entries) if entries else entry.df
+    rollup, dupes = entry._rollup, entry._dupes
+    if entries and rollup is not None:
+        rollup = rollup_after_patches(rollup, entry.df, df, entries)
+    if entries and dupes is not None:
+        dupes = dupes.patched(entry.df, df, entries)
+    return replace(entry, df=df, _view=None if entries else entry._view,
+                   _search=None if entries else entry._search, _rollup=rollup, _dupes=dupes,
+                   journal_version=jversion, journal_offset=entry.journal_offset + used,
+                   journal_entries=entry.journal_entries + len(entries))
+
+
+class _JournalFetch(threading.Thread):
+    """
+    Download del journal intero in parallelo al CSV, solo se il pool ha subito una
+    connessione libera: chi carica tiene già la sua (anche da ftp_parallel) e aspettarne
+    un'altra esaurirebbe il pool. result() None se non è partito o non è riuscito: il
+    journal si scarica poi sulla connessione principale.
+    """
+
+    def __init__(self, filename: str):
+        super().__init__(name="prd-journal", daemon=True)
+        self.filename, self.data = filename, None
+        self.start()
+
+    def run(self):
+        try:
+            self.data = ftp_try_run(lambda ftp: ftp_download_file(ftp, journal_name(self.filename)))
+        except Exception as e:
+            log_error(f"journal in parallelo {self.filename}", e)   # si riscarica sulla connessione principale
+
+    def result(self) -> bytes | None:
+        self.join()
+        return self.data
+
+
+class DatasetCache:
+    """
+    Cache di processo dei file CSV remoti: bytes grezzi + DataFrame con le
+    modifiche del journal già applicate.
+    Se cambia SIZE/MDTM si scaricano solo le righe accodate (REST); il file
+    intero viene riscaricato solo se è stato riscritto o dopo invalidate().
+    I DataFrame restituiti sono condivisi: chi li modifica deve farne una copia.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file_locks: dict[str, threading.Lock] = {}
+        self._entries: dict[str, Dataset] = {}
+        self._checked: dict[str, float] = {}
+        self._gen = 0   # incrementato da invalidate(): scarta i caricamenti in corso
+
+    def _file_lock(self, filename: str) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(filename, threading.Lock())
+
+    def get(self, filename: str = REMOTE_FILE, ftp=None) -> Dataset | None:
+        with self._file_lock(filename):
+            entry = self._entries.get(filename)
+            if entry is not None and time.monotonic() - self._checked.get(filename, 0) < REVALIDATE_SEC:
+                return entry
+
+            gen = self._gen
+            if ftp is None:
+                entry = ftp_run(lambda f: self._refresh(f, filename, entry))
+            else:
+                entry = self._refresh(ftp, filename, entry)
+
+            with self._lock:
+                if gen != self._gen:
+                    return entry
+                if entry is None:
+                    self._entries.pop(filename, None)
+                else:
+                    self._entries[filename] = entry
+                self._checked[filename] = time.monotonic()
+            return entry
+
+    def _refresh(self, ftp, filename: str, entry: Dataset | None) -> Dataset | None:
+        version = ftp_remote_version(ftp, filename)
+        if version is None or version[0] == 0:
+            return None
+        jversion = ftp_remote_version(ftp, journal_name(filename))
+        if entry is not None and entry.version == version and entry.journal_version == jversion:
+            return entry
+        base = entry
+        journal = None
+        if base is None or base.version != version:
+            # versione senza MDTM = quanto letto: stessa dimensione si verifica sulla coda
+            base = _sync_tail(ftp, entry, version, allow_same=entry.version[1] is None) if entry is not None else None
+            if base is None:
+                # download completo: il journal arriva intanto su un'altra connessione, se libera
+                journal = _JournalFetch(filename) if jversion and jversion[0] else None
+                base = self._load_full(ftp, filename, version)
+            if base is None:
+                return None
+        synced = _sync_journal(ftp, base, jversion, journal and journal.result())
+        if synced is None:
+            base = self._load_full(ftp, filename, version)
+            synced = base and _sync_journal(ftp, base, jversion)
+        return synced
+
+    @staticmethod
+    def _load_full(ftp, filename: str, version) -> Dataset | None:
+        # snapshot tipizzato + sola coda del CSV, se lo snapshot è ancora valido
+        # (stessa generazione: il file non è stato riscritto dopo lo snapshot)
+        gen = read_version(ftp, filename)["gen"]
+        snap = read_snapshot(ftp, filename)
+        if snap is not None and snap[1].get("gen", 0) == gen:
+            df, meta = snap
+            offset = meta["csv_offset"]
+            base = Dataset(filename, (offset, None), meta["header"], meta["tail"], offset, df,
+                           meta["sep"], snapshot_offset=offset, gen=gen)
+            ds = _sync_tail(ftp, base, version, allow_same=True)
+            if ds is not None:
+                return ds
+        raw = ftp_download_file(ftp, filename)
+        if raw and len(raw) != version[0]:
+            # file cambiato durante il download: vale quanto letto, la coda si sincronizza al prossimo controllo
+            version = (len(raw), None)
+        return replace(_parse_dataset(filename, version, raw), gen=gen) if raw else None
+
+    def peek(self, filename: str) -> Dataset | None:
+        """Dataset in cache così com'è (anche da rivalidare), senza accessi FTP."""
+        with self._lock:
+            return self._entries.get(filename)
+
+    def set_snapshot_offset(self, filename: str, offset: int):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is not None:
+                self._entries[filename] = replace(entry, snapshot_offset=offset)
+
+    def invalidate(self, filename: str | None = None, drop: bool = True):
+        """
+        drop=True scarta il dataset (file riscritto); drop=False forza solo la
+        rivalidazione al prossimo get(), così dopo un APPE si legge solo la coda.
+        """
+        with self._lock:
+            self._gen += 1
+            names = set(self._entries) | set(self._checked) if filename is None else [filename]
+            for n in names:
+                self._checked.pop(n, None)
+                if drop:
+                    self._entries.pop(n, None)
+
+
+_cache = DatasetCache()
+
+def get_dataset(filename: str = REMOTE_FILE, ftp=None) -> Dataset | None:
+    return _cache.get(filename, ftp)
+
+def cached_dataset(filename: str = REMOTE_FILE) -> Dataset | None:
+    return _cache.peek(filename)
+
+def invalidate_dataset(filename: str | None = None, drop: bool = True):
+    _cache.invalidate(filename, drop)
+
+def set_snapshot_offset(filename: str, offset: int):
+    _cache.set_snapshot_offset(filename, offset)
@@ -0,0 +1,37 @@
+import pandas as pd
+
+from .data import fmt_column
+from .tracing import traced
+
+# Schede per pagina nella Lettura (modalità mobile-friendly)
+CARD_PAGE_SIZE = 20
+
+
+# ---------- SCHEDE LETTURA (un solo blocco HTML per pagina) ----------
+def _text(df: pd.DataFrame, col: str) -> pd.Series:
+    """Colonna come testo HTML-escaped, come fmt_cell ('' per i vuoti, date senza ora)."""
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    out = fmt_column(df[col]).astype(str)
+    return (out.str.replace("&", "&amp;", regex=False).str.replace("<", "&lt;", regex=False)
+               .str.replace(">", "&gt;", regex=False).str.replace('"', "&quot;", regex=False))
+
+@traced("render.schede", lambda out, df: {"rows": len(df)})
+def cards_html(df: pd.DataFrame) -> str:
+    """HTML delle schede per le righe di df (una pagina), assemblato per colonne."""
+    if df.empty:
+        return ""
+    f = {c: _text(df, c) for c in ["CODICE_MATERIALE", "DESCRIZIONE", "DATA", "OPERATORE", "MACCHINA", "FASE",
+                                   "CICLO_NR", "NUMERO_PRG", "CARTELLA_MACCHINA", "TEMPO_FASE (hh:mm)", "Timestamp"]}
+    html = ('<div class="prd-card"><div class="prd-h4">🔩 ' + f["CODICE_MATERIALE"] + " — " + f["DESCRIZIONE"] + "</div>"
+            + '<div class="prd-meta">📅 <b>' + f["DATA"] + "</b> &nbsp;•&nbsp; 👤 <b>" + f["OPERATORE"]
+            + "</b> &nbsp;•&nbsp; 🏭 <b>" + f["MACCHINA"] + "</b> &nbsp;•&nbsp; 🚦 <b>" + f["FASE"] + "</b></div>"
+            + '<div><span class="prd-chip">CICLO: ' + f["CICLO_NR"] + "</span> "
+            + '<span class="prd-chip">PRG: ' + f["NUMERO_PRG"] + "</span> "
+            + '<span class="prd-chip">CARTELLA: ' + f["CARTELLA_MACCHINA"] + "</span> "
+            + '<span class="prd-chip">Tempo: ' + f["TEMPO_FASE (hh:mm)"] + "</span></div>"
+            + '<div class="prd-sep"></div><div class="prd-kv"><b>Timestamp:</b> ' + f["Timestamp"] + "</div></div>")
+    return "".join(html.tolist())
+
+def page_count(n_rows: int, page_size: int = CARD_PAGE_SIZE) -> int:
+    return max(1, -(-n_rows // page_size))
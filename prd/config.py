@@ -0,0 +1,17 @@
+import os
+
+# ---------- COSTANTI APP ----------
+PRIMARY_DIR  = "/httpdocs/IA/luppichini/PRD"
+REMOTE_FILE  = "Dati_PRD_Alessio.csv"
+OPERATORI    = ["ALESSIO", "ALE_SERAP", "ALESSANDRO", "LUCA", "MICHELE", "VALERIO"]
+
+# Ordine colonne del file di produzione
+COLUMNS = [
+    "Timestamp","OPERATORE","DATA","CODICE_MATERIALE","DESCRIZIONE","CICLO_NR",
+    "MACCHINA","NUMERO_PRG","CARTELLA_MACCHINA","FASE","TEMPO_FASE_MIN"
+]
+
+# Coda locale delle registrazioni non ancora inviate (disco dell'host dell'app)
+OUTBOX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".outbox")
+# Log di diagnostica (tracciamento JSONL a rotazione)
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".logs")
@@ -0,0 +1,314 @@
+import csv
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+from .tracing import traced
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+# Byte iniziali in cui cercare la riga di intestazione (separatore, nomi colonne)
+SNIFF_BYTES = 64 * 1024
+# Lettura a blocchi: byte per blocco pyarrow / righe per blocco del parser pandas
+CHUNK_BYTES = 4 * 1024 * 1024
+CHUNK_ROWS  = 40_000
+
+
+# ---------- CSV lettura/tempo ----------
+def sniff_separator_from_bytes(csv_bytes: bytes, default=";"):
+    """Separatore dalla prima riga, cercata nei soli primi SNIFF_BYTES (il buffer non si copia)."""
+    if not csv_bytes:
+        return default
+    end = csv_bytes.find(b"\n", 0, SNIFF_BYTES)
+    head = bytes(memoryview(csv_bytes)[:end if end >= 0 else SNIFF_BYTES]).decode("utf-8", "ignore")
+    return ";" if head.count(";") >= head.count(",") else ","
+
+def _header_names(csv_bytes: bytes, sep: str) -> list[str]:
+    end = csv_bytes.find(b"\n", 0, SNIFF_BYTES)
+    head = bytes(memoryview(csv_bytes)[:end if end >= 0 else SNIFF_BYTES]).decode("utf-8-sig", "ignore")
+    return next(csv.reader([head.rstrip("\r")], delimiter=sep), [])
+
+def _arrow_types(cols: list[str]) -> dict:
+    """Testo per le colonne note; CICLO_NR numerico già nel parser (un valore non numerico
+    fa fallire la lettura pyarrow e si ripiega su pandas, che lo rende NA come prima)."""
+    return {c: pa.float64() if c.strip() in INT_COLUMNS else pa.string() for c in cols}
+
+def _arrow_chunks(csv_bytes: bytes, sep: str, names: list[str] | None, usecols, text_cols: list[str]):
+    """Blocchi di ~CHUNK_BYTES letti da pyarrow (multithread), colonne note come testo."""
+    reader = pa_csv.open_csv(
+        pa.BufferReader(csv_bytes),
+        read_options=pa_csv.ReadOptions(block_size=CHUNK_BYTES, column_names=names),
+        parse_options=pa_csv.ParseOptions(delimiter=sep, newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(column_types=_arrow_types(text_cols),
+                                              strings_can_be_null=True, include_columns=usecols),
+        memory_pool=pa.system_memory_pool(),   # mimalloc trattiene i blocchi già liberati
+    )
+    for batch in reader:
+        yield batch.to_pandas()
+
+def _concat_chunks(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """concat_typed colonna per colonna, togliendo ogni colonna dai blocchi appena unita:
+    in memoria c'è al più una colonna in doppio, non due copie del frame."""
+    cols = {}
+    for c in list(frames[0].columns):
+        cols[c] = concat_typed([f.pop(c).to_frame() for f in frames])[c]
+    return pd.DataFrame(cols, copy=False)
+
+def _pandas_chunks(csv_bytes: bytes, sep: str, names: list[str] | None, usecols, text_cols: list[str]):
+    yield from pd.read_csv(io.BytesIO(csv_bytes), sep=sep, header=None if names else "infer", names=names,
+                           usecols=usecols, dtype={c: str for c in text_cols}, chunksize=CHUNK_ROWS)
+
+@traced("csv.lettura", lambda out, csv_bytes, *a, **k: {"bytes": len(csv_bytes or b""), "rows": len(out[0])})
+def ingest_csv(csv_bytes: bytes | None, sep: str | None = None, names: list[str] | None = None,
+               usecols: list[str] | None = None) -> tuple[pd.DataFrame, str]:
+    """
+    Unico punto di lettura del CSV di produzione -> (DataFrame tipizzato, separatore).
+    Le colonne note si leggono come testo (schema esplicito, niente inferenza) e
+    si tipizzano blocco per blocco: il picco di memoria resta vicino al frame finale
+    invece che a più copie dei byte grezzi. pyarrow se disponibile, altrimenti il
+    parser C di pandas; una riga che pyarrow rifiuta (es. campi mancanti) fa
+    ripartire la lettura con pandas. names = dati senza intestazione (coda del file).
+    """
+    if not csv_bytes:
+        return pd.DataFrame(), sep or ";"
+    sep = sep or sniff_separator_from_bytes(csv_bytes)
+    raw_names = names or _header_names(csv_bytes, sep)
+    text_cols = [c for c in raw_names if c.strip() in SCHEMA_COLUMNS and (usecols is None or c in usecols)]
+
+    def _read(chunks) -> pd.DataFrame:
+        frames = []
+        for chunk in chunks:
+            chunk.columns = [str(c).strip() for c in chunk.columns]
+            frames.append(type_frame(chunk))
+        return _concat_chunks(frames) if len(frames) > 1 else frames[0] if frames else \
+            type_frame(pd.DataFrame({c.strip(): pd.Series(dtype=object) for c in raw_names}))
+
+    if HAS_ARROW:
+        try:
+            return _read(_arrow_chunks(csv_bytes, sep, names, usecols, text_cols)), sep
+        except (pa.ArrowInvalid, ValueError):
+            pass
+    return _read(_pandas_chunks(csv_bytes, sep, names, usecols, text_cols)), sep
+
+def std(x: str) -> str:
+    return " ".join(str(x or "").strip().split())
+
+def to_int_safe(x, default=0):
+    try:
+        s = str(x).strip().replace(",", ".")
+        v = int(float(s))
+        return v if v >= 0 else default
+    except Exception:
+        return default
+
+def minutes_to_hhmm(m) -> str:
+    try:
+        if pd.isna(m):
+            return ""
+        m = int(round(float(m)))
+        h = m // 60
+        r = m % 60
+        return f"{h:02d}:{r:02d}"
+    except Exception:
+        return ""
+
+def parse_hhmmss_to_minutes(s: str) -> int | None:
+    """Converte 'HH:MM:SS' o 'HH:MM' in minuti; None se non combacia."""
+    if s is None:
+        return None
+    s = str(s).strip()
+    m = re.match(r"^\s*(\d{1,3})\s*:\s*([0-5]?\d)\s*:\s*([0-5]?\d)\s*$", s)
+    if m:
+        hh, mm = int(m.group(1)), int(m.group(2))
+        return hh * 60 + mm
+    m = re.match(r"^\s*(\d{1,3})\s*:\s*([0-5]?\d)\s*$", s)
+    if m:
+        hh, mm = int(m.group(1)), int(m.group(2))
+        return hh * 60 + mm
+    return None
+
+def _text_codes(ser: pd.Series) -> tuple[np.ndarray, list[str]]:
+    """Codici e valori distinti del testo della colonna (come ser.astype(str))."""
+    codes, uniq = pd.factorize(ser.astype(str), use_na_sentinel=False)
+    return codes, list(uniq)
+
+def _take(codes: np.ndarray, values: list, dtype) -> pd.array:
+    return pd.array(values, dtype=dtype).take(codes)
+
+@traced("normalizza_tempi", lambda out, df: {"rows": len(out)})
+def normalize_time_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Popola sempre:
+      - TEMPO_FASE_MIN (int, minuti)
+      - TEMPO_FASE (hh:mm) per display
+    Le conversioni valore per valore girano solo sui valori distinti (pochi
+    centinaia anche su milioni di righe) e vengono riportate sulle righe per codice.
+    """
+    u2orig = {c.upper().strip(): c for c in df.columns}
+    tmin = None
+
+    if "TEMPO_FASE_MIN" in u2orig:
+        c = u2orig["TEMPO_FASE_MIN"]
+        ser = df[c]
+        codes, uniq = _text_codes(ser)
+        if any(":" in u for u in uniq):
+            tmin = _take(codes, [parse_hhmmss_to_minutes(u) for u in uniq], "Int64")
+        else:
+            tmin = pd.to_numeric(ser, errors="coerce").astype("Int64").array
+
+    if tmin is None:
+        tempo_cols = [u2orig[u] for u in u2orig if "TEMPO" in u]
+        for c in tempo_cols:
+            codes, uniq = _text_codes(df[c])
+            if any(":" in u for u in uniq):
+                tmin = _take(codes, [parse_hhmmss_to_minutes(u) for u in uniq], "Int64")
+                break
+
+    if tmin is None and "ORE" in u2orig and "MINUTI" in u2orig:
+        (hc, hu), (mc, mu) = _text_codes(df[u2orig["ORE"]]), _text_codes(df[u2orig["MINUTI"]])
+        h = np.array([to_int_safe(u) for u in hu], dtype="int64")[hc]
+        m = np.array([to_int_safe(u) for u in mu], dtype="int64")[mc]
+        tmin = pd.array(h * 60 + m, dtype="Int64")
+
+    if tmin is None:
+        df["TEMPO_FASE_MIN"] = pd.Series([pd.NA] * len(df), dtype="Int64")
+    else:
+        df["TEMPO_FASE_MIN"] = pd.Series(tmin, index=df.index)
+
+    codes, uniq = pd.factorize(df["TEMPO_FASE_MIN"], use_na_sentinel=False)
+    df["TEMPO_FASE (hh:mm)"] = np.array([minutes_to_hhmm(u) for u in uniq] or [""], dtype=object)[codes]
+    return df
+
+# ---------- append sicuro: helper CSV ----------
+def serialize_row(columns: list[str], row: dict, sep: str) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=sep, lineterminator="\n", quoting=csv.QUOTE_MINIMAL)
+    writer.writerow([row.get(col, "") for col in columns])
+    return output.getvalue()
+
+def fmt_cell(v) -> str:
+    """Valore del dataset tipizzato come testo per form e schede ('' per i vuoti, date senza ora)."""
+    if v is None or pd.isna(v):
+        return ""
+    if isinstance(v, pd.Timestamp):
+        return v.strftime("%Y-%m-%d") if v == v.normalize() else v.strftime("%Y-%m-%d %H:%M:%S")
+    return str(v)
+
+def minutes_to_hhmmss(m) -> str:
+    """Minuti -> 'H:MM:00' (formato usato nel CSV per TEMPO_FASE_MIN)."""
+    try:
+        if pd.isna(m):
+            return ""
+        m = int(round(float(m)))
+        return f"{m // 60}:{m % 60:02d}:00"
+    except Exception:
+        return ""
+
+def fmt_column(ser: pd.Series) -> pd.Series:
+    """fmt_cell su un'intera colonna (object)."""
+    if pd.api.types.is_datetime64_any_dtype(ser):
+        out = ser.dt.strftime("%Y-%m-%d %H:%M:%S").where(ser != ser.dt.normalize(), ser.dt.strftime("%Y-%m-%d"))
+    else:
+        out = ser.astype("string")
+    return out.fillna("").astype(object)
+
+def minutes_to_hhmmss_column(ser: pd.Series) -> pd.Series:
+    """minutes_to_hhmmss su un'intera colonna di minuti (object)."""
+    m = pd.to_numeric(ser, errors="coerce").round().astype("Int64")
+    out = (m // 60).astype("string") + ":" + (m % 60).astype("string").str.zfill(2) + ":00"
+    return out.fillna("").astype(object)
+
+# ---------- schema tipizzato ----------
+CATEGORY_COLUMNS = ["OPERATORE", "MACCHINA", "FASE", "CARTELLA_MACCHINA"]
+DATETIME_COLUMNS = ["Timestamp", "DATA"]
+INT_COLUMNS      = ["CICLO_NR"]
+TEXT_COLUMNS     = ["CODICE_MATERIALE", "DESCRIZIONE", "NUMERO_PRG"]
+SCHEMA_COLUMNS   = set(CATEGORY_COLUMNS + DATETIME_COLUMNS + INT_COLUMNS + TEXT_COLUMNS + ["TEMPO_FASE_MIN"])
+
+_HHMM_RE = r"^\s*(\d{1,3})\s*:\s*([0-5]?\d)(?:\s*:\s*[0-5]?\d)?\s*$"
+
+def tempo_to_minutes(ser: pd.Series) -> pd.Series:
+    """
+    Minuti (Int64) valore per valore: 'HH:MM[:SS]' come parse_hhmmss_to_minutes,
+    tutto il resto come numero. A differenza di normalize_time_columns il
+    risultato di una riga non dipende dalle altre, quindi il file si può
+    tipizzare a blocchi (coda incrementale) con lo stesso esito.
+    Il parsing gira sui soli valori distinti (poche centinaia di durate).
+    """
+    codes, uniq = pd.factorize(ser, use_na_sentinel=True)
+    s = pd.Series(uniq, dtype=object).astype("string")
+    has_colon = s.str.contains(":", regex=False).fillna(False).astype(bool)
+    hm = s.str.extract(_HHMM_RE)
+    from_hhmm = (pd.to_numeric(hm[0]) * 60 + pd.to_numeric(hm[1])).astype("Float64")
+    num = pd.to_numeric(s.where(~has_colon).str.strip(), errors="coerce").astype("Float64")
+    minutes = from_hhmm.where(has_colon, num).round().astype("Int64").array
+    return pd.Series(minutes.take(codes, allow_fill=True), index=ser.index)
+
+def to_datetime_safe(ser: pd.Series) -> pd.Series:
+    """ISO (formato scritto dall'app) in blocco; gli altri formati valore per valore."""
+    out = pd.to_datetime(ser, errors="coerce", format="ISO8601")
+    bad = out.isna() & ser.notna()
+    if bad.any():
+        out[bad] = pd.to_datetime(ser[bad].astype(str), errors="coerce", format="mixed", dayfirst=True)
+    return out
+
+def type_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte (in place) le colonne note nei tipi compatti del dataset."""
+    for c in DATETIME_COLUMNS:
+        if c in df.columns:
+            df[c] = to_datetime_safe(df[c])
+    for c in INT_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors="coerce").round().astype("Int64")
+    if "TEMPO_FASE_MIN" in df.columns:
+        df["TEMPO_FASE_MIN"] = tempo_to_minutes(df["TEMPO_FASE_MIN"])
+    for c in TEXT_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype("string")
+    for c in CATEGORY_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype("string").astype("category")
+    return df
+
+def type_value(col: str, val):
+    """Converte un singolo valore (es. da una modifica del journal) nel tipo della colonna."""
+    if col in DATETIME_COLUMNS:
+        return to_datetime_safe(pd.Series([val], dtype=object)).iloc[0]
+    if col == "TEMPO_FASE_MIN":
+        return tempo_to_minutes(pd.Series([val], dtype=object)).iloc[0]
+    if col in INT_COLUMNS:
+        return pd.to_numeric(pd.Series([val], dtype=object), errors="coerce").round().astype("Int64").iloc[0]
+    if val is None:
+        return pd.NA
+    if col in TEXT_COLUMNS or col in CATEGORY_COLUMNS:
+        return str(val)
+    return val
+
+def concat_typed(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """pd.concat che mantiene i tipi del primo frame (categorie diverse -> unione)."""
+    first = frames[0]
+    aligned = [first.copy(deep=False)] + [f.copy() for f in frames[1:]]
+    for c in first.columns:
+        if c in CATEGORY_COLUMNS:
+            sers = [f[c] if isinstance(f[c].dtype, pd.CategoricalDtype) else f[c].astype("string").astype("category")
+                    for f in aligned if c in f.columns]
+            cats = pd.Index(sers[0].cat.categories)
+            for ser in sers[1:]:
+                cats = cats.append(ser.cat.categories.difference(cats))
+            for f, ser in zip([f for f in aligned if c in f.columns], sers):
+                f[c] = ser.cat.set_categories(cats)
+        else:
+            for f in aligned[1:]:
+                if c in f.columns and f[c].dtype != first[c].dtype:
+                    try:
+                        f[c] = f[c].astype(first[c].dtype)
+                    except (TypeError, ValueError):
+                        pass
+    return pd.concat(aligned, ignore_index=True)
@@ -0,0 +1,200 @@
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .data import to_datetime_safe
+
+# Chiave di una registrazione ripetuta (doppio invio, import ripetuto)
+ENTRY_KEY = ["DATA", "OPERATORE", "CODICE_MATERIALE", "FASE", "MACCHINA"]
+
+
+# ---------- INDICI DUPLICATI (contatori per chiave, aggiornati con il dataset) ----------
+# Un indice per file: CICLO_NR -> righe, hash della ENTRY_KEY -> righe, NUMERO_PRG ->
+# {materiale: righe}. Le righe accodate si aggiungono, quelle modificate dal journal si
+# tolgono con i vecchi valori e si riaggiungono con i nuovi: ogni controllo è un lookup.
+def _norm_codes(ser: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Codici e valori distinti ripuliti e maiuscoli ('' per i vuoti)."""
+    if pd.api.types.is_datetime64_any_dtype(ser):
+        codes, uniq = pd.factorize(ser, use_na_sentinel=False)
+        return codes, np.array([u.strftime("%Y-%m-%d") if pd.notna(u) else "" for u in uniq] or [""], dtype=object)
+    codes, uniq = pd.factorize(ser.astype("string").fillna(""), use_na_sentinel=False)
+    return codes, np.array([" ".join(str(u).split()).upper() for u in uniq] or [""], dtype=object)
+
+def _norm(ser: pd.Series) -> np.ndarray:
+    codes, uniq = _norm_codes(ser)
+    return uniq[codes]
+
+def _col(df: pd.DataFrame, c: str) -> pd.Series:
+    if c not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    if c == "DATA" and not pd.api.types.is_datetime64_any_dtype(df[c]):
+        return to_datetime_safe(df[c].astype(object).replace("", None))
+    return df[c]
+
+def entry_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Hash (uint64) della ENTRY_KEY normalizzata di ogni riga: ogni colonna si ripulisce e
+    si hasha sui valori distinti, poi gli hash delle colonne si combinano riga per riga."""
+    out = np.zeros(len(df), dtype="uint64")
+    for c in ENTRY_KEY:
+        codes, uniq = _norm_codes(_col(df, c))
+        out = out * np.uint64(1_000_003) ^ pd.util.hash_array(uniq)[codes]
+    return out
+
+def _cicli(df: pd.DataFrame) -> pd.Series:
+    return pd.to_numeric(_col(df, "CICLO_NR"), errors="coerce").round().astype("Int64")
+
+def _counts(values) -> Counter:
+    vc = pd.Series(values).value_counts()
+    return Counter(dict(zip(vc.index.tolist(), vc.tolist())))
+
+
+class DuplicateIndex:
+    """Contatori per CICLO_NR, registrazione (ENTRY_KEY) e NUMERO_PRG -> materiali."""
+
+    def __init__(self, df: pd.DataFrame | None = None):
+        self.cicli: Counter = Counter()
+        self.entries: Counter = Counter()
+        self.prg: dict[str, Counter] = {}
+        if df is not None:
+            self._update(df, 1)
+
+    def _update(self, df: pd.DataFrame, sign: int):
+        if df.empty:
+            return
+        for counter, values in ((self.cicli, _cicli(df).dropna().astype("int64")), (self.entries, entry_hashes(df))):
+            counts = _counts(values)
+            if sign > 0:
+                counter.update(counts)   # su un contatore vuoto è un dict.update
+                continue
+            counter.subtract(counts)
+            for k in counts:
+                if counter[k] <= 0:
+                    del counter[k]
+        pairs = pd.DataFrame({"p": _norm(_col(df, "NUMERO_PRG")), "m": _norm(_col(df, "CODICE_MATERIALE"))})
+        for (p, m), n in pairs[pairs["p"] != ""].value_counts().items():
+            mats = self.prg.setdefault(p, Counter())
+            mats[m] += sign * n
+            if mats[m] <= 0:
+                del mats[m]
+                if not mats:
+                    del self.prg[p]
+
+    def _copy(self) -> "DuplicateIndex":
+        out = DuplicateIndex()
+        out.cicli, out.entries = self.cicli.copy(), self.entries.copy()
+        out.prg = {p: m.copy() for p, m in self.prg.items()}
+        return out
+
+    def appended(self, new: pd.DataFrame) -> "DuplicateIndex":
+        """Nuovo indice con le righe accodate (quello corrente resta valido per chi lo usa)."""
+        out = self._copy()
+        out._update(new, 1)
+        return out
+
+    def patched(self, before: pd.DataFrame, after: pd.DataFrame, entries: list[dict]) -> "DuplicateIndex":
+        """Nuovo indice dopo le modifiche del journal: solo le righe toccate."""
+        rows = sorted({e["row"] for e in entries if 0 <= e["row"] < len(after)})
+        if not rows:
+            return self
+        out = self._copy()
+        out._update(before.iloc[rows], -1)
+        out._update(after.iloc[rows], 1)
+        return out
+
+
+def check_record(row: dict, indexes: list[DuplicateIndex], pending: list[dict] = (),
+                 check_ciclo: bool = True) -> list[str]:
+    """Avvisi per una nuova registrazione: CICLO_NR già usato, registrazione identica, PRG di altro materiale."""
+    one = pd.DataFrame([row])
+    out = []
+    ciclo = _cicli(one).iloc[0]
+    if check_ciclo and pd.notna(ciclo):
+        n = sum(ix.cicli.get(int(ciclo), 0) for ix in indexes)
+        if n:
+            out.append(f"CICLO NR {ciclo} già usato ({n} {'riga' if n == 1 else 'righe'}).")
+    h = entry_hashes(one)[0]
+    if any(ix.entries.get(h) for ix in indexes):
+        out.append("Registrazione identica già presente (stessa DATA, OPERATORE, MATERIALE, FASE, MACCHINA).")
+    elif pending and h in set(entry_hashes(pd.DataFrame(pending))):
+        out.append("Registrazione identica già in coda di invio.")
+    prg, mat = _norm(_col(one, "NUMERO_PRG"))[0], _norm(_col(one, "CODICE_MATERIALE"))[0]
+    if prg:
+        others = sorted({m for ix in indexes for m in ix.prg.get(prg, {})} - {mat})
+        if others:
+            out.append(f"NUMERO PRG {prg} già usato per {', '.join(others[:5])}" + (" …" if len(others) > 5 else "") + ".")
+    return out
+
+def flag_duplicates(rows: pd.DataFrame, indexes: list[DuplicateIndex]) -> pd.Series:
+    """
+    Per le righe da importare: motivi per cui sono possibili duplicati ('' = nessuno).
+    Tra righe ripetute nel file resta buona la prima.
+    """
+    h = pd.Series(entry_hashes(rows), index=rows.index)
+    c = _cicli(rows)
+    flags = {
+        "già presente": h.map(lambda k: any(ix.entries.get(k) for ix in indexes)),
+        "ripetuta nel file": h.duplicated(),
+        "CICLO NR già usato": c.map(lambda v: pd.notna(v) and any(ix.cicli.get(int(v)) for ix in indexes)),
+        "CICLO NR ripetuto nel file": c.notna() & c.duplicated(),
+    }
+    out = pd.Series("", index=rows.index, dtype=object)
+    for text, mask in flags.items():
+        m = mask.fillna(False).to_numpy(dtype=bool)
+        out[m] = out[m] + np.where(out[m] == "", "", ", ") + text
+    return out
+
+def ciclo_conflicts(values: dict[int, int], indexes: list[DuplicateIndex], old: dict[int, int] | None = None) -> list[int]:
+    """
+    Righe (chiavi di values) il cui nuovo CICLO_NR è già usato altrove o ripetuto tra le
+    modifiche; old = CICLO_NR attuale delle stesse righe (che si libera con la modifica).
+    """
+    freed = Counter((old or {}).values())
+    asked = Counter(values.values())
+    return [r for r, c in values.items()
+            if sum(ix.cicli.get(c, 0) for ix in indexes) - freed[c] > 0 or asked[c] > 1]
+
+
+# ---------- REPORT DI COERENZA (tutto lo storico, in background) ----------
+def consistency_report(df: pd.DataFrame) -> dict:
+    """
+    CICLO_NR ripetuti, registrazioni identiche, NUMERO_PRG usati per più materiali e
+    minuti conteggiati in più per macchina (copie oltre la prima).
+    """
+    ciclo = _cicli(df)
+    dup_ciclo = ciclo.notna() & ciclo.duplicated(keep=False)
+    h = pd.Series(entry_hashes(df), index=df.index)
+    dup_entry = h.duplicated(keep=False)
+    extra = h.duplicated(keep="first")
+    pairs = pd.DataFrame({"NUMERO_PRG": _norm(_col(df, "NUMERO_PRG")), "MATERIALE": _norm(_col(df, "CODICE_MATERIALE"))})
+    pairs = pairs[pairs["NUMERO_PRG"] != ""]
+    prg = pairs.groupby("NUMERO_PRG")["MATERIALE"].agg(lambda s: sorted(set(s)))
+    prg = prg[prg.map(len) > 1]
+    tmin = pd.to_numeric(_col(df, "TEMPO_FASE_MIN"), errors="coerce").fillna(0)
+    inflated = (pd.DataFrame({"MACCHINA": _col(df, "MACCHINA").astype("string").fillna(""), "T": tmin})[extra.to_numpy()]
+                .groupby("MACCHINA")["T"].agg(["size", "sum"]).rename(columns={"size": "COPIE", "sum": "MINUTI_IN_PIÙ"})
+                .sort_values("MINUTI_IN_PIÙ", ascending=False))
+    return {
+        "rows": len(df),
+        "cicli": df.loc[dup_ciclo].sort_values("CICLO_NR") if "CICLO_NR" in df else df.iloc[0:0],
+        "registrazioni": df.loc[dup_entry.to_numpy()].assign(_k=h[dup_entry]).sort_values(["_k", "Timestamp"]
+                         if "Timestamp" in df else "_k").drop(columns="_k"),
+        "prg": pd.DataFrame({"NUMERO_PRG": prg.index, "MATERIALI": prg.map(", ".join).to_numpy(),
+                             "N": prg.map(len).to_numpy()}),
+        "gonfiati": inflated.reset_index(),
+    }
+
+_reporter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prd-report")
+_reports: dict[tuple, Future] = {}
+_lock = threading.Lock()
+
+def report_in_background(key: tuple, load) -> Future:
+    """consistency_report(load().df) su un thread a parte, una volta per key (es. versione del dataset)."""
+    with _lock:
+        fut = _reports.get(key)
+        if fut is None:
+            _reports.clear()   # basta l'ultimo
+            fut = _reports[key] = _reporter.submit(lambda: consistency_report(load().df))
+    return fut
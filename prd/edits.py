@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from .data import fmt_column, minutes_to_hhmmss_column
+
+# Colonne modificabili (le stesse del form per record) e colonne mostrate solo come riferimento
+EDIT_COLUMNS = ["CODICE_MATERIALE", "DESCRIZIONE", "CICLO_NR", "MACCHINA", "FASE",
+                "NUMERO_PRG", "CARTELLA_MACCHINA", "TEMPO_FASE_MIN"]
+READONLY_COLUMNS = ["Timestamp", "OPERATORE", "DATA"]
+REQUIRED_COLUMNS = ["CODICE_MATERIALE", "DESCRIZIONE", "FASE"]
+
+_TEMPO_RE = r"\d{1,3}:[0-5]?\d(?::[0-5]?\d)?"
+
+
+# ---------- MODIFICA A GRIGLIA ----------
+def edit_frame(df: pd.DataFrame, rows) -> pd.DataFrame:
+    """
+    Righe `rows` (posizioni nel dataset) come testo, nel formato dei form di
+    modifica: indice = posizione della riga, tempo in 'H:MM:SS'.
+    """
+    sub = df.iloc[np.asarray(rows, dtype="int64")]
+    out = pd.DataFrame(index=pd.Index(np.asarray(rows, dtype="int64"), name="RIGA"))
+    for c in READONLY_COLUMNS + EDIT_COLUMNS:
+        if c == "Timestamp":
+            # str() come nel form: è il riferimento con cui il journal riconosce la riga
+            col = sub[c].astype(str) if c in sub.columns else ""
+        elif c == "TEMPO_FASE_MIN":
+            col = minutes_to_hhmmss_column(sub[c]) if c in sub.columns else ""
+        else:
+            col = fmt_column(sub[c]) if c in sub.columns else ""
+        out[c] = col.to_numpy() if isinstance(col, pd.Series) else col
+    return out
+
+def diff_edits(base: pd.DataFrame, edited: pd.DataFrame) -> pd.DataFrame:
+    """Celle cambiate: DataFrame booleano (righe x EDIT_COLUMNS), spazi iniziali/finali ignorati."""
+    cols = [c for c in EDIT_COLUMNS if c in edited.columns]
+    old = base[cols].fillna("").astype(str).apply(lambda s: s.str.strip())
+    new = edited[cols].fillna("").astype(str).apply(lambda s: s.str.strip())
+    return new.ne(old)
+
+def validate_edits(edited: pd.DataFrame, changed: pd.DataFrame) -> list[str]:
+    """Errori delle righe modificate (un solo passaggio per colonna); lista vuota se tutto ok."""
+    rows = changed.index[changed.any(axis=1)]
+    e = edited.loc[rows].fillna("").astype(str).apply(lambda s: s.str.strip())
+    bad = {}
+    for c in REQUIRED_COLUMNS:
+        bad[f"{c} vuoto"] = e[c] == ""
+    ciclo = pd.to_numeric(e["CICLO_NR"].where(e["CICLO_NR"].str.fullmatch(r"\d+")), errors="coerce")
+    bad["CICLO_NR non valido"] = ~(ciclo >= 1)
+    bad["Tempo non valido (hh:mm:ss)"] = ~(e["TEMPO_FASE_MIN"].eq("") | e["TEMPO_FASE_MIN"].str.fullmatch(_TEMPO_RE))
+    errors = []
+    for msg, mask in bad.items():
+        hit = mask[mask].index
+        if len(hit):
+            errors.append(f"{msg}: righe {', '.join(str(i) for i in hit[:20])}" + (" …" if len(hit) > 20 else ""))
+    return errors
+
+def changes_from_edits(base: pd.DataFrame, edited: pd.DataFrame, changed: pd.DataFrame) -> list[tuple[int, str, dict]]:
+    """[(posizione riga, Timestamp originale, {colonna: nuovo valore}), ...] per save_row_changes."""
+    out = []
+    for row in changed.index[changed.any(axis=1)]:
+        vals = {c: str(edited.at[row, c] if pd.notna(edited.at[row, c]) else "").strip()
+                for c in changed.columns[changed.loc[row].to_numpy()]}
+        if "CICLO_NR" in vals:
+            vals["CICLO_NR"] = int(vals["CICLO_NR"])
+        out.append((int(row), base.at[row, "Timestamp"], vals))
+    return out
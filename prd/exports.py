@@ -0,0 +1,124 @@
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from .data import fmt_column, minutes_to_hhmm
+
+# Formati di download: etichetta -> (estensione, mime)
+FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+# Contenuto: dettaglio delle righe filtrate o riepilogo dei tempi per una colonna
+CONTENTS = {
+    "Righe filtrate": None,
+    "Tempo per macchina": "MACCHINA",
+    "Tempo per operatore": "OPERATORE",
+    "Tempo per materiale": "CODICE_MATERIALE",
+}
+# Righe scritte per volta nel CSV (il testo del frame intero non esiste mai in memoria)
+CSV_CHUNK_ROWS = 50_000
+# Byte di export tenuti in cache per tutto il processo
+EXPORT_CACHE_BYTES = 256 * 1024 * 1024
+# Limite di righe di un foglio Excel (intestazione esclusa)
+XLSX_MAX_ROWS = 1_048_575
+
+
+# ---------- EXPORT (generati solo su richiesta, in cache per versione + filtri + formato) ----------
+def summary_frame(df: pd.DataFrame, by: str) -> pd.DataFrame:
+    """Righe, cicli distinti e tempo totale/medio per valore di `by`, dal più lungo."""
+    tmin = pd.to_numeric(df["TEMPO_FASE_MIN"], errors="coerce") if "TEMPO_FASE_MIN" in df else pd.Series(0.0, index=df.index)
+    keys = df[by].astype("string").fillna("") if by in df else pd.Series("", index=df.index)
+    g = pd.DataFrame({by: keys, "CICLO_NR": df.get("CICLO_NR"), "T": tmin})
+    out = g.groupby(by, sort=False).agg(RIGHE=("T", "size"), CICLI=("CICLO_NR", "nunique"), TEMPO_MIN=("T", "sum"))
+    out["TEMPO_MEDIO_MIN"] = (out["TEMPO_MIN"] / out["RIGHE"]).round(1)
+    out = out.sort_values("TEMPO_MIN", ascending=False).reset_index()
+    out["TEMPO_MIN"] = out["TEMPO_MIN"].astype("int64")
+    out["TEMPO (hh:mm)"] = out["TEMPO_MIN"].map(minutes_to_hhmm)
+    return out
+
+def _csv_bytes(df: pd.DataFrame, sep: str) -> bytes:
+    """CSV con date come nel file di produzione, scritto a blocchi di CSV_CHUNK_ROWS righe."""
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    buf = io.BytesIO()
+    for start in range(0, max(len(df), 1), CSV_CHUNK_ROWS):
+        chunk = df.iloc[start:start + CSV_CHUNK_ROWS]
+        if dates:
+            chunk = chunk.assign(**{c: fmt_column(chunk[c]) for c in dates})
+        buf.write(chunk.to_csv(index=False, sep=sep, header=start == 0).encode("utf-8"))
+    return buf.getvalue()
+
+def _xlsx_bytes(df: pd.DataFrame) -> bytes:
+    if len(df) > XLSX_MAX_ROWS:
+        raise ValueError(f"Troppe righe per Excel ({len(df)}): usa CSV o Parquet.")
+    buf = io.BytesIO()
+    try:
+        with pd.ExcelWriter(buf, engine="openpyxl") as xw:
+            df.to_excel(xw, index=False, sheet_name="PRD")
+    except ImportError:
+        raise RuntimeError("Per esportare in Excel serve il pacchetto openpyxl.")
+    return buf.getvalue()
+
+def render_export(df: pd.DataFrame, fmt: str, sep: str = ";") -> bytes:
+    """Contenuto del file nel formato `fmt` (chiave di FORMATS)."""
+    if fmt == "CSV":
+        return _csv_bytes(df, sep)
+    if fmt == "Excel":
+        return _xlsx_bytes(df)
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+class ExportCache:
+    """
+    File già generati, condivisi tra sessioni: la chiave contiene versione del
+    dataset, filtri, contenuto e formato, quindi un dato cambiato è una chiave nuova.
+    Si scartano i meno usati oltre EXPORT_CACHE_BYTES.
+    """
+
+    def __init__(self, max_bytes: int = EXPORT_CACHE_BYTES):
+        self._lock = threading.Lock()
+        self._items: OrderedDict[tuple, bytes] = OrderedDict()
+        self._size = 0
+        self.max_bytes = max_bytes
+
+    def peek(self, key: tuple) -> bytes | None:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def get(self, key: tuple, build) -> bytes:
+        data = self.peek(key)
+        if data is None:
+            data = build()
+            with self._lock:
+                if key not in self._items:
+                    self._items[key] = data
+                    self._size += len(data)
+                while self._size > self.max_bytes and len(self._items) > 1:
+                    self._size -= len(self._items.popitem(last=False)[1])
+        return data
+
+
+_exports = ExportCache()
+
+def cached_export(key: tuple, content: str, fmt: str) -> bytes | None:
+    """Export già pronto (None = da generare)."""
+    return _exports.peek(key + (content, fmt))
+
+def get_export(key: tuple, frame, content: str, fmt: str, sep: str = ";") -> bytes:
+    """
+    Export di `content` (chiave di CONTENTS) in `fmt`; `frame` è una funzione che
+    restituisce le righe filtrate e viene chiamata solo se il file non è in cache.
+    """
+    def build():
+        df = frame()
+        by = CONTENTS[content]
+        return render_export(df if by is None else summary_frame(df, by), fmt, sep)
+    return _exports.get(key + (content, fmt), build)
@@ -0,0 +1,277 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ftplib import FTP, error_perm, error_reply, error_temp
+
+import streamlit as st
+
+from .config import PRIMARY_DIR
+from .tracing import in_context, span, traced
+
+# Pool connessioni
+POOL_SIZE       = 4     # connessioni contemporanee massime verso l'hosting
+ACQUIRE_TIMEOUT = 60    # attesa massima di una connessione libera (s)
+HEALTHCHECK_SEC = 15    # oltre questo ozio la connessione viene verificata con NOOP prima dell'uso
+KEEPALIVE_SEC   = 45    # intervallo NOOP sulle connessioni inattive
+MAX_IDLE_SEC    = 300   # oltre questo ozio la connessione viene chiusa
+
+# Errori dopo cui la connessione non è più affidabile (timeout, 421, socket chiuso, ...)
+TRANSIENT_ERRORS = (error_temp, error_reply, EOFError, OSError)
+
+
+# ---------- FTP ----------
+@traced("ftp.connessione")
+def ftp_connect() -> FTP:
+    ftp = FTP(st.secrets["FTP_HOST"], timeout=90)
+    ftp.set_pasv(True)
+    ftp.login(user=st.secrets["FTP_USER"], passwd=st.secrets["FTP_PASS"])
+    return ftp
+
+def ftp_cwd_existing(ftp: FTP, target_dir: str):
+    try:
+        ftp.cwd(target_dir)
+    except Exception as e:
+        raise RuntimeError(f"Impossibile entrare in {target_dir}: {e}")
+
+@traced("ftp.download", lambda out, ftp, filename, offset=0: {"file": filename, "offset": offset,
+                                                               "bytes": len(out or b"")})
+def ftp_download_file(ftp: FTP, filename: str, offset: int = 0) -> bytes | None:
+    """Scarica il file; con offset > 0 scarica solo i byte da offset in poi (REST)."""
+    bio = io.BytesIO()
+    try:
+        ftp.retrbinary(f"RETR {filename}", bio.write, rest=offset or None)
+        return bio.getvalue()
+    except error_perm as e:
+        if "550" in str(e):
+            return None
+        raise
+
+@traced("ftp.intestazione", lambda out, ftp, filename, *a, **k: {"file": filename, "bytes": len(out or b"")})
+def ftp_read_head(ftp: FTP, filename: str, max_bytes: int = 4096) -> bytes | None:
+    """Legge solo l'inizio del file (fino al primo a capo o max_bytes) e interrompe il RETR."""
+    ftp.voidcmd("TYPE I")
+    try:
+        conn = ftp.transfercmd(f"RETR {filename}")
+    except error_perm as e:
+        if "550" in str(e):
+            return None
+        raise
+    buf = b""
+    try:
+        while len(buf) < max_bytes and b"\n" not in buf:
+            chunk = conn.recv(min(8192, max_bytes - len(buf)))
+            if not chunk:
+                break
+            buf += chunk
+    finally:
+        conn.close()
+    try:
+        ftp.voidresp()   # 226 se il file era già tutto arrivato, altrimenti 426
+    except error_temp:
+        pass
+    nl = buf.find(b"\n")
+    return buf[:nl + 1] if nl >= 0 else buf
+
+@traced("ftp.upload", lambda out, ftp, filename, payload: {"file": filename, "bytes": len(payload)})
+def ftp_upload_file(ftp: FTP, filename: str, payload: bytes):
+    bio = io.BytesIO(payload)
+    ftp.storbinary(f"STOR {filename}", bio)
+
+def ftp_file_exists_and_size(ftp: FTP, filename: str) -> tuple[bool, int]:
+    try:
+        ftp.voidcmd("TYPE I")  # molti server rifiutano SIZE in modalità ASCII
+        size = ftp.size(filename)
+        return True, size if size is not None else 0
+    except error_perm:   # 550: file assente (gli errori di rete invece risalgono)
+        return False, 0
+
+def ftp_mdtm(ftp: FTP, filename: str) -> str | None:
+    """Data ultima modifica remota ('YYYYMMDDhhmmss'); None se il server non supporta MDTM."""
+    try:
+        resp = ftp.sendcmd(f"MDTM {filename}")
+    except error_perm:
+        return None
+    parts = resp.split(maxsplit=1)
+    return parts[1].strip() if len(parts) == 2 and parts[0] == "213" else None
+
+@traced("ftp.versione", lambda out, ftp, filename: {"file": filename})
+def ftp_remote_version(ftp: FTP, filename: str) -> tuple[int, str | None] | None:
+    """Versione economica del file remoto: (SIZE, MDTM). None se il file non esiste."""
+    exists, size = ftp_file_exists_and_size(ftp, filename)
+    if not exists:
+        return None
+    return size, ftp_mdtm(ftp, filename)
+
+
+# ---------- POOL CONNESSIONI ----------
+def _ftp_alive(ftp: FTP) -> bool:
+    try:
+        ftp.voidcmd("NOOP")
+        return True
+    except Exception:
+        return False
+
+def _ftp_close(ftp: FTP):
+    try:
+        ftp.quit()
+    except Exception:
+        try:
+            ftp.close()
+        except Exception:
+            pass
+
+
+class PoolBusy(RuntimeError):
+    """Nessuna connessione libera nel pool entro l'attesa concessa."""
+
+
+class FTPPool:
+    """
+    Pool limitato di connessioni FTP già autenticate e posizionate in `directory`.
+    Le connessioni inattive restano vive con NOOP periodici; quelle che falliscono
+    con errori di rete/4xx vengono scartate e sostituite al prossimo uso.
+    Chi usa una connessione del pool non deve cambiare directory.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, directory: str = PRIMARY_DIR, connect=ftp_connect):
+        self.size = size
+        self.directory = directory
+        self._connect = connect
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: list[tuple[FTP, float]] = []
+        self._lock = threading.Lock()
+        self._keepalive: threading.Thread | None = None
+
+    def _open(self) -> FTP:
+        for attempt in range(3):
+            try:
+                ftp = self._connect()
+                break
+            except error_temp:   # 421: troppe connessioni, riprovo con backoff
+                if attempt == 2:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+        ftp_cwd_existing(ftp, self.directory)
+        return ftp
+
+    def _take(self) -> FTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                ftp, since = self._idle.pop()
+            if time.monotonic() - since < HEALTHCHECK_SEC or _ftp_alive(ftp):
+                return ftp
+            _ftp_close(ftp)
+        return self._open()
+
+    def _give(self, ftp: FTP):
+        with self._lock:
+            self._idle.append((ftp, time.monotonic()))
+            if self._keepalive is None:
+                self._keepalive = threading.Thread(target=self._keepalive_loop, name="ftp-keepalive", daemon=True)
+                self._keepalive.start()
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(KEEPALIVE_SEC)
+            with self._lock:
+                n = len(self._idle)
+            for _ in range(n):
+                self._check_one()
+
+    def _check_one(self):
+        """NOOP su una connessione inattiva alla volta, occupando uno slot come una sessione:
+        le altre restano disponibili e le connessioni aperte non superano mai `size`."""
+        if not self._slots.acquire(blocking=False):
+            return   # pool tutto in uso: le connessioni sono già attive
+        try:
+            with self._lock:
+                if not self._idle:
+                    return
+                ftp, since = self._idle.pop(0)   # la più vecchia
+            if time.monotonic() - since < MAX_IDLE_SEC and _ftp_alive(ftp):
+                with self._lock:
+                    self._idle.append((ftp, since))
+            else:
+                _ftp_close(ftp)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self, wait: bool = True):
+        """Connessione in uso esclusivo; restituita al pool all'uscita.
+        wait=False: PoolBusy subito se non c'è una connessione libera."""
+        with span("ftp.attesa_pool"):
+            if not (self._slots.acquire(timeout=ACQUIRE_TIMEOUT) if wait else self._slots.acquire(blocking=False)):
+                raise PoolBusy("Nessuna connessione FTP disponibile (pool occupato).")
+        ftp = None
+        try:
+            ftp = self._take()
+            yield ftp
+        except error_perm:
+            raise   # 5xx: la connessione resta valida
+        except BaseException:
+            if ftp is not None:
+                _ftp_close(ftp)
+                ftp = None
+            raise
+        finally:
+            if ftp is not None:
+                self._give(ftp)
+            self._slots.release()
+
+    def run(self, fn, retries: int = 1):
+        """Esegue fn(ftp) riprovando su una connessione nuova in caso di errore transitorio.
+        Solo per operazioni idempotenti (letture, STOR completo): mai per APPE."""
+        for attempt in range(retries + 1):
+            try:
+                with self.session() as ftp:
+                    return fn(ftp)
+            except TRANSIENT_ERRORS:
+                if attempt == retries:
+                    raise
+
+    def try_run(self, fn):
+        """fn(ftp) solo se una connessione è libera subito (nessuna attesa, nessun tentativo
+        ulteriore); None altrimenti. Per lavori accessori avviati da chi ha già una connessione."""
+        try:
+            with self.session(wait=False) as ftp:
+                return fn(ftp)
+        except PoolBusy:
+            return None
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ftp, _ in idle:
+            _ftp_close(ftp)
+
+
+_pool = FTPPool()
+
+def ftp_session():
+    return _pool.session()
+
+def ftp_run(fn, retries: int = 1):
+    return _pool.run(fn, retries)
+
+def ftp_try_run(fn):
+    return _pool.try_run(fn)
+
+
+# ---------- TRASFERIMENTI IN PARALLELO ----------
+# Un lavoro = un file (partizione, segmento di backup, ...) su una propria connessione
+# del pool: il tempo totale è circa quello del trasferimento più lento. I lavori non
+# devono a loro volta usare ftp_parallel (i thread sono condivisi) né aspettare una
+# seconda connessione del pool (al più ftp_try_run, che non aspetta).
+_workers = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="prd-ftp")
+
+def ftp_parallel(fns: list) -> list:
+    """Esegue le funzioni senza argomenti in parallelo; risultati nello stesso ordine."""
+    if len(fns) <= 1:
+        return [fn() for fn in fns]
+    futures = [_workers.submit(in_context(fn)) for fn in fns]
+    return [f.result() for f in futures]
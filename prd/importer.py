@@ -0,0 +1,149 @@
+import io
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .config import COLUMNS, OPERATORI, REMOTE_FILE
+from .data import (minutes_to_hhmmss_column, normalize_time_columns, sniff_separator_from_bytes, std,
+                   tempo_to_minutes, to_datetime_safe)
+from .ftp import ftp_session
+from .seq import ciclo_sequence
+from .store import append_production_rows
+
+# Colonne obbligatorie per una riga importata (come nel form di Scrittura)
+REQUIRED = ["OPERATORE", "DATA", "CODICE_MATERIALE", "DESCRIZIONE", "FASE"]
+# Nomi alternativi frequenti negli export delle macchine
+SYNONYMS = {
+    "CODICE_MATERIALE": ["CODICE", "MATERIALE", "COD_MATERIALE", "ARTICOLO"],
+    "DESCRIZIONE": ["DESCR", "DESCRIZIONE_ARTICOLO"],
+    "CICLO_NR": ["CICLO", "N_CICLO", "NR_CICLO"],
+    "NUMERO_PRG": ["PRG", "PROGRAMMA", "N_PRG"],
+    "CARTELLA_MACCHINA": ["CARTELLA"],
+    "TEMPO_FASE_MIN": ["TEMPO", "TEMPO_FASE", "DURATA"],
+    "DATA": ["DATA_LAVORO", "GIORNO"],
+}
+
+
+# ---------- IMPORT DA FILE ----------
+def _norm_name(c: str) -> str:
+    return re.sub(r"[^A-Z0-9]+", "_", str(c).upper()).strip("_")
+
+def read_upload(name: str, data: bytes) -> pd.DataFrame:
+    """CSV (separatore rilevato) o XLSX come DataFrame di testo, vuoti = ''."""
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            df = pd.read_excel(io.BytesIO(data), dtype=str)
+        except ImportError:
+            raise RuntimeError("Per importare file Excel serve il pacchetto openpyxl.")
+    else:
+        sep = sniff_separator_from_bytes(data, default=";")
+        df = pd.read_csv(io.BytesIO(data), sep=sep, dtype=str, keep_default_na=False,
+                         encoding="utf-8-sig", skip_blank_lines=True)
+    df.columns = [str(c).strip() for c in df.columns]
+    return df.fillna("")
+
+def guess_mapping(columns: list[str]) -> dict[str, str | None]:
+    """Colonna del file proposta per ciascuna colonna del CSV di produzione (None = assente)."""
+    by_norm = {_norm_name(c): c for c in columns}
+    out = {}
+    for target in COLUMNS:
+        names = [target] + SYNONYMS.get(target, [])
+        out[target] = next((by_norm[n] for n in names if n in by_norm), None)
+    return out
+
+def _std(ser: pd.Series) -> pd.Series:
+    """std() su una colonna (valori distinti): spazi ripuliti e compattati."""
+    codes, uniq = pd.factorize(ser.fillna("").astype(str), use_na_sentinel=False)
+    return pd.Series(np.array([std(u) for u in uniq] or [""], dtype=object)[codes], index=ser.index)
+
+def _dates(raw: pd.Series) -> pd.Series:
+    """to_datetime_safe sui soli valori distinti (le date di un export si ripetono molto)."""
+    codes, uniq = pd.factorize(raw)
+    parsed = to_datetime_safe(pd.Series(uniq, dtype=object).where(lambda s: s != ""))
+    return pd.Series(parsed.to_numpy()[codes], index=raw.index).where(codes >= 0)
+
+def prepare_import(up: pd.DataFrame, mapping: dict[str, str | None]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Normalizza e valida le righe del file in blocco (un passaggio per colonna).
+    Restituisce (righe valide nelle colonne COLUMNS, errori [RIGA, ERRORI]);
+    RIGA è la riga del file (intestazione = 1). CICLO_NR vuoto = da assegnare.
+    """
+    empty = pd.Series("", index=up.index, dtype=object)
+    cols = {t: _std(up[c]) for t, c in mapping.items() if c}
+    col = lambda t: cols.get(t, empty)
+    out = pd.DataFrame(index=up.index)
+    bad: dict[str, pd.Series] = {}
+
+    for c in ["CODICE_MATERIALE", "DESCRIZIONE", "MACCHINA", "NUMERO_PRG", "CARTELLA_MACCHINA", "FASE"]:
+        out[c] = col(c)
+    out["CODICE_MATERIALE"] = out["CODICE_MATERIALE"].str.upper()
+    out["OPERATORE"] = col("OPERATORE").str.upper()
+    bad["OPERATORE sconosciuto"] = (out["OPERATORE"] != "") & ~out["OPERATORE"].isin(OPERATORI)
+
+    raw = col("DATA")
+    data = _dates(raw)
+    bad["DATA non valida"] = (raw != "") & data.isna()
+    out["DATA"] = data.dt.strftime("%Y-%m-%d").fillna("")
+
+    raw = col("Timestamp")
+    ts = _dates(raw)
+    bad["Timestamp non valido"] = (raw != "") & ts.isna()
+    out["Timestamp"] = ts.dt.strftime("%Y-%m-%d %H:%M:%S").fillna(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    raw = col("CICLO_NR")
+    ciclo = pd.to_numeric(raw.where(raw.str.fullmatch(r"\d+(?:\.0+)?")), errors="coerce")
+    bad["CICLO_NR non valido"] = (raw != "") & ~(ciclo >= 1)
+    out["CICLO_NR"] = ciclo.astype("Int64")
+
+    # tempo: 'H:MM[:SS]' o minuti come nel CSV; in alternativa colonne ORE + MINUTI del file
+    raw = col("TEMPO_FASE_MIN")
+    if mapping.get("TEMPO_FASE_MIN"):
+        minutes = tempo_to_minutes(raw.where(raw != ""))
+        bad["Tempo non valido"] = (raw != "") & (minutes.isna() | (minutes < 0))
+    else:
+        names = {_norm_name(c): c for c in up.columns}
+        src = up[[names[n] for n in ["ORE", "MINUTI"] if n in names]]
+        src.columns = [_norm_name(c) for c in src.columns]
+        minutes = normalize_time_columns(src.copy())["TEMPO_FASE_MIN"]
+        # né colonna tempo né ORE + MINUTI: le righe non si importano a 0:00:00
+        bad["Tempo mancante (serve la colonna tempo o ORE e MINUTI)"] = minutes.isna()
+    out["TEMPO_FASE_MIN"] = minutes_to_hhmmss_column(minutes.fillna(0))
+
+    for c in REQUIRED:
+        bad[f"{c} mancante"] = col(c) == ""
+
+    errors = pd.Series("", index=up.index, dtype=object)
+    for msg, mask in bad.items():
+        errors = errors.where(~mask, errors + "; " + msg)
+    errors = errors.str.lstrip("; ")
+    ko = (errors != "").to_numpy()
+    report = pd.DataFrame({"RIGA": np.arange(2, len(up) + 2)[ko], "ERRORI": errors.to_numpy()[ko]})
+    return out.loc[~ko, COLUMNS].reset_index(drop=True), report
+
+def import_rows(rows: pd.DataFrame, filename: str = REMOTE_FILE, ftp=None) -> int:
+    """
+    Assegna i CICLO_NR mancanti con una sola prenotazione (blocco contiguo, in ordine
+    di file), fa avanzare il contatore oltre i CICLO_NR espliciti e accoda tutte le
+    righe con un solo APPE (uno per mese nell'archivio mensile). Restituisce il primo
+    CICLO_NR assegnato (0 se nessuno).
+    """
+    if rows.empty:
+        return 0
+    rows = rows.copy()
+    auto = rows["CICLO_NR"].isna().to_numpy()
+    first = 0
+    if (~auto).any():
+        ciclo_sequence.reserve(int(rows.loc[~auto, "CICLO_NR"].max()))
+    if auto.any():
+        first = ciclo_sequence.reserve(count=int(auto.sum()))
+        rows.loc[auto, "CICLO_NR"] = np.arange(first, first + int(auto.sum()))
+    rows["CICLO_NR"] = rows["CICLO_NR"].astype("int64")
+    records = rows.to_dict("records")
+    if ftp is None:
+        with ftp_session() as f:
+            append_production_rows(f, filename, records, preferred_columns=COLUMNS)
+    else:
+        append_production_rows(ftp, filename, records, preferred_columns=COLUMNS)
+    return first
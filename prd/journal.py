@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+from datetime import datetime
+from ftplib import FTP
+
+import pandas as pd
+
+from .data import to_datetime_safe, type_value
+from .tracing import traced
+
+# Oltre questo numero di modifiche pendenti il journal viene compattato nel CSV
+JOURNAL_COMPACT_AT = 200
+
+
+# ---------- JOURNAL MODIFICHE ----------
+# Una riga JSON per modifica: {"row": n, "ts": Timestamp originale, "set": {col: valore}, "user", "at"}.
+# "row" è la posizione della riga dati nel CSV (0 = prima riga dopo l'header): il file
+# cresce solo in coda e la compattazione non cambia l'ordine, quindi resta stabile.
+def journal_name(filename: str) -> str:
+    return f"{filename}.journal"
+
+def make_patch(row_id: int, ts, changes: dict, user: str | None = None) -> bytes:
+    entry = {"row": int(row_id), "ts": str(ts), "set": changes, "user": user,
+             "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    return (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+@traced("ftp.append_journal", lambda out, ftp, filename, patches: {"file": filename,
+                                                                  "bytes": sum(map(len, patches))})
+def append_patches(ftp: FTP, filename: str, patches: list[bytes]):
+    """Accoda le modifiche al journal con un solo APPE (crea il file se manca)."""
+    ftp.storbinary(f"APPE {journal_name(filename)}", io.BytesIO(b"".join(patches)))
+
+def parse_journal(data: bytes) -> tuple[list[dict], int]:
+    """Voci complete del journal e byte consumati (una riga in scrittura viene lasciata per dopo)."""
+    end = data.rfind(b"\n") + 1
+    entries = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return entries, end
+
+def _same_ts(value, ts: str) -> bool:
+    """Il Timestamp della riga coincide con quello registrato nella modifica (testo o data)."""
+    if str(value) == ts:
+        return True
+    return str(to_datetime_safe(pd.Series([value], dtype=object)).iloc[0]) == ts
+
+def _numeric_target(ser: pd.Series, val):
+    """
+    Tipo a cui portare la colonna numerica per accogliere val: None se va bene così
+    (numpy.int64 da type_value, NA in una colonna nullable); una colonna intera diventa
+    nullable o decimale solo se serve, object solo per valori non numerici.
+    """
+    nullable = isinstance(ser.dtype, pd.api.extensions.ExtensionDtype)
+    if pd.isna(val):
+        return None if nullable or ser.dtype.kind == "f" else "Int64"
+    if not pd.api.types.is_number(val):
+        return object
+    if ser.dtype.kind in "iu" and not float(val).is_integer():
+        return "Float64" if nullable else "float64"
+    return None
+
+def apply_patches(df: pd.DataFrame, entries: list[dict]) -> pd.DataFrame:
+    """Applica le modifiche sul DataFrame tipizzato (in place). Le voci il cui Timestamp
+    non corrisponde alla riga indicata vengono ignorate (journal di un altro file)."""
+    has_ts = "Timestamp" in df.columns
+    for e in entries:
+        row = e["row"]
+        if not 0 <= row < len(df):
+            continue
+        if has_ts and not _same_ts(df.iat[row, df.columns.get_loc("Timestamp")], e["ts"]):
+            continue
+        for col, val in e["set"].items():
+            if col not in df.columns:
+                continue
+            val = type_value(col, val)
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                cats = df[col].cat.categories
+                if pd.notna(val) and val not in cats:
+                    df[col] = df[col].cat.add_categories(pd.Index([val], dtype=cats.dtype))
+            elif df[col].dtype.kind in "iuf" and (target := _numeric_target(df[col], val)) is not None:
+                df[col] = df[col].astype(target)
+            df.iat[row, df.columns.get_loc(col)] = val
+    return df
+
+def latest_changes(entries: list[dict]) -> dict[int, tuple[str, dict]]:
+    """Per ogni riga: Timestamp atteso e valori finali (l'ultima modifica vince)."""
+    out: dict[int, tuple[str, dict]] = {}
+    for e in entries:
+        ts, changes = out.get(e["row"], (e["ts"], {}))
+        changes.update(e["set"])
+        out[e["row"]] = (ts, changes)
+    return out
+
+def rewrite_csv(raw: bytes, sep: str, entries: list[dict]) -> bytes:
+    """
+    Riscrive il CSV applicando le modifiche riga per riga; le righe non toccate
+    e l'header restano quelli originali.
+    """
+    changes = latest_changes(entries)
+    text = raw.decode("utf-8")
+    reader = csv.reader(io.StringIO(text, newline=""), delimiter=sep)
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=sep, lineterminator="\n", quoting=csv.QUOTE_MINIMAL)
+    header = next(reader)
+    writer.writerow(header)
+    names = [c.strip() for c in header]
+    ts_pos = names.index("Timestamp") if "Timestamp" in names else None
+    row_id = 0
+    for rec in reader:
+        if not rec:
+            continue   # riga vuota: pandas la salta, quindi non conta come riga dati
+        if row_id in changes:
+            ts, vals = changes[row_id]
+            if ts_pos is None or (ts_pos < len(rec) and _same_ts(rec[ts_pos], ts)):
+                rec = rec + [""] * (len(names) - len(rec))
+                for col, val in vals.items():
+                    if col in names:
+                        rec[names.index(col)] = "" if val is None else str(val)
+        writer.writerow(rec)
+        row_id += 1
+    return out.getvalue().encode("utf-8")
@@ -0,0 +1,260 @@
+import hashlib
+import io
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from ftplib import FTP, error_perm
+
+from .ftp import ftp_download_file, ftp_file_exists_and_size, ftp_upload_file
+from .tracing import log_error, span
+
+# Durata di un lease di riscrittura (scaduto si può prendere) e attesa massima per ottenerlo
+LEASE_SEC      = 60
+LEASE_WAIT_SEC = 30
+# Byte già noti riscaricati per verificare che il file sia solo cresciuto prima di riaccodarne la coda
+TAIL_CHECK     = 4096
+# Tentativi di sostituzione quando il file continua a crescere durante la riscrittura
+REPLACE_TRIES  = 5
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# ---------- LEASE DI RISCRITTURA ----------
+# Gli APPE restano senza lock: più operatori accodano in parallelo. Chi riscrive un file
+# intero (sostituzione dopo una compattazione, migrazione, manifest, contatore CICLO_NR)
+# crea la cartella "<file>.lockdir" con MKD, che riesce a un solo processo (atomico sul
+# server), e ci scrive "lease" = "owner;scadenza epoch;token". Un lease scaduto
+# (processo morto) si spezza rinominando la cartella altrove: anche RNFR/RNTO riesce a
+# uno solo. Gli APPE sul file aspettano solo mentre un lease altrui è attivo.
+def lock_name(filename: str) -> str:
+    return f"{filename}.lockdir"
+
+def _info_name(lockdir: str) -> str:
+    return f"{lockdir}/lease"
+
+_local = threading.local()      # lease tenuti dal thread: filename -> [token, profondità]
+_proc_locks: dict[str, threading.Lock] = {}
+_proc_guard = threading.Lock()
+_infoless: dict[str, float] = {}   # cartella di lock vista senza "lease": da quando (monotonic)
+
+def _held() -> dict[str, list]:
+    if not hasattr(_local, "held"):
+        _local.held = {}
+    return _local.held
+
+def _proc_lock(filename: str) -> threading.Lock:
+    with _proc_guard:
+        return _proc_locks.setdefault(filename, threading.Lock())
+
+def _read_info(ftp: FTP, lockdir: str) -> tuple[str, float, str] | None:
+    exists, _ = ftp_file_exists_and_size(ftp, _info_name(lockdir))
+    if not exists:
+        return None
+    data = ftp_download_file(ftp, _info_name(lockdir))
+    try:
+        owner, expires, token = data.decode("utf-8").strip().split(";")
+        return owner, float(expires), token
+    except Exception:
+        return None
+
+def read_lease(ftp: FTP, filename: str) -> tuple[str, float, str] | None:
+    """(owner, scadenza, token) del lease sul file; None se libero (o appena creato, senza dati)."""
+    return _read_info(ftp, lock_name(filename))
+
+def _other_lease(ftp: FTP, filename: str) -> tuple[str, float, str] | None:
+    """Lease attivo di un altro processo/thread sul file (None se libero, scaduto o nostro)."""
+    if filename in _held():
+        return None
+    cur = read_lease(ftp, filename)
+    return cur if cur is not None and cur[1] > time.time() else None
+
+def _remove_lockdir(ftp: FTP, lockdir: str):
+    for cmd, name in ((ftp.delete, _info_name(lockdir)), (ftp.rmd, lockdir)):
+        try:
+            cmd(name)
+        except error_perm:
+            pass
+
+def _break(ftp: FTP, filename: str, token: str | None):
+    """Spezza il lease scaduto con quel token: la cartella si rinomina (uno solo ci riesce)
+    e si cancella; se nel frattempo era stato ripreso da altri la si rimette a posto."""
+    lockdir = lock_name(filename)
+    stale = f"{lockdir}.scaduto-{uuid.uuid4().hex[:8]}"
+    try:
+        ftp.rename(lockdir, stale)
+    except error_perm:
+        return   # già spezzato o rilasciato
+    cur = _read_info(ftp, stale)
+    if (cur[2] if cur else None) != token:
+        try:
+            ftp.rename(stale, lockdir)
+            return
+        except error_perm:
+            pass
+    _remove_lockdir(ftp, stale)
+
+def _acquire(ftp: FTP, filename: str, ttl: float, wait: float) -> str:
+    lockdir = lock_name(filename)
+    deadline, pause = time.monotonic() + wait, 0.05
+    while True:
+        try:
+            ftp.mkd(lockdir)
+        except error_perm:
+            cur = read_lease(ftp, filename)
+            if cur is None:
+                # cartella senza dati: creazione in corso o processo morto subito dopo MKD
+                with _proc_guard:
+                    since = _infoless.setdefault(lockdir, time.monotonic())
+                if time.monotonic() - since > ttl:
+                    _break(ftp, filename, None)
+            else:
+                with _proc_guard:
+                    _infoless.pop(lockdir, None)
+                if cur[1] <= time.time():
+                    _break(ftp, filename, cur[2])
+        else:
+            token = uuid.uuid4().hex[:12]
+            ftp_upload_file(ftp, _info_name(lockdir), f"{OWNER};{time.time() + ttl:.0f};{token}\n".encode("utf-8"))
+            with _proc_guard:
+                _infoless.pop(lockdir, None)
+            return token
+        if time.monotonic() >= deadline:
+            who = f" da {cur[0]}" if cur else ""
+            raise RuntimeError(f"{filename} in riscrittura{who}: riprova tra poco.")
+        time.sleep(pause)
+        pause = min(pause * 2, 1.0)
+
+def _release(ftp: FTP, filename: str, token: str):
+    try:
+        cur = read_lease(ftp, filename)
+        if cur is not None and cur[2] == token:   # scaduto e preso da altri: non è più nostro
+            _remove_lockdir(ftp, lock_name(filename))
+    except Exception as e:
+        log_error(f"rilascio lease {filename}", e)   # scade da solo dopo il TTL
+
+@contextmanager
+def write_lease(ftp: FTP, filename: str, ttl: float = LEASE_SEC, wait: float = LEASE_WAIT_SEC):
+    """Lease esclusivo per riscrivere `filename` (rientrante nello stesso thread)."""
+    held = _held()
+    if filename in held:
+        held[filename][1] += 1
+        try:
+            yield held[filename][0]
+        finally:
+            held[filename][1] -= 1
+        return
+    lock = _proc_lock(filename)
+    if not lock.acquire(timeout=wait):
+        raise RuntimeError(f"{filename} in riscrittura in questo processo: riprova tra poco.")
+    try:
+        with span("lease", file=filename):
+            token = _acquire(ftp, filename, ttl, wait)
+        held[filename] = [token, 1]
+        try:
+            yield token
+        finally:
+            del held[filename]
+            _release(ftp, filename, token)
+    finally:
+        lock.release()
+
+def wait_for_lease(ftp: FTP, filename: str, wait: float = LEASE_WAIT_SEC) -> bool:
+    """
+    Prima di un APPE: aspetta che finisca una riscrittura altrui in corso sul file.
+    True se ha aspettato (il file può essere cambiato: SIZE e intestazione vanno riletti).
+    """
+    deadline, pause, waited = time.monotonic() + wait, 0.05, False
+    while (cur := _other_lease(ftp, filename)) is not None:
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"{filename} in riscrittura da {cur[0]}: riprova tra poco.")
+        time.sleep(pause)
+        pause, waited = min(pause * 2, 0.5), True
+    return waited
+
+
+# ---------- VERSIONE DEL FILE (sidecar) ----------
+# "<file>.ver" = {"gen", "size", "sha1", "by", "at"}: la generazione cresce a ogni
+# riscrittura (gli APPE non la cambiano), size e sha1 descrivono il contenuto scritto.
+# Chi riscrive parte da (gen, byte letti) e sostituisce il file solo se gen è ancora
+# quella e i byte letti sono ancora l'inizio del file.
+def version_name(filename: str) -> str:
+    return f"{filename}.ver"
+
+_gens: dict[str, int] = {}   # ultima generazione vista da questo processo (senza accessi FTP)
+
+def read_version(ftp: FTP, filename: str) -> dict:
+    data = ftp_download_file(ftp, version_name(filename))
+    try:
+        ver = json.loads(data.decode("utf-8")) if data else {"gen": 0}
+    except ValueError:
+        ver = {"gen": 0}
+    _gens[filename] = ver.get("gen", 0)
+    return ver
+
+def known_generation(filename: str) -> int | None:
+    """Generazione del file vista per ultima (caricamento completo, riscrittura); None se mai letta."""
+    return _gens.get(filename)
+
+def _write_version(ftp: FTP, filename: str, gen: int, payload: bytes):
+    ver = {"gen": gen, "size": len(payload), "sha1": hashlib.sha1(payload).hexdigest(), "by": OWNER,
+           "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    ftp_upload_file(ftp, version_name(filename), json.dumps(ver).encode("utf-8"))
+    _gens[filename] = gen
+
+def _rename_over(ftp: FTP, src: str, dst: str):
+    try:
+        ftp.rename(src, dst)
+    except error_perm:
+        ftp.delete(dst)   # server che non sovrascrivono con RNTO
+        ftp.rename(src, dst)
+
+def replace_file(ftp: FTP, filename: str, base: bytes, payload: bytes, gen: int, lease: str | None = None) -> int:
+    """
+    Sostituisce `filename`, letto come `base` alla generazione `gen`, con `payload` (la sua
+    riscrittura). Il nuovo contenuto si carica su un file temporaneo senza lease; sotto il
+    lease (`lease`, default filename) si riaccodano al temporaneo i soli byte arrivati dopo
+    `base` e lo si rinomina: gli APPE aspettano pochi comandi, non l'upload, e chi legge
+    non vede mai un file a metà. Restituisce i byte riaccodati.
+    """
+    tmp = f"{filename}.tmp-{uuid.uuid4().hex[:8]}"
+    ftp_upload_file(ftp, tmp, payload)
+    try:
+        with write_lease(ftp, lease or filename):
+            if read_version(ftp, filename).get("gen", 0) != gen:
+                raise RuntimeError(f"{filename} riscritto da un altro processo nel frattempo: riprova.")
+            known, sent = base, 0
+            for _ in range(REPLACE_TRIES):
+                _, size = ftp_file_exists_and_size(ftp, filename)
+                if size < len(known):
+                    raise RuntimeError(f"{filename} accorciato da un altro processo nel frattempo: riprova.")
+                if size > len(known):
+                    check = min(TAIL_CHECK, len(known))
+                    data = ftp_download_file(ftp, filename, offset=len(known) - check) or b""
+                    if data[:check] != known[len(known) - check:]:
+                        raise RuntimeError(f"{filename} riscritto da un altro processo nel frattempo: riprova.")
+                    known += data[check:]
+                    if not known.endswith(b"\n"):
+                        time.sleep(0.1)   # APPE in corso: rileggo la coda quando è completa
+                        continue
+                tail = known[len(base):]
+                if tail.startswith(b"\n") and payload.endswith(b"\n") and not base.endswith(b"\n"):
+                    tail = tail[1:]   # a capo aggiunto dall'APPE su un file senza a capo finale
+                if len(tail) > sent:
+                    ftp.storbinary(f"APPE {tmp}", io.BytesIO(tail[sent:]))
+                    sent = len(tail)
+                if ftp_file_exists_and_size(ftp, filename)[1] != len(known):
+                    continue   # APPE arrivati intanto (prima che vedessero il lease): si riaccodano
+                _rename_over(ftp, tmp, filename)
+                _write_version(ftp, filename, gen + 1, payload + tail)
+                return len(tail)
+            raise RuntimeError(f"{filename} continua a crescere durante la riscrittura: riprova.")
+    finally:
+        try:
+            ftp.delete(tmp)
+        except error_perm:
+            pass   # già rinominato
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from .config import COLUMNS, OUTBOX_DIR, REMOTE_FILE
+from .ftp import ftp_download_file, ftp_file_exists_and_size, ftp_session
+from .seq import ciclo_sequence
+from .store import append_production_rows, append_target
+
+# Righe massime per APPE e attesa dopo un invio per raccogliere quelli vicini
+BATCH_MAX    = 200
+BATCH_LINGER = 0.5
+# Controllo periodico della coda e attesa massima tra due tentativi falliti
+FLUSH_SEC    = 5
+MAX_BACKOFF  = 60
+# Per quanto una chiave già inviata scarta ancora lo stesso invio ripetuto
+SENT_KEEP_SEC = 600
+
+
+# ---------- CODA LOCALE DI SCRITTURA ----------
+def _fsync_write(path: str, data: bytes):
+    """Scrittura atomica e persistente (file temporaneo + rename)."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Outbox:
+    """
+    Write-ahead log delle registrazioni di Scrittura sul disco dell'host:
+    l'invio dell'operatore è solo un append locale, un thread le porta sul CSV
+    remoto a blocchi (un APPE per blocco).
+
+    File in OUTBOX_DIR:
+      "<file>.outbox.jsonl"  una riga per registrazione {id, row, ciclo_req, at}
+      "<file>.outbox.done"   "generazione;offset": byte del log già arrivati sul server
+      "<file>.outbox.flight" blocco in scrittura: righe (con CICLO_NR assegnati),
+                             SIZE remota di partenza, lunghezza e hash dei byte accodati.
+    Se un APPE va a buon fine ma la conferma si perde, al tentativo successivo i byte
+    del blocco si ritrovano sul server a partire da quella SIZE e non si riscrivono.
+    Un solo processo per coda (l'app Streamlit gira in un processo).
+    """
+
+    def __init__(self, filename: str = REMOTE_FILE, directory: str = OUTBOX_DIR):
+        self.filename = filename
+        base = os.path.join(directory, f"{filename}.outbox")
+        self.directory = directory
+        self.log_path, self.done_path, self.flight_path = base + ".jsonl", base + ".done", base + ".flight"
+        self._lock = threading.Lock()         # file della coda
+        self._flush_lock = threading.Lock()   # un invio alla volta
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pending: dict[str, dict] = {}   # id -> voce non ancora inviata
+        self._sent: dict[str, float] = {}     # id -> quando è arrivata sul server (monotonic)
+        self.last_error: str | None = None
+        self.last_flush: datetime | None = None
+        self._loaded = False
+
+    # --- file locali ---
+    # Il log inizia con {"gen": ...}: svuotarlo è un solo replace atomico con una nuova
+    # generazione, e un offset "fatto" di una generazione precedente non vale più.
+    def _load(self):
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self.log_path):
+            self._rotate()
+        entries, _ = self._read_pending()
+        self._pending = {e["id"]: e for e in entries}
+        self._loaded = True
+
+    def _rotate(self):
+        _fsync_write(self.log_path, (json.dumps({"gen": uuid.uuid4().hex}) + "\n").encode("ascii"))
+
+    def _header(self) -> tuple[str, int]:
+        with open(self.log_path, "rb") as f:
+            first = f.readline()
+        return json.loads(first)["gen"], len(first)
+
+    def _done_offset(self, gen: str, start: int) -> int:
+        try:
+            with open(self.done_path, "rb") as f:
+                done_gen, offset = f.read().decode("ascii").strip().split(";")
+            return int(offset) if done_gen == gen else start
+        except (OSError, ValueError):
+            return start
+
+    def _read_pending(self) -> tuple[list[dict], list[int]]:
+        """Voci non ancora inviate e offset di fine di ciascuna nel log."""
+        gen, start = self._header()
+        done = self._done_offset(gen, start)
+        with open(self.log_path, "rb") as f:
+            f.seek(done)
+            data = f.read()
+        entries, ends, pos = [], [], done
+        for line in data.splitlines(keepends=True):
+            pos += len(line)
+            if not line.endswith(b"\n"):
+                break   # riga troncata da un crash durante l'append: mai confermata all'operatore
+            if line.strip():
+                entries.append(json.loads(line))
+                ends.append(pos)
+        return entries, ends
+
+    def _mark_done(self, gen: str, offset: int):
+        with self._lock:
+            if self._header()[0] == gen:
+                _fsync_write(self.done_path, f"{gen};{offset}".encode("ascii"))
+                if offset >= os.path.getsize(self.log_path):
+                    self._rotate()   # tutto inviato: log nuovo
+            entries, _ = self._read_pending()
+            now = time.monotonic()
+            self._sent = {k: t for k, t in self._sent.items() if now - t < SENT_KEEP_SEC}
+            pending = {e["id"]: e for e in entries}
+            self._sent.update((k, now) for k in self._pending.keys() - pending.keys())
+            self._pending = pending
+
+    def _read_flight(self) -> dict | None:
+        try:
+            with open(self.flight_path, "rb") as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _clear_flight(self):
+        try:
+            os.remove(self.flight_path)
+        except FileNotFoundError:
+            pass
+
+    # --- API ---
+    def enqueue(self, row: dict, ciclo_req: int | None = None, key: str | None = None) -> str:
+        """
+        Registra la riga sul disco locale (fsync) e sveglia l'invio. ciclo_req None =
+        CICLO_NR assegnato all'invio (il prossimo libero). key è la chiave di
+        idempotenza: lo stesso invio ripetuto (doppio click) viene scartato, sia in
+        coda sia per SENT_KEEP_SEC dopo l'arrivo sul server.
+        """
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            self._load()
+            if key not in self._pending and key not in self._sent:
+                entry = {"id": key, "row": row, "ciclo_req": ciclo_req,
+                         "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+                line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                with open(self.log_path, "ab") as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._pending[key] = entry
+        self.start()
+        self._wake.set()
+        return key
+
+    def pending(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._pending)
+
+    def pending_auto(self) -> int:
+        """Righe in coda che riceveranno il prossimo CICLO_NR libero."""
+        with self._lock:
+            self._load()
+            return sum(1 for e in self._pending.values() if e.get("ciclo_req") is None)
+
+    def pending_rows(self) -> list[dict]:
+        """Righe in coda non ancora inviate (per i controlli dei duplicati)."""
+        with self._lock:
+            self._load()
+            return [e["row"] for e in self._pending.values()]
+
+    def flush(self) -> int:
+        """Invia tutta la coda (blocchi da BATCH_MAX); restituisce le righe scritte."""
+        sent = 0
+        with self._flush_lock:
+            with self._lock:
+                self._load()
+            while True:
+                n = self._flush_batch()
+                if n is None:
+                    break
+                sent += n
+        self.last_flush = datetime.now()
+        return sent
+
+    def _flush_batch(self) -> int | None:
+        flight = self._read_flight()
+        if flight is None:
+            entries, ends = self._read_pending()
+            if not entries:
+                return None
+            # un blocco va su un solo file (archivio mensile: voci consecutive dello stesso mese)
+            target = append_target(self.filename, entries[0]["row"])
+            n = 1
+            while n < min(len(entries), BATCH_MAX) and append_target(self.filename, entries[n]["row"]) == target:
+                n += 1
+            entries, end = entries[:n], ends[n - 1]
+            rows = self._assign_ciclo(entries)
+            flight = {"rows": rows, "gen": self._header()[0], "end": end, "file": target}
+            _fsync_write(self.flight_path, json.dumps(flight).encode("utf-8"))
+
+        with ftp_session() as ftp:
+            if "size" in flight and self._already_appended(ftp, flight):
+                self._done(flight)
+                return len(flight["rows"])
+
+            def _before(size, payload):
+                flight.update(size=size, len=len(payload), sha=hashlib.sha1(payload).hexdigest())
+                _fsync_write(self.flight_path, json.dumps(flight).encode("utf-8"))
+
+            append_production_rows(ftp, self.filename, [dict(r) for r in flight["rows"]],
+                                   preferred_columns=COLUMNS, before_append=_before)
+        self._done(flight)
+        return len(flight["rows"])
+
+    def _assign_ciclo(self, entries: list[dict]) -> list[dict]:
+        """CICLO_NR definitivi: un blocco unico per le righe senza numero richiesto."""
+        auto = [e for e in entries if e.get("ciclo_req") is None]
+        first = ciclo_sequence.reserve(count=len(auto)) if auto else None
+        rows = []
+        for e in entries:
+            row = dict(e["row"])
+            if e.get("ciclo_req") is None:
+                row["CICLO_NR"], first = first, first + 1
+            else:
+                row["CICLO_NR"] = ciclo_sequence.reserve(int(e["ciclo_req"]))
+            rows.append(row)
+        return rows
+
+    def _already_appended(self, ftp, flight: dict) -> bool:
+        target = flight.get("file", self.filename)
+        exists, size = ftp_file_exists_and_size(ftp, target)
+        if not exists or size < flight["size"] + flight["len"]:
+            return False
+        data = ftp_download_file(ftp, target, offset=flight["size"]) or b""
+        return hashlib.sha1(data[:flight["len"]]).hexdigest() == flight["sha"]
+
+    def _done(self, flight: dict):
+        self._mark_done(flight["gen"], flight["end"])
+        self._clear_flight()
+
+    # --- invio in background ---
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="prd-outbox", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        backoff = FLUSH_SEC
+        while True:
+            woken = self._wake.wait(backoff)
+            self._wake.clear()
+            if woken:
+                time.sleep(BATCH_LINGER)   # raccoglie gli invii arrivati insieme (cambio turno)
+            if not self.pending() and self._read_flight() is None:
+                backoff = FLUSH_SEC
+                continue
+            try:
+                self.flush()
+                self.last_error = None
+                backoff = FLUSH_SEC
+            except Exception as e:
+                self.last_error = str(e)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+outbox = Outbox()
@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+
+import pandas as pd
+
+from .cache import REVALIDATE_SEC, get_dataset
+from .config import REMOTE_FILE
+from .data import concat_typed, normalize_time_columns, to_datetime_safe
+from .dupes import DuplicateIndex
+from .ftp import ftp_download_file, ftp_parallel, ftp_run, ftp_upload_file
+from .rollups import merge_rollups
+from .search import SearchIndex
+from .tracing import run
+
+# Partizione delle righe senza DATA valida
+NO_DATE = "senza-data"
+# Mesi caricati di default quando nessun filtro indica il periodo
+DEFAULT_MONTHS = 3
+# Dataset combinati tenuti in memoria (selezioni di partizioni diverse)
+MAX_COMBINED = 8
+
+
+# ---------- ARCHIVIO MENSILE (un CSV per mese + manifest) ----------
+# "<file>.manifest.json": {"columns", "sep", "partitions": {"YYYY-MM": {"file", "rows",
+# "bytes", "data_min", "data_max", "ciclo_min", "ciclo_max"}}}. Ogni partizione è un CSV
+# come il file unico (journal, snapshot, backup e cache per file valgono uguali);
+# il manifest è il punto di commit della migrazione: finché manca si usa il file unico.
+def manifest_name(filename: str) -> str:
+    return f"{filename}.manifest.json"
+
+def partition_name(filename: str, key: str) -> str:
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}_{key}{ext}"
+
+def month_keys(data: pd.Series) -> pd.Series:
+    """Chiave di partizione per riga ("YYYY-MM", NO_DATE se DATA manca o non è valida)."""
+    d = data if pd.api.types.is_datetime64_any_dtype(data) else to_datetime_safe(data.replace("", None))
+    return d.dt.strftime("%Y-%m").fillna(NO_DATE)
+
+def partition_stats(df: pd.DataFrame) -> dict:
+    """Righe e intervalli DATA/CICLO_NR di un frame tipizzato (per il manifest)."""
+    def _fmt(v):
+        return None if pd.isna(v) else (v.strftime("%Y-%m-%d") if hasattr(v, "strftime") else int(v))
+    d = df["DATA"] if "DATA" in df.columns else pd.Series(dtype="datetime64[ns]")
+    c = pd.to_numeric(df["CICLO_NR"], errors="coerce") if "CICLO_NR" in df.columns else pd.Series(dtype=float)
+    return {"rows": len(df), "data_min": _fmt(d.min()), "data_max": _fmt(d.max()),
+            "ciclo_min": _fmt(c.min()), "ciclo_max": _fmt(c.max())}
+
+def merge_stats(entry: dict, stats: dict) -> dict:
+    """Statistiche di una partizione dopo un append di righe con `stats`."""
+    out = dict(entry, rows=entry.get("rows", 0) + stats["rows"])
+    for k, pick in [("data_min", min), ("data_max", max), ("ciclo_min", min), ("ciclo_max", max)]:
+        vals = [v for v in (entry.get(k), stats[k]) if v is not None]
+        out[k] = pick(vals) if vals else None
+    return out
+
+
+_lock = threading.Lock()
+_manifests: dict[str, tuple[float, dict | None]] = {}   # filename -> (controllato alle, manifest)
+
+def read_manifest(ftp, filename: str) -> dict | None:
+    data = ftp_download_file(ftp, manifest_name(filename))
+    return json.loads(data.decode("utf-8")) if data else None
+
+def write_manifest(ftp, filename: str, manifest: dict):
+    ftp_upload_file(ftp, manifest_name(filename), json.dumps(manifest, indent=1).encode("utf-8"))
+    with _lock:
+        _manifests[filename] = (time.monotonic(), manifest)
+
+def get_manifest(filename: str = REMOTE_FILE, ftp=None) -> dict | None:
+    """Manifest dell'archivio mensile (None = file unico), riletto al più ogni REVALIDATE_SEC."""
+    with _lock:
+        cached = _manifests.get(filename)
+    if cached is not None and time.monotonic() - cached[0] < REVALIDATE_SEC:
+        return cached[1]
+    manifest = read_manifest(ftp, filename) if ftp is not None else ftp_run(lambda f: read_manifest(f, filename))
+    with _lock:
+        _manifests[filename] = (time.monotonic(), manifest)
+    return manifest
+
+def forget_manifest(filename: str | None = None):
+    with _lock:
+        if filename is None:
+            _manifests.clear()
+        else:
+            _manifests.pop(filename, None)
+
+
+def select_partitions(manifest: dict, day: date | None = None, start: date | None = None,
+                      end: date | None = None, last_months: int | None = DEFAULT_MONTHS,
+                      ciclo: int | None = None) -> list[str]:
+    """
+    Partizioni necessarie ai filtri, in ordine cronologico: un giorno preciso, un
+    intervallo di date, un CICLO_NR (dagli intervalli del manifest) oppure gli ultimi
+    `last_months` mesi presenti (None = tutto l'archivio).
+    """
+    parts = manifest["partitions"]
+    keys = sorted(k for k in parts if k != NO_DATE)
+    if day is not None:
+        return [k for k in keys if k == day.strftime("%Y-%m")]
+    if start is not None or end is not None:
+        lo = start.strftime("%Y-%m") if start else ""
+        hi = end.strftime("%Y-%m") if end else "9999-99"
+        return [k for k in keys if lo <= k <= hi]
+    if ciclo is not None:
+        return [k for k in ([NO_DATE] if NO_DATE in parts else []) + keys
+                if parts[k].get("ciclo_min") is not None and parts[k]["ciclo_min"] <= ciclo <= parts[k]["ciclo_max"]]
+    if last_months is not None:
+        return keys[-last_months:]
+    return ([NO_DATE] if NO_DATE in parts else []) + keys
+
+
+class PartitionedDataset:
+    """
+    Unione delle partizioni richieste, con la stessa interfaccia di Dataset per le
+    pagine (df, view, search, sep). `parts` dice da quale file viene ogni riga:
+    modifiche e controlli di concorrenza si fanno sul CSV della singola partizione.
+    """
+
+    def __init__(self, filename: str, keys: list[str], datasets: list):
+        self.filename = filename
+        self.keys = keys
+        self.datasets = datasets
+        self.sep = datasets[0].sep
+        self.df = concat_typed([d.df for d in datasets]) if len(datasets) > 1 else datasets[0].df
+        starts = [0]
+        for d in datasets[:-1]:
+            starts.append(starts[-1] + len(d.df))
+        self.parts = [(d.filename, s, len(d.df), d.version, d.journal_version) for d, s in zip(datasets, starts)]
+        self.version = tuple(d.version for d in datasets)
+        self.journal_version = tuple(d.journal_version for d in datasets)
+        self.journal_entries = sum(d.journal_entries for d in datasets)
+        self._view: pd.DataFrame | None = None
+        self._search: SearchIndex | None = None
+        self._rollup: pd.DataFrame | None = None
+
+    @property
+    def view(self) -> pd.DataFrame:
+        if self._view is None:
+            self._view = normalize_time_columns(self.df.copy())
+        return self._view
+
+    @property
+    def search(self) -> SearchIndex:
+        if self._search is None:
+            self._search = SearchIndex(self.df)
+        return self._search
+
+    @property
+    def rollup(self) -> pd.DataFrame:
+        """Unione dei riepiloghi delle partizioni (ognuno aggiornato per differenza)."""
+        if self._rollup is None:
+            self._rollup = merge_rollups([d.rollup for d in self.datasets])
+        return self._rollup
+
+
+_combined: dict[tuple, PartitionedDataset] = {}
+
+def load_partitions(filename: str, keys: list[str], ftp=None) -> PartitionedDataset | None:
+    """
+    Scarica/rivalida solo le partizioni `keys` (cache per file) e le unisce. Senza
+    una connessione passata le partizioni (con i loro journal) arrivano in parallelo.
+    """
+    manifest = get_manifest(filename, ftp)
+    files = [manifest["partitions"][k]["file"] for k in keys if k in manifest["partitions"]]
+    if ftp is None:
+        loaded = ftp_parallel([lambda f=f: get_dataset(f) for f in files])
+    else:
+        loaded = [get_dataset(f, ftp) for f in files]
+    datasets = [d for d in loaded if d is not None]
+    if not datasets:
+        return None
+    ck = (filename, tuple(id(d) for d in datasets))
+    with _lock:
+        pds = _combined.get(ck)
+    if pds is None:
+        pds = PartitionedDataset(filename, keys, datasets)
+        with _lock:
+            _combined[ck] = pds
+            while len(_combined) > MAX_COMBINED:
+                _combined.pop(next(iter(_combined)))
+    return pds
+
+def load_dataset(filename: str = REMOTE_FILE, ftp=None, **selection):
+    """
+    Dataset per le pagine: il file unico se non è stato migrato, altrimenti le sole
+    partizioni scelte da select_partitions(**selection).
+    """
+    manifest = get_manifest(filename, ftp)
+    if manifest is None:
+        return get_dataset(filename, ftp)
+    return load_partitions(filename, select_partitions(manifest, **selection), ftp)
+
+def duplicate_indexes(filename: str, rows: pd.DataFrame, ftp=None) -> list[DuplicateIndex]:
+    """
+    Indici dei duplicati per controllare `rows`: il file unico, oppure le partizioni dei
+    mesi delle loro DATA e dei loro CICLO_NR più quelle del periodo di default (per i
+    NUMERO_PRG, che nell'archivio mensile si controllano solo sui mesi recenti).
+    """
+    manifest = get_manifest(filename, ftp)
+    if manifest is None:
+        ds = get_dataset(filename, ftp)
+        return [] if ds is None else [ds.dupes]
+    keys = set(select_partitions(manifest))
+    days = to_datetime_safe(rows["DATA"].astype(object).replace("", None)).dropna() if "DATA" in rows else []
+    for day in {d.date() for d in days}:
+        keys.update(select_partitions(manifest, day=day))
+    cicli = pd.to_numeric(rows["CICLO_NR"], errors="coerce").dropna() if "CICLO_NR" in rows else []
+    for c in {int(c) for c in cicli}:
+        keys.update(select_partitions(manifest, ciclo=c))
+    ds = load_partitions(filename, sorted(keys), ftp)
+    return [] if ds is None else [d.dupes for d in ds.datasets]
+
+
+# ---------- PRECARICAMENTO ----------
+# Subito dopo il login il dataset (o le partizioni del periodo di default) si scarica
+# in background: la pagina disegna intanto i suoi widget e lo trova già in cache.
+_prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prd-prefetch")
+_inflight: dict[tuple, Future] = {}
+
+def prefetch_dataset(filename: str = REMOTE_FILE, **selection) -> Future:
+    """Avvia load_dataset in background (una sola volta per richiesta in corso)."""
+    key = (filename, tuple(sorted(selection.items())))
+    with _lock:
+        fut = _inflight.get(key)
+        if fut is None or fut.done():
+            fut = _inflight[key] = _prefetcher.submit(_prefetch, filename, selection)
+    return fut
+
+def _prefetch(filename: str, selection: dict):
+    with run("Precaricamento", file=filename):
+        ds = load_dataset(filename, **selection)
+        for d in getattr(ds, "datasets", [ds] if ds is not None else []):
+            d.dupes   # indici dei duplicati pronti per il primo invio dalla Scrittura
+        return ds
@@ -0,0 +1,75 @@
+import pandas as pd
+
+# Dimensioni dei riepiloghi (una riga per combinazione presente nei dati)
+DIMS = ["DATA", "MACCHINA", "OPERATORE", "FASE", "CODICE_MATERIALE"]
+# Misure additive: minuti totali, righe registrate (i cicli distinti non si sommano
+# tra combinazioni diverse: si contano sulle righe, vedi exports)
+MEASURES = ["TEMPO_MIN", "RIGHE"]
+
+
+# ---------- RIEPILOGHI (aggiornati per differenza: righe accodate o modificate) ----------
+# Il riepilogo è un DataFrame indicizzato sulle DIMS (testo, DATA come 'YYYY-MM-DD',
+# '' per i vuoti) con le MEASURES: essendo somme, righe nuove si aggiungono e righe
+# modificate si tolgono con i vecchi valori e si riaggiungono con i nuovi.
+def aggregate(df: pd.DataFrame) -> pd.DataFrame:
+    """Riepilogo delle righe di un frame tipizzato."""
+    keys = {}
+    for c in DIMS:
+        if c not in df.columns:
+            keys[c] = pd.Series("", index=df.index)
+        elif pd.api.types.is_datetime64_any_dtype(df[c]):
+            keys[c] = df[c].dt.strftime("%Y-%m-%d").fillna("")
+        else:
+            keys[c] = df[c].astype("string").fillna("").astype(object)
+    g = pd.DataFrame(keys)
+    g["TEMPO_MIN"] = pd.to_numeric(df["TEMPO_FASE_MIN"], errors="coerce").fillna(0).astype("int64") \
+        if "TEMPO_FASE_MIN" in df.columns else 0
+    g["RIGHE"] = 1
+    return g.groupby(DIMS, sort=False)[MEASURES].sum()
+
+def combine(base: pd.DataFrame, add: pd.DataFrame | None = None, remove: pd.DataFrame | None = None) -> pd.DataFrame:
+    """base + add - remove, senza le combinazioni rimaste senza righe."""
+    out = base
+    if remove is not None and len(remove):
+        out = out.sub(remove, fill_value=0)
+    if add is not None and len(add):
+        out = out.add(add, fill_value=0)
+    if out is base:
+        return base
+    return out[out["RIGHE"] > 0].astype("int64")
+
+def merge_rollups(rollups: list[pd.DataFrame]) -> pd.DataFrame:
+    """Riepilogo di più file (partizioni mensili)."""
+    if len(rollups) == 1:
+        return rollups[0]
+    return pd.concat(rollups).groupby(level=DIMS, sort=False).sum()
+
+def rollup_after_patches(rollup: pd.DataFrame, before: pd.DataFrame, after: pd.DataFrame,
+                         entries: list[dict]) -> pd.DataFrame:
+    """Riepilogo aggiornato dopo le modifiche del journal: solo le righe toccate si ricalcolano."""
+    rows = sorted({e["row"] for e in entries if 0 <= e["row"] < len(after)})
+    if not rows:
+        return rollup
+    return combine(rollup, add=aggregate(after.iloc[rows]), remove=aggregate(before.iloc[rows]))
+
+
+def query(rollup: pd.DataFrame, start: str | None = None, end: str | None = None,
+          where: dict[str, list[str]] | None = None) -> pd.DataFrame:
+    """Righe del riepilogo (colonne DIMS + MEASURES) in un intervallo di DATA e con i valori scelti."""
+    r = rollup.reset_index()
+    mask = pd.Series(True, index=r.index)
+    if start:
+        mask &= r["DATA"] >= start
+    if end:
+        mask &= (r["DATA"] <= end) & (r["DATA"] != "")
+    for c, vals in (where or {}).items():
+        if vals:
+            mask &= r[c].isin(vals)
+    return r[mask]
+
+def pivot(rows: pd.DataFrame, index: str, columns: str | None = None, measure: str = "TEMPO_MIN") -> pd.DataFrame:
+    """Tabella pivot di una misura; "MEDIA_MIN" = minuti medi per riga."""
+    keys = [index] + ([columns] if columns and columns != index else [])
+    g = rows.groupby(keys)[MEASURES].sum()
+    val = (g["TEMPO_MIN"] / g["RIGHE"]).round(1) if measure == "MEDIA_MIN" else g[measure]
+    return val.unstack(fill_value=0) if len(keys) > 1 else val.to_frame(measure)
@@ -0,0 +1,130 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .tracing import traced
+
+# Lunghezza dei gram dell'indice invertito (testi cercati più corti: si scorrono i valori distinti)
+NGRAM = 3
+# Segmenti di righe accodate oltre i quali l'indice si ricostruisce in un pezzo solo
+MAX_SEGMENTS = 8
+
+
+# ---------- INDICE DI RICERCA (uno per versione del dataset) ----------
+class _Postings:
+    """Righe raggruppate per valore distinto di una colonna (codici di pd.factorize)."""
+
+    def __init__(self, ser: pd.Series, lower: bool = False):
+        self.codes, uniq = pd.factorize(ser, use_na_sentinel=True)
+        # minuscolo sui soli valori distinti (forme diverse dello stesso testo restano voci separate)
+        self.values = [str(v).lower() for v in uniq] if lower else list(uniq)
+        self.order = np.argsort(self.codes, kind="stable")
+        # righe del valore i = order[starts[i]:starts[i+1]] (i NA, codice -1, restano in testa)
+        self.starts = np.searchsorted(self.codes, np.arange(len(self.values) + 1), sorter=self.order)
+
+    def rows(self, ids) -> np.ndarray:
+        ids = np.asarray(sorted(ids), dtype="int64")
+        if len(ids) == 0:
+            return np.empty(0, dtype="int64")
+        if len(ids) > len(self.values) // 8:
+            return np.flatnonzero(np.isin(self.codes, ids))
+        return np.sort(np.concatenate([self.order[self.starts[i]:self.starts[i + 1]] for i in ids]))
+
+
+class _TextIndex:
+    """Valori distinti in minuscolo + indice invertito per trigrammi sui valori distinti."""
+
+    def __init__(self, ser: pd.Series):
+        self.postings = _Postings(ser, lower=True)
+        self.grams: dict[str, set[int]] = {}
+        for i, v in enumerate(self.postings.values):
+            for j in range(len(v) - NGRAM + 1):
+                self.grams.setdefault(v[j:j + NGRAM], set()).add(i)
+
+    def contains(self, text: str) -> np.ndarray:
+        q = text.lower()
+        values = self.postings.values
+        if len(q) < NGRAM:
+            ids = [i for i, v in enumerate(values) if q in v]
+        else:
+            sets = sorted((self.grams.get(q[j:j + NGRAM], set()) for j in range(len(q) - NGRAM + 1)), key=len)
+            ids = set.intersection(*sets) if sets[0] else set()
+            ids = [i for i in ids if q in values[i]]   # i trigrammi dicono solo "forse"
+        return self.postings.rows(ids)
+
+
+class SearchIndex:
+    """
+    Filtri della Lettura/Modifica senza scansioni del DataFrame: ogni filtro
+    restituisce le posizioni delle righe, che poi si intersecano. Gli indici
+    delle singole colonne si costruiscono al primo uso, per segmenti di righe:
+    dopo un append (righe solo in coda) i segmenti già costruiti si riusano e
+    si indicizzano solo le righe nuove.
+    """
+
+    def __init__(self, df: pd.DataFrame, prev: "SearchIndex | None" = None):
+        self._df = df
+        self._lock = threading.Lock()
+        n = len(df)
+        if prev is not None and prev._n <= n and len(prev._bounds) < MAX_SEGMENTS:
+            self._bounds = prev._bounds + ([(prev._n, n)] if n > prev._n else [])
+            with prev._lock:
+                self._text = {c: dict(segs) for c, segs in prev._text.items()}
+                self._exact = {c: dict(segs) for c, segs in prev._exact.items()}
+        else:
+            self._bounds = [(0, n)]
+            self._text: dict[str, dict[int, _TextIndex]] = {}
+            self._exact: dict[str, dict[int, tuple[_Postings, dict]]] = {}
+        self._n = n
+
+    def _segments(self, store: dict, col: str, build) -> list[tuple[int, object]]:
+        with self._lock:
+            segs = store.setdefault(col, {})
+            for a, b in self._bounds:
+                if a not in segs:
+                    segs[a] = build(self._df[col].iloc[a:b])
+            return [(a, segs[a]) for a, _ in self._bounds]
+
+    def contains(self, col: str, text: str) -> np.ndarray | None:
+        """Righe in cui col contiene text (senza distinzione di maiuscole); None se la colonna manca."""
+        if col not in self._df.columns:
+            return None
+        segs = self._segments(self._text, col, _TextIndex)
+        return np.concatenate([ix.contains(text) + a for a, ix in segs])
+
+    def equals(self, col: str, value) -> np.ndarray | None:
+        """Righe con col == value (CICLO_NR anche come testo, DATA come data); None se la colonna manca."""
+        if col not in self._df.columns:
+            return None
+        segs = self._segments(self._exact, col, _exact_postings)
+        key = _key(value)
+        return np.concatenate([p.rows([keys[key]] if key in keys else []) + a for a, (p, keys) in segs])
+
+    @traced("filtri", lambda out, self, *a, **k: {"rows": None if out is None else len(out)})
+    def query(self, contains: dict | None = None, equals: dict | None = None) -> np.ndarray | None:
+        """Intersezione dei filtri non vuoti; None se nessun filtro è attivo."""
+        parts = [self.contains(c, t) for c, t in (contains or {}).items() if t]
+        parts += [self.equals(c, v) for c, v in (equals or {}).items() if v is not None and v != ""]
+        parts = sorted((p for p in parts if p is not None), key=len)
+        if not parts:
+            return None
+        rows = parts[0]
+        for p in parts[1:]:
+            rows = np.intersect1d(rows, p, assume_unique=True)
+        return rows
+
+
+def _exact_postings(ser: pd.Series) -> tuple[_Postings, dict]:
+    p = _Postings(ser)
+    return p, {_key(v): i for i, v in enumerate(p.values)}
+
+def _key(v):
+    """Chiave di confronto: interi come testo (CICLO_NR esatto come prima), date come Timestamp."""
+    if isinstance(v, str):
+        return v.strip()
+    if isinstance(v, (int, np.integer)) and not isinstance(v, bool):
+        return str(int(v))
+    if isinstance(v, np.datetime64) or hasattr(v, "isoformat"):
+        return pd.Timestamp(v)
+    return v
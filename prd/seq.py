@@ -0,0 +1,119 @@
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from .cache import get_dataset
+from .config import REMOTE_FILE
+from .ftp import ftp_download_file, ftp_file_exists_and_size, ftp_run, ftp_upload_file
+from .lease import write_lease
+from .partitions import get_manifest
+
+# Validità del suggerimento in memoria: entro questo intervallo nessun accesso FTP
+SUGGEST_TTL = 30
+# Lease del contatore: una prenotazione dura pochi comandi
+SEQ_LEASE_SEC = 15
+
+
+# ---------- SEQUENZA CICLO_NR ----------
+def max_ciclo_nr(df: pd.DataFrame) -> int:
+    if df is None or df.empty or "CICLO_NR" not in df.columns:
+        return 0
+    m = pd.to_numeric(df["CICLO_NR"], errors="coerce").max()
+    return int(m) if pd.notna(m) else 0
+
+
+class CicloSequence:
+    """
+    Allocatore di CICLO_NR basato su un file contatore accanto al CSV
+    ("<file>.seq" = "ultimo;size_csv;token").
+    Se il contatore manca o il CSV è cresciuto senza aggiornarlo, si riallinea
+    al massimo CICLO_NR del dataset in cache (sincronizzato in coda).
+    Il contatore si scrive solo sotto il lease "<file>.seq.lockdir" (MKD atomico):
+    due processi non possono riservare lo stesso blocco. Dimensione e massimo dei dati
+    (che possono richiedere il download del CSV) si calcolano prima di prendere il
+    lease: sotto il lease restano solo lettura e scrittura del contatore.
+    """
+
+    def __init__(self, filename: str = REMOTE_FILE):
+        self.filename = filename
+        self.seq_name = f"{filename}.seq"
+        self._lock = threading.Lock()
+        self._last: int | None = None
+        self._read_at = 0.0
+
+    def _read(self, ftp) -> tuple[int, int, str] | None:
+        data = ftp_download_file(ftp, self.seq_name)
+        if not data:
+            return None
+        try:
+            last, size, token = data.decode("ascii").strip().split(";")
+            return int(last), int(size), token
+        except Exception:
+            return None
+
+    def _write(self, ftp, last: int, size: int) -> bool:
+        """Scrive il contatore (sotto lease) e lo rilegge: False se qualcuno ha scritto nel frattempo
+        (lease scaduto e preso da altri)."""
+        token = uuid.uuid4().hex[:12]
+        ftp_upload_file(ftp, self.seq_name, f"{last};{size};{token}\n".encode("ascii"))
+        cur = self._read(ftp)
+        return cur is not None and cur[2] == token
+
+    def _size_and_max(self, ftp) -> tuple:
+        """Dimensione dei dati (file unico o somma delle partizioni) e calcolo del massimo CICLO_NR."""
+        manifest = get_manifest(self.filename, ftp)
+        if manifest is None:
+            _, size = ftp_file_exists_and_size(ftp, self.filename)
+            return size, lambda: max_ciclo_nr(getattr(get_dataset(self.filename, ftp), "df", None))
+        parts = manifest["partitions"].values()
+        return (sum(p.get("bytes", 0) for p in parts),
+                lambda: max([p["ciclo_max"] for p in parts if p.get("ciclo_max") is not None] or [0]))
+
+    def _current(self, ftp) -> int:
+        """Ultimo CICLO_NR usato (contatore, o massimo dei dati se assente o non allineato).
+        Non scrive: il contatore si riallinea alla prossima prenotazione, sotto lease."""
+        size, data_max = self._size_and_max(ftp)
+        cur = self._read(ftp)
+        if cur is not None and cur[1] == size:
+            return cur[0]
+        return max(cur[0] if cur else 0, data_max())
+
+    def suggest(self) -> int:
+        """Prossimo CICLO_NR da proporre nel form (senza riservarlo)."""
+        with self._lock:
+            if self._last is None or time.monotonic() - self._read_at > SUGGEST_TTL:
+                self._last = ftp_run(self._current)
+                self._read_at = time.monotonic()
+            return self._last + 1
+
+    def reserve(self, ciclo_nr: int | None = None, count: int = 1) -> int:
+        """
+        Riserva un CICLO_NR al momento dell'invio: il prossimo libero se ciclo_nr
+        è None, altrimenti quello richiesto (il contatore avanza se serve).
+        Con count > 1 riserva il blocco n..n+count-1 e restituisce n.
+        """
+        def _reserve(ftp):
+            size, data_max = self._size_and_max(ftp)
+            seen = self._read(ftp)
+            floor = data_max() if seen is None or seen[1] != size else 0   # contatore da riallineare
+            with write_lease(ftp, self.seq_name, ttl=SEQ_LEASE_SEC):
+                cur = self._read(ftp)
+                last = max(cur[0] if cur else 0, floor)
+                n = last + 1 if ciclo_nr is None else int(ciclo_nr)
+                if self._write(ftp, max(last, n + count - 1), size):
+                    return n, max(last, n + count - 1)
+            raise RuntimeError("Impossibile riservare CICLO_NR: contatore conteso, riprova.")
+
+        with self._lock:
+            n, self._last = ftp_run(_reserve)
+            self._read_at = time.monotonic()
+            return n
+
+    def invalidate(self):
+        with self._lock:
+            self._last = None
+
+
+ciclo_sequence = CicloSequence()
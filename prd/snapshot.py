@@ -0,0 +1,73 @@
+import base64
+import io
+import json
+from ftplib import FTP, error_perm
+
+import pandas as pd
+
+from .ftp import ftp_download_file, ftp_upload_file
+
+try:
+    import pyarrow  # noqa: F401  (motore Parquet di pandas)
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+# Byte di CSV accodati dopo lo snapshot oltre i quali conviene riscriverlo
+SNAPSHOT_REFRESH_BYTES = 512 * 1024
+
+
+# ---------- SNAPSHOT TIPIZZATO (Parquet) ----------
+# "<file>.parquet" contiene il DataFrame tipizzato dei primi csv_offset byte del CSV
+# (modifiche del journal comprese, riapplicarle è innocuo); "<file>.parquet.json"
+# dice fin dove arriva, gli ultimi byte coperti e la generazione del CSV (sidecar
+# ".ver"), per verificare che non sia stato riscritto e scaricarne solo la coda.
+def snapshot_names(filename: str) -> tuple[str, str]:
+    return f"{filename}.parquet", f"{filename}.parquet.json"
+
+def read_snapshot(ftp: FTP, filename: str) -> tuple[pd.DataFrame, dict] | None:
+    if not HAS_PARQUET:
+        return None
+    pq_name, meta_name = snapshot_names(filename)
+    raw_meta = ftp_download_file(ftp, meta_name)
+    if not raw_meta:
+        return None
+    try:
+        meta = json.loads(raw_meta.decode("utf-8"))
+        meta["header"] = base64.b64decode(meta["header"])
+        meta["tail"] = base64.b64decode(meta["tail"])
+    except (ValueError, KeyError):
+        return None
+    data = ftp_download_file(ftp, pq_name)
+    if not data:
+        return None
+    df = pd.read_parquet(io.BytesIO(data))
+    if len(df) != meta.get("rows"):
+        return None   # parquet e meta di due scritture diverse
+    return df, meta
+
+def write_snapshot(ftp: FTP, ds) -> bool:
+    """Salva lo snapshot del Dataset in cache; False se Parquet non è disponibile."""
+    if not HAS_PARQUET:
+        return False
+    buf = io.BytesIO()
+    ds.df.to_parquet(buf, index=False)
+    meta = {
+        "csv_offset": ds.synced,
+        "rows": len(ds.df),
+        "sep": ds.sep,
+        "header": base64.b64encode(ds.header).decode("ascii"),
+        "tail": base64.b64encode(ds.tail).decode("ascii"),
+        "gen": ds.gen,
+    }
+    pq_name, meta_name = snapshot_names(ds.filename)
+    ftp_upload_file(ftp, pq_name, buf.getvalue())
+    ftp_upload_file(ftp, meta_name, json.dumps(meta).encode("utf-8"))
+    return True
+
+def drop_snapshot(ftp: FTP, filename: str):
+    """Invalida lo snapshot (prima di riscrivere il CSV): basta togliere il meta."""
+    try:
+        ftp.delete(snapshot_names(filename)[1])
+    except error_perm:
+        pass
@@ -0,0 +1,75 @@
+import importlib
+import os
+import threading
+import time
+
+from .tracing import add_run, log_error
+
+# Moduli pesanti importati in background al primo avvio (pandas e pyarrow soprattutto):
+# la schermata di login non li aspetta e dopo il login sono già in memoria
+WARM_MODULES = ["pandas", "prd.data", "prd.cache", "prd.partitions", "prd.store", "prd.outbox",
+                "prd.cards", "prd.edits", "prd.exports", "prd.importer", "prd.rollups", "prd.dupes"]
+
+
+# ---------- AVVIO DEL PROCESSO (preriscaldamento e tempi) ----------
+# Tempi in secondi dall'avvio del processo: primo script, schermata di login, import
+# pesanti, dataset in cache, prima pagina dopo il login. Ogni tappa vale la prima volta.
+def _process_start() -> float:
+    """Avvio del processo (epoch) da /proc; fuori da Linux l'import di questo modulo."""
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - started)
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+_T0 = _process_start()
+_lock = threading.Lock()
+_marks: dict[str, float] = {}
+_started = False
+
+
+def mark(name: str):
+    """Registra la tappa `name` (solo la prima volta); alla prima pagina il resoconto va nel log."""
+    with _lock:
+        if name in _marks:
+            return
+        _marks[name] = round(time.time() - _T0, 3)
+        done = name == "prima pagina"
+    if done:
+        rep = report()
+        add_run("Avvio", rep["prima pagina"] * 1000,
+                [{"name": k, "ms": round(v * 1000, 1), "thread": "avvio"} for k, v in rep.items()])
+
+def report() -> dict[str, float]:
+    """Tappe dell'avvio raggiunte finora (secondi dall'avvio del processo), in ordine."""
+    with _lock:
+        return dict(sorted(_marks.items(), key=lambda kv: kv[1]))
+
+def warm_up(filename: str):
+    """
+    Una volta per processo, dal primo script (anche prima del login): import pesanti,
+    coda di invio e precaricamento del dataset su un thread a parte.
+    """
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    mark("primo script")
+    threading.Thread(target=_warm, args=(filename,), name="prd-warmup", daemon=True).start()
+
+def _warm(filename: str):
+    try:
+        for m in WARM_MODULES:
+            importlib.import_module(m)
+        mark("import")
+        from .outbox import outbox
+        from .partitions import prefetch_dataset
+        outbox.start()
+        prefetch_dataset(filename).result()
+        mark("dati in cache")
+    except Exception as e:
+        log_error("Avvio", e)
@@ -0,0 +1,409 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ftplib import FTP
+
+import pandas as pd
+
+from .backup import backup_file
+from .cache import cached_dataset, get_dataset, invalidate_dataset, set_snapshot_offset
+from .config import REMOTE_FILE
+from .data import serialize_row, sniff_separator_from_bytes, type_frame
+from .edits import edit_frame
+from .ftp import (ftp_download_file, ftp_file_exists_and_size, ftp_read_head, ftp_remote_version,
+                  ftp_run, ftp_upload_file)
+from .journal import (JOURNAL_COMPACT_AT, append_patches, journal_name, make_patch,
+                      parse_journal, rewrite_csv)
+from .lease import read_version, replace_file, wait_for_lease, write_lease
+from .partitions import (forget_manifest, get_manifest, manifest_name, merge_stats, month_keys,
+                         partition_name, partition_stats, read_manifest, write_manifest)
+from .seq import ciclo_sequence
+from .snapshot import SNAPSHOT_REFRESH_BYTES, drop_snapshot, write_snapshot
+from .tracing import log_error, span
+
+
+# Byte massimi letti per trovare la riga di intestazione
+HEADER_MAX_BYTES = 8192
+# Lease della migrazione all'archivio mensile (copia di tutto lo storico)
+MIGRATION_LEASE_SEC = 600
+
+_schema_lock = threading.Lock()
+_schemas: dict[str, tuple[int, list[str], str, bool]] = {}   # filename -> (size, colonne, sep, header con a capo)
+
+
+# ---------- append sicuro via FTP ----------
+def ftp_backup_file(ftp: FTP, filename: str, data: bytes | None = None):
+    """Backup giornaliero prima di una scrittura: un errore di backup non blocca il salvataggio."""
+    try:
+        backup_file(ftp, filename, data)
+    except Exception as e:
+        log_error(f"backup {filename}", e)
+
+
+def read_remote_schema(ftp: FTP, filename: str, size: int) -> tuple[list[str], str, bool]:
+    """
+    Colonne e separatore del file remoto leggendo solo la riga di intestazione
+    (RETR interrotto). Il risultato resta valido finché SIZE è quella attesa.
+    """
+    with _schema_lock:
+        cached = _schemas.get(filename)
+    if cached and cached[0] == size:
+        return cached[1], cached[2], cached[3]
+
+    head = ftp_read_head(ftp, filename, max_bytes=HEADER_MAX_BYTES)
+    terminated = bool(head) and head.endswith(b"\n")
+    if not head or not (terminated or len(head) == size):
+        raise RuntimeError("Header esistente non leggibile. Append annullato per evitare corruzioni.")
+    sep = sniff_separator_from_bytes(head, default=";")
+    cols = [c.strip() for c in head.decode("utf-8", "ignore").rstrip("\r\n").split(sep)]
+
+    with _schema_lock:
+        _schemas[filename] = (size, cols, sep, terminated)
+    return cols, sep, terminated
+
+
+def append_rows_safe_via_ftp(ftp: FTP, filename: str, rows: list[dict], preferred_columns: list[str] = None,
+                             before_append=None):
+    """
+    Accoda più righe con un solo APPE (solo l'header viene letto dal server).
+    before_append(size, payload), se passato, viene chiamato subito prima della
+    scrittura con la SIZE remota di partenza e i byte che verranno aggiunti.
+    L'APPE non prende lock: aspetta solo una riscrittura altrui in corso (lease).
+    """
+    if not rows:
+        return
+    exists, size = ftp_file_exists_and_size(ftp, filename)
+
+    if not exists or size == 0:
+        with write_lease(ftp, filename):   # due operatori che creano lo stesso file (nuovo mese)
+            if read_manifest(ftp, filename) is not None:
+                # file unico appena suddiviso per mese (manifest in cache non aggiornato)
+                forget_manifest(filename)
+                return append_production_rows(ftp, filename, rows, preferred_columns, before_append)
+            exists, size = ftp_file_exists_and_size(ftp, filename)
+            if not exists or size == 0:
+                cols = preferred_columns or list(rows[0].keys())
+                sep = ";"
+                header = (sep.join(cols) + "\n").encode("utf-8")
+                lines  = "".join(serialize_row(cols, row, sep) for row in rows).encode("utf-8")
+                if before_append:
+                    before_append(0, header + lines)
+                ftp_upload_file(ftp, filename, header + lines)
+                invalidate_dataset(filename)
+                return
+
+    ftp_backup_file(ftp, filename)
+    if wait_for_lease(ftp, filename):
+        # riscrittura appena finita: SIZE e intestazione vanno riletti
+        return append_rows_safe_via_ftp(ftp, filename, rows, preferred_columns, before_append)
+
+    cols, sep, terminated = read_remote_schema(ftp, filename, size)
+    for row in rows:
+        for c in cols:
+            row.setdefault(c, "")
+
+    payload = ("" if terminated else "\n") + "".join(serialize_row(cols, row, sep) for row in rows)
+    payload = payload.encode("utf-8")
+    if before_append:
+        before_append(size, payload)
+    with span("ftp.append", file=filename, bytes=len(payload)):
+        ftp.storbinary(f"APPE {filename}", io.BytesIO(payload))
+    with _schema_lock:
+        _schemas[filename] = (size + len(payload), cols, sep, True)
+    invalidate_dataset(filename, drop=False)
+    maybe_write_snapshot(filename)
+
+
+def append_row_safe_via_ftp(ftp: FTP, filename: str, row: dict, preferred_columns: list[str] = None):
+    append_rows_safe_via_ftp(ftp, filename, [row], preferred_columns)
+
+
+def append_production_rows(ftp: FTP, filename: str, rows: list[dict], preferred_columns: list[str] = None,
+                           before_append=None):
+    """
+    Accoda righe di produzione: sul file unico, oppure (archivio mensile) con un
+    APPE per ogni partizione toccata, aggiornando conteggi e intervalli nel manifest.
+    Gli APPE vanno in parallelo con gli altri operatori; solo la riscrittura del
+    manifest (breve) passa dal suo lease.
+    before_append vale solo se tutte le righe vanno sulla stessa partizione.
+    """
+    if not rows:
+        return
+    manifest = get_manifest(filename, ftp)
+    if manifest is None:
+        return append_rows_safe_via_ftp(ftp, filename, rows, preferred_columns, before_append)
+    keys = month_keys(pd.Series([r.get("DATA", "") for r in rows], dtype=object).astype(str))
+    groups: dict[str, list[dict]] = {}
+    for key, row in zip(keys, rows):
+        groups.setdefault(key, []).append(row)
+    if before_append and len(groups) > 1:
+        raise ValueError("before_append richiede righe di una sola partizione.")
+
+    files = {key: (manifest["partitions"].get(key) or {}).get("file") or partition_name(filename, key)
+             for key in groups}
+    stats = {}
+    for key, grp in groups.items():
+        stats[key] = partition_stats(type_frame(pd.DataFrame(grp)))
+        append_rows_safe_via_ftp(ftp, files[key], grp, manifest["columns"], before_append)
+
+    with write_lease(ftp, manifest_name(filename)):
+        manifest = read_manifest(ftp, filename)   # ultima versione: il manifest si riscrive intero
+        for key in groups:
+            entry = manifest["partitions"].get(key) or {"file": files[key], "rows": 0}
+            entry = merge_stats(entry, stats[key])
+            entry["bytes"] = ftp_file_exists_and_size(ftp, entry["file"])[1]
+            manifest["partitions"][key] = entry
+        write_manifest(ftp, filename, manifest)
+
+
+def append_target(filename: str, row: dict, ftp: FTP = None) -> str:
+    """File su cui finisce la riga: il file unico o la partizione del mese di DATA."""
+    if get_manifest(filename, ftp) is None:
+        return filename
+    return partition_name(filename, month_keys(pd.Series([str(row.get("DATA", ""))], dtype=object)).iloc[0])
+
+
+# ---------- modifiche via journal ----------
+def save_row_changes(ftp: FTP, filename: str, changes: list[tuple[int, str, dict]], user: str | None = None):
+    """
+    Registra le modifiche [(posizione riga, Timestamp, {colonna: valore}), ...]
+    nel journal con un solo APPE; il CSV non viene riscritto. Oltre
+    JOURNAL_COMPACT_AT modifiche pendenti la compattazione parte in background.
+    """
+    wait_for_lease(ftp, filename)   # compattazione in corso: il journal sta per essere svuotato
+    append_patches(ftp, filename, [make_patch(row, ts, vals, user) for row, ts, vals in changes])
+    invalidate_dataset(filename, drop=False)
+    maybe_compact_journal(filename)
+
+
+def check_rows_unchanged(ftp: FTP, filename: str, version, jversion, base):
+    """
+    Controllo ottimistico prima di salvare modifiche calcolate sulla versione
+    (version, jversion) di CSV e journal: se SIZE/MDTM sono ancora quelle non
+    serve altro, altrimenti le righe di `base` (edit_frame delle righe toccate)
+    devono avere ancora gli stessi valori.
+    """
+    if (ftp_remote_version(ftp, filename) == version
+            and ftp_remote_version(ftp, journal_name(filename)) == jversion):
+        return
+    invalidate_dataset(filename, drop=False)
+    ds = get_dataset(filename, ftp)
+    n = len(ds.df) if ds is not None else 0
+    rows = [r for r in base.index if r < n]
+    cur = edit_frame(ds.df, rows).reindex(base.index) if rows else base.iloc[0:0].reindex(base.index)
+    stale = base.index[cur.ne(base).any(axis=1)]
+    if len(stale):
+        raise RuntimeError(f"Righe {', '.join(map(str, stale[:20]))} cambiate da un altro utente dopo il "
+                           "caricamento: ricarica la ricerca e riprova.")
+
+
+def _by_part(parts: list[tuple], rows) -> list[tuple[tuple, list[int]]]:
+    """Righe (posizioni nel dataset) raggruppate per file di origine."""
+    out = []
+    for part in parts:
+        _, start, n, _, _ = part
+        mine = [r for r in rows if start <= r < start + n]
+        if mine:
+            out.append((part, mine))
+    return out
+
+
+def save_dataset_changes(ftp: FTP, parts: list[tuple], changes: list[tuple[int, str, dict]], user: str | None = None,
+                         filename: str = REMOTE_FILE):
+    """save_row_changes sul journal di ciascun file (partizione) toccato; posizioni da ds.parts.
+    Nell'archivio mensile i nuovi CICLO_NR allargano gli intervalli del manifest."""
+    by_row = {row: (ts, vals) for row, ts, vals in changes}
+    cicli: dict[str, list[int]] = {}
+    for (fname, start, _, _, _), rows in _by_part(parts, list(by_row)):
+        save_row_changes(ftp, fname, [(r - start, *by_row[r]) for r in rows], user)
+        cicli[fname] = [int(by_row[r][1]["CICLO_NR"]) for r in rows if by_row[r][1].get("CICLO_NR") not in (None, "")]
+    _widen_ciclo_ranges(ftp, filename, {f: v for f, v in cicli.items() if v})
+
+
+def _widen_ciclo_ranges(ftp: FTP, filename: str, cicli: dict[str, list[int]]):
+    """
+    ciclo_min/ciclo_max delle partizioni allargati ai CICLO_NR assegnati dalle modifiche:
+    intervalli per eccesso (il vecchio numero non li restringe), così select_partitions e
+    il contatore non saltano mai la partizione che ora contiene un numero.
+    """
+    manifest = get_manifest(filename, ftp) if cicli else None
+    if manifest is None:
+        return
+    keys = {p["file"]: k for k, p in manifest["partitions"].items()}
+    stats = {keys[f]: {"rows": 0, "data_min": None, "data_max": None, "ciclo_min": min(v), "ciclo_max": max(v)}
+             for f, v in cicli.items() if f in keys}
+    if not stats:
+        return
+    with write_lease(ftp, manifest_name(filename)):
+        manifest = read_manifest(ftp, filename)   # ultima versione: il manifest si riscrive intero
+        for key, add in stats.items():
+            if key in manifest["partitions"]:
+                manifest["partitions"][key] = merge_stats(manifest["partitions"][key], add)
+        write_manifest(ftp, filename, manifest)
+
+
+def check_parts_unchanged(ftp: FTP, parts: list[tuple], base):
+    """check_rows_unchanged per ogni file di ds.parts da cui vengono le righe di base."""
+    for (fname, start, _, version, jversion), rows in _by_part(parts, list(base.index)):
+        local = base.loc[rows].set_axis(pd.Index(rows) - start, axis=0)
+        try:
+            check_rows_unchanged(ftp, fname, version, jversion, local)
+        except RuntimeError:
+            raise RuntimeError(f"Righe cambiate da un altro utente dopo il caricamento ({fname}): "
+                               "ricarica la ricerca e riprova.")
+
+
+def compact_journal(ftp: FTP, filename: str) -> int:
+    """
+    Riporta nel CSV le modifiche del journal e lo svuota; restituisce quante ne ha applicate.
+    Riscrittura contro la generazione letta (replace_file): le righe accodate al CSV e le
+    modifiche accodate al journal nel frattempo vengono riaccodate, non perse.
+    """
+    jname = journal_name(filename)
+    gen, jgen = read_version(ftp, filename)["gen"], read_version(ftp, jname)["gen"]
+    jraw = ftp_download_file(ftp, jname) or b""
+    entries, used = parse_journal(jraw)
+    raw = ftp_download_file(ftp, filename) if entries else None
+    if not raw:
+        return 0
+    raw = raw[:raw.rfind(b"\n") + 1] or raw   # riga in scrittura: arriva con la coda
+
+    payload = rewrite_csv(raw, sniff_separator_from_bytes(raw), entries)
+    ftp_backup_file(ftp, filename, raw)
+    drop_snapshot(ftp, filename)   # lo snapshot non coprirebbe le righe riscritte
+    replace_file(ftp, filename, raw, payload, gen)
+
+    # svuoto il journal tenendo le modifiche arrivate nel frattempo (riapplicarne una già
+    # compattata è innocuo); il lease è quello del CSV, che gli APPE sul journal rispettano
+    replace_file(ftp, jname, jraw[:used], b"", jgen, lease=filename)
+    invalidate_dataset(filename)
+    maybe_write_snapshot(filename, load=True)
+    return len(entries)
+
+
+# ---------- archivio mensile ----------
+def migrate_to_partitions(ftp: FTP, filename: str) -> dict:
+    """
+    Migrazione una tantum del file unico in un CSV per mese (righe copiate come
+    testo, senza ritipizzarle). Il manifest si scrive per ultimo: finché manca
+    l'app continua sul file unico, che alla fine viene rinominato, non cancellato.
+    Sotto lease: gli APPE sul file unico aspettano la fine della migrazione.
+    """
+    with write_lease(ftp, filename, ttl=MIGRATION_LEASE_SEC):
+        return _migrate_to_partitions(ftp, filename)
+
+def _migrate_to_partitions(ftp: FTP, filename: str) -> dict:
+    if read_manifest(ftp, filename) is not None:
+        raise RuntimeError("Archivio già suddiviso per mese.")
+    compact_journal(ftp, filename)   # le modifiche pendenti finiscono nelle partizioni
+    raw = ftp_download_file(ftp, filename)
+    if not raw:
+        raise RuntimeError(f"{filename} è vuoto o assente.")
+    ftp_backup_file(ftp, filename, raw)
+    sep = sniff_separator_from_bytes(raw, default=";")
+    text = pd.read_csv(io.BytesIO(raw), sep=sep, dtype=str, keep_default_na=False)
+    text.columns = [c.strip() for c in text.columns]
+    typed = type_frame(text.copy())
+    keys = month_keys(typed["DATA"]) if "DATA" in typed.columns else pd.Series("senza-data", index=text.index)
+
+    manifest = {"columns": list(text.columns), "sep": sep, "migrated_from": filename,
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "partitions": {}}
+    for key, idx in keys.groupby(keys).groups.items():
+        part = partition_name(filename, key)
+        payload = text.loc[idx].to_csv(sep=sep, index=False, lineterminator="\n").encode("utf-8")
+        ftp_upload_file(ftp, part, payload)
+        invalidate_dataset(part)
+        manifest["partitions"][key] = {"file": part, "bytes": len(payload), **partition_stats(typed.loc[idx])}
+    with write_lease(ftp, manifest_name(filename)):
+        write_manifest(ftp, filename, manifest)
+
+    _, size = ftp_file_exists_and_size(ftp, filename)
+    if size != len(raw):
+        # righe arrivate durante la migrazione: vanno nelle partizioni (il manifest ora esiste)
+        tail = pd.read_csv(io.BytesIO(raw[:raw.find(b"\n") + 1] + (ftp_download_file(ftp, filename, offset=len(raw)) or b"")),
+                           sep=sep, dtype=str, keep_default_na=False)
+        tail.columns = [c.strip() for c in tail.columns]
+        append_production_rows(ftp, filename, tail.to_dict("records"), manifest["columns"])
+    drop_snapshot(ftp, filename)
+    ftp.rename(filename, f"{filename}.pre_partizioni")
+    invalidate_dataset(filename)
+    ciclo_sequence.invalidate()
+    return manifest
+
+
+# ---------- manutenzione in background ----------
+# Snapshot e compattazione automatica girano su un thread a parte con una propria
+# connessione del pool: chi accoda una riga o salva una modifica non aspetta mai un
+# download completo, una riscrittura del CSV o l'upload del Parquet.
+_maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prd-manutenzione")
+_maintenance_lock = threading.Lock()
+_queued: set[tuple[str, str]] = set()
+
+def _in_background(job: str, filename: str, fn):
+    """fn(ftp) in background, al più un lavoro `job` in coda per file (best effort)."""
+    with _maintenance_lock:
+        if (job, filename) in _queued:
+            return
+        _queued.add((job, filename))
+
+    def _run():
+        with _maintenance_lock:
+            _queued.discard((job, filename))
+        try:
+            ftp_run(fn)
+        except Exception as e:
+            log_error(f"{job} {filename}", e)
+    _maintenance.submit(_run)
+
+def drain_maintenance(timeout: float | None = None):
+    """Attende la fine dei lavori in background, anche di quelli accodati nel frattempo
+    (una compattazione accoda lo snapshot): prima di spegnere o riallestire il server."""
+    while True:
+        _maintenance.submit(lambda: None).result(timeout)   # un solo worker: passa dopo quelli già in coda
+        with _maintenance_lock:
+            if not _queued:
+                return
+
+def _snapshot_due(ds) -> bool:
+    return ds.snapshot_offset is None or ds.synced - ds.snapshot_offset >= SNAPSHOT_REFRESH_BYTES
+
+def maybe_write_snapshot(filename: str, load: bool = False):
+    """
+    Riscrive in background lo snapshot Parquet se manca o se il CSV è cresciuto abbastanza
+    (best effort). Dopo un APPE solo per un file già in cache (si sincronizza la coda);
+    load=True carica anche un file non in cache (dopo una compattazione).
+    """
+    if not load:
+        cached = cached_dataset(filename)
+        if cached is None or not _snapshot_due(cached):
+            return
+
+    def _write(ftp):
+        ds = get_dataset(filename, ftp)
+        if ds is not None and _snapshot_due(ds) and write_snapshot(ftp, ds):
+            set_snapshot_offset(filename, ds.synced)
+    _in_background("snapshot", filename, _write)
+
+def maybe_compact_journal(filename: str):
+    """
+    Dopo un salvataggio: in background si rilegge la coda del journal e, oltre
+    JOURNAL_COMPACT_AT modifiche pendenti, si compatta. Solo per un file già in cache
+    (niente download completo fuori dal percorso di caricamento).
+    """
+    if cached_dataset(filename) is None:
+        return
+
+    def _compact(ftp):
+        ds = get_dataset(filename, ftp)
+        if ds is not None and ds.journal_entries >= JOURNAL_COMPACT_AT:
+            compact_journal(ftp, filename)
+    _in_background("compattazione", filename, _compact)
+
+
+def get_next_ciclo_nr_from_server() -> int:
+    try:
+        return ciclo_sequence.suggest()
+    except Exception as e:
+        log_error("prossimo CICLO_NR", e)
+        return 1
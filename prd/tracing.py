@@ -0,0 +1,177 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from .config import LOG_DIR
+
+# Tracciamento attivo (PRD_TRACE=0 lo spegne; da admin si cambia a runtime)
+enabled = os.environ.get("PRD_TRACE", "1") != "0"
+# Esecuzioni tenute in memoria per il pannello di diagnostica
+KEEP_RUNS = 50
+# Log JSONL a rotazione: dimensione massima di un file e file vecchi conservati
+LOG_FILE = os.path.join(LOG_DIR, "trace.jsonl")
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+
+log = logging.getLogger("prd")
+
+
+# ---------- TRACCIAMENTO (span per esecuzione di pagina) ----------
+# Un'esecuzione (run) raccoglie gli span dei passi caldi fatti nel suo contesto: FTP,
+# parsing, normalizzazione, filtri, rendering. Fuori da un run, o con il tracciamento
+# spento, span() e @traced costano un controllo e nient'altro.
+_current: contextvars.ContextVar[list | None] = contextvars.ContextVar("prd_trace", default=None)
+_runs: deque = deque(maxlen=KEEP_RUNS)
+_lock = threading.Lock()
+_writer: logging.Logger | None = None
+
+
+class _Span:
+    __slots__ = ("rec", "spans", "t0")
+
+    def __init__(self, spans: list, name: str, attrs: dict):
+        self.spans, self.rec = spans, {"name": name, **attrs}
+
+    def __enter__(self) -> dict:
+        self.t0 = time.perf_counter()
+        return self.rec
+
+    def __exit__(self, et, ev, tb):
+        self.rec["ms"] = round((time.perf_counter() - self.t0) * 1000, 2)
+        self.rec["thread"] = threading.current_thread().name
+        if et is not None and not _control_flow(et):
+            self.rec["error"] = f"{et.__name__}: {ev}"[:300]
+        self.spans.append(self.rec)
+        return False
+
+
+class _Noop:
+    def __enter__(self) -> dict:
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _Noop()
+
+def _control_flow(et) -> bool:
+    """st.rerun/st.stop passano come eccezioni: non sono errori."""
+    return any(c.__name__ == "ScriptControlException" for c in et.__mro__)
+
+def span(name: str, **attrs):
+    """Context manager che misura un passo; il dict restituito accoglie bytes/rows/..."""
+    spans = _current.get() if enabled else None
+    return _NOOP if spans is None else _Span(spans, name, attrs)
+
+def traced(name: str, measure=None):
+    """
+    Decoratore: span `name` attorno alla funzione. measure(risultato, *args, **kwargs)
+    restituisce gli attributi da registrare (byte, righe, file, ...).
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            spans = _current.get() if enabled else None
+            if spans is None:
+                return fn(*args, **kwargs)
+            with _Span(spans, name, {}) as rec:
+                out = fn(*args, **kwargs)
+                if measure is not None:
+                    try:
+                        rec.update(measure(out, *args, **kwargs))
+                    except Exception:
+                        pass   # una misura non calcolabile non deve rompere il passo
+                return out
+        return wrapper
+    return deco
+
+def in_context(fn):
+    """fn da eseguire su un altro thread (pool FTP) registrando gli span nel run corrente."""
+    if _current.get() is None:
+        return fn
+    ctx = contextvars.copy_context()
+    return lambda: ctx.run(fn)
+
+@contextmanager
+def run(label: str, **attrs):
+    """
+    Un'esecuzione (rerun di pagina, precaricamento, ...): alla fine va in memoria e nel
+    log. Dentro un run già aperto (fragment annidato) gli span finiscono in quello.
+    """
+    if not enabled or _current.get() is not None:
+        yield _current.get()
+        return
+    spans: list = []
+    token = _current.set(spans)
+    t0 = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _current.reset(token)
+        add_run(label, (time.perf_counter() - t0) * 1000, spans, **attrs)
+
+def add_run(label: str, ms: float, spans: list[dict], **attrs):
+    """Registra un'esecuzione già misurata (in memoria e nel log)."""
+    rec = {"at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "run": label, **attrs,
+           "ms": round(ms, 2), "spans": spans}
+    with _lock:
+        _runs.append(rec)
+    _write(rec)
+
+def trace_page(label: str):
+    """Decoratore per le pagine: ogni esecuzione (anche solo del fragment) è un run."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with run(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def log_error(where: str, exc: BaseException):
+    """Errore gestito (il flusso prosegue) ma da non perdere: nel run corrente, nel log e su logging."""
+    log.warning("%s: %s", where, exc, exc_info=exc)
+    rec = {"name": where, "error": f"{type(exc).__name__}: {exc}"[:300], "ms": 0.0,
+           "thread": threading.current_thread().name}
+    spans = _current.get()
+    if spans is not None:
+        spans.append(rec)
+    elif enabled:
+        _write({"at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **rec})
+
+def recent_runs() -> list[dict]:
+    """Ultime esecuzioni registrate, dalla più recente."""
+    with _lock:
+        return list(reversed(_runs))
+
+def set_enabled(on: bool):
+    global enabled
+    enabled = on
+
+
+def _write(rec: dict):
+    global _writer
+    try:
+        if _writer is None:
+            with _lock:
+                if _writer is None:
+                    os.makedirs(LOG_DIR, exist_ok=True)
+                    w = logging.getLogger("prd.trace")
+                    w.propagate = False
+                    w.setLevel(logging.INFO)
+                    h = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                            encoding="utf-8")
+                    h.setFormatter(logging.Formatter("%(message)s"))
+                    w.addHandler(h)
+                    _writer = w
+        _writer.info(json.dumps(rec, ensure_ascii=False, default=str))
+    except OSError:
+        pass   # disco non scrivibile: il tracciamento resta solo in memoria